@@ -0,0 +1,200 @@
+"""Comandos de linha de comando do backend.
+
+Importação da base de retiradas direto de arquivos locais, sem passar pelo
+servidor HTTP nem pelos limites de upload (tamanho e linhas)::
+
+    python -m app.cli catalog-import --clients 012011.csv --inventory 020220.csv
+    python -m app.cli catalog-import --inventory 020220.csv --incremental
+    python -m app.cli catalog-import --inventory 020220.csv --dry-run
+
+Usa o mesmo ``DATABASE_URL`` da API e o mesmo código de parse e gravação do
+upload. O banco já deve estar criado (ou use ``--bootstrap``).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Sequence
+
+from app.database.session import SessionLocal
+from app.models.pickup_catalog import PickupCatalogImportJob
+from app.services.equipment_allocation_state import rebuild_allocation_state
+from app.services.pickup_catalog_import import (
+    SNAPSHOT_COMMIT_ROWS,
+    import_pickup_catalog,
+    reclaim_inactive_batches,
+)
+from app.services.pickup_catalog_jobs import JOB_STATUS_QUEUED, JOB_STATUS_RUNNING
+
+
+def _safe_text(value: Any) -> str:
+    return str(value or "").strip()
+
+
+class _ProgressPrinter:
+    def __init__(self):
+        self.started_at = time.perf_counter()
+
+    def _line(self, text: str, rows: int) -> None:
+        elapsed = time.perf_counter() - self.started_at
+        rate = rows / elapsed if elapsed > 0 else 0.0
+        print(f"[{elapsed:8.1f}s] {text} ({rate:,.0f} linhas/s)", file=sys.stderr, flush=True)
+
+    def stage(self, stage: str, rows: int) -> None:
+        self._line(f"{stage}: {rows:,} linhas lidas", rows)
+
+    def committed(self, written: int, total: int) -> None:
+        self._line(f"gravando: {written:,}/{total:,} itens", written)
+
+
+def _existing_file(raw_path: str) -> Path:
+    path = Path(raw_path).expanduser()
+    if not path.is_file():
+        raise argparse.ArgumentTypeError(f"arquivo não encontrado: {raw_path}")
+    return path
+
+
+def _positive_int(raw_value: str) -> int:
+    try:
+        value = int(raw_value)
+    except ValueError:
+        value = 0
+    if value <= 0:
+        raise argparse.ArgumentTypeError("informe um inteiro positivo")
+    return value
+
+
+def _pending_server_jobs(db) -> list[int]:
+    return [
+        int(row[0])
+        for row in db.query(PickupCatalogImportJob.id).filter(
+            PickupCatalogImportJob.status.in_([JOB_STATUS_QUEUED, JOB_STATUS_RUNNING])
+        )
+    ]
+
+
+def _print_summary(result: dict[str, Any], elapsed: float, rows: int) -> None:
+    stats = result.get("stats") or {}
+    diff = result.get("inventory_diff") or {}
+    print(_safe_text(result.get("message")))
+    print(
+        f"clientes: {stats.get('clients_count', 0)} | clientes com itens: {stats.get('inventory_clients', 0)} "
+        f"| itens em aberto: {stats.get('open_items', 0)}"
+    )
+    print(
+        f"itens ({diff.get('mode', '-')}): {diff.get('inserted', 0)} novos, {diff.get('updated', 0)} atualizados, "
+        f"{diff.get('deleted', 0)} removidos, {diff.get('unchanged', 0)} sem mudança"
+    )
+    if result.get("dry_run"):
+        print(f"problemas: {result.get('problems_total', 0)}")
+        for problem in result.get("problems") or []:
+            print(f"  - {problem}")
+    rate = rows / elapsed if elapsed > 0 else 0.0
+    print(f"tempo total: {elapsed:.1f}s | {rows:,} linhas | {rate:,.0f} linhas/s")
+
+
+def catalog_import(args: argparse.Namespace) -> int:
+    if args.clients is None and args.inventory is None:
+        print("erro: informe --clients e/ou --inventory.", file=sys.stderr)
+        return 2
+
+    if args.bootstrap:
+        from app.main import run_db_bootstrap
+
+        run_db_bootstrap()
+
+    printer = _ProgressPrinter()
+    rows_seen = {"rows": 0}
+
+    def on_stage(stage: str, rows: int) -> None:
+        rows_seen["rows"] = rows
+        printer.stage(stage, rows)
+
+    db = SessionLocal()
+    try:
+        pending = _pending_server_jobs(db)
+        if pending and not args.force:
+            print(
+                f"erro: há importação do servidor na fila ou em andamento (jobs {pending}). "
+                "Aguarde ou use --force.",
+                file=sys.stderr,
+            )
+            return 1
+
+        started_at = time.perf_counter()
+        try:
+            result = import_pickup_catalog(
+                db,
+                clients_source=args.clients,
+                inventory_source=args.inventory,
+                clients_file_name=args.clients.name if args.clients else "",
+                inventory_file_name=args.inventory.name if args.inventory else "",
+                incremental=args.incremental,
+                dry_run=args.dry_run,
+                trace_memory=args.trace_memory or None,
+                commit_rows=args.commit_rows,
+                progress=on_stage,
+                commit_progress=printer.committed,
+            )
+        except ValueError as exc:
+            db.rollback()
+            print(f"erro: {exc}", file=sys.stderr)
+            return 1
+        if not args.dry_run:
+            rebuild_allocation_state(db)
+            reclaim_inactive_batches(db)
+        elapsed = time.perf_counter() - started_at
+    finally:
+        db.close()
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        _print_summary(result, elapsed, rows_seen["rows"])
+        if args.profile:
+            for stage in result.get("profile", {}).get("stages", []):
+                print(
+                    f"  {stage['stage']:<34} {stage.get('wall_ms', 0):>10.1f} ms "
+                    f"| entrada {stage.get('rows_in', 0):>9} | saída {stage.get('rows_out', 0):>9}"
+                )
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    catalog = commands.add_parser(
+        "catalog-import",
+        help="importa 01.20.11 e/ou 02.02.20 de arquivos locais",
+    )
+    catalog.add_argument("--clients", type=_existing_file, help="CSV 01.20.11 (clientes)")
+    catalog.add_argument("--inventory", type=_existing_file, help="CSV 02.02.20 (itens emprestados)")
+    catalog.add_argument("--incremental", action="store_true", help="aplica só a diferença dos itens no lote ativo")
+    catalog.add_argument("--dry-run", action="store_true", help="valida os arquivos sem gravar nada")
+    catalog.add_argument(
+        "--commit-rows",
+        type=_positive_int,
+        default=SNAPSHOT_COMMIT_ROWS,
+        help=f"itens por commit ao gravar um lote novo (padrão: {SNAPSHOT_COMMIT_ROWS})",
+    )
+    catalog.add_argument("--trace-memory", action="store_true", help="mede o pico de memória por etapa")
+    catalog.add_argument("--profile", action="store_true", help="mostra o tempo de cada etapa no fim")
+    catalog.add_argument("--json", action="store_true", help="imprime o resultado completo em JSON")
+    catalog.add_argument("--bootstrap", action="store_true", help="cria/atualiza as tabelas antes de importar")
+    catalog.add_argument("--force", action="store_true", help="importa mesmo com job do servidor pendente")
+    catalog.set_defaults(handler=catalog_import)
+    return parser
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -26,6 +26,13 @@ def env_positive_int(name: str, default: int) -> int:
     return parsed_value if parsed_value > 0 else default
 
 
+def env_flag(name: str, default: bool = False) -> bool:
+    raw_value = str(os.getenv(name, "") or "").strip().lower()
+    if not raw_value:
+        return default
+    return raw_value in {"1", "true", "yes", "sim", "on"}
+
+
 PICKUP_CATALOG_CLIENTS_CSV_MAX_BYTES = (
     env_positive_int("PICKUP_CATALOG_CLIENTS_CSV_MAX_MB", 200) * 1024 * 1024
 )
@@ -40,6 +47,34 @@ PICKUP_CATALOG_INVENTORY_CSV_MAX_LINES = env_positive_int(
     "PICKUP_CATALOG_INVENTORY_CSV_MAX_LINES",
     120000,
 )
+# Diretório dos arquivos temporários de upload de CSV (padrão: diretório temporário do sistema).
+CSV_UPLOAD_SPOOL_DIR = os.getenv("CSV_UPLOAD_SPOOL_DIR", "").strip()
+# Opcional: arquivo JSON de regras de tipo de item fora do código (ex.: disco persistente).
+PICKUP_CATALOG_ITEM_TYPE_RULES_FILE = os.getenv("PICKUP_CATALOG_ITEM_TYPE_RULES_FILE", "").strip()
+PICKUP_CATALOG_RECLASSIFY_BATCH_SIZE = env_positive_int("PICKUP_CATALOG_RECLASSIFY_BATCH_SIZE", 1000)
+# Parse paralelo dos CSVs: 1 processo mantém o parse sequencial; arquivos abaixo
+# do limite mínimo também seguem sequenciais (subir processos custa mais que o ganho).
+PICKUP_CATALOG_CSV_PARSE_WORKERS = env_positive_int("PICKUP_CATALOG_CSV_PARSE_WORKERS", 1)
+PICKUP_CATALOG_CSV_PARALLEL_MIN_BYTES = (
+    env_positive_int("PICKUP_CATALOG_CSV_PARALLEL_MIN_MB", 8) * 1024 * 1024
+)
+# Lotes da base de retiradas mantidos após cada importação (o ativo incluso),
+# para voltar a um lote anterior sem reimportar.
+PICKUP_CATALOG_RETAINED_BATCHES = env_positive_int("PICKUP_CATALOG_RETAINED_BATCHES", 2)
+# Pico de memória por etapa no relatório da importação (tracemalloc; deixa o parse mais lento).
+PICKUP_CATALOG_IMPORT_TRACE_MEMORY = env_flag("PICKUP_CATALOG_IMPORT_TRACE_MEMORY")
+# Snapshot novo em pipeline: leitura, classificação e gravação rodam ao mesmo
+# tempo, ligadas por filas limitadas (linhas por bloco e blocos por fila).
+PICKUP_CATALOG_IMPORT_PIPELINE = env_flag("PICKUP_CATALOG_IMPORT_PIPELINE", True)
+PICKUP_CATALOG_PIPELINE_CHUNK_ROWS = env_positive_int("PICKUP_CATALOG_PIPELINE_CHUNK_ROWS", 5000)
+PICKUP_CATALOG_PIPELINE_QUEUE_CHUNKS = env_positive_int("PICKUP_CATALOG_PIPELINE_QUEUE_CHUNKS", 4)
+# Jobs de importação: etapa, linhas e heartbeat gravados na linha do job a cada
+# N segundos; job "processando" sem heartbeat há mais que o limite foi interrompido.
+PICKUP_CATALOG_IMPORT_JOB_HEARTBEAT_SECONDS = env_positive_int("PICKUP_CATALOG_IMPORT_JOB_HEARTBEAT_SECONDS", 5)
+PICKUP_CATALOG_IMPORT_JOB_STALE_SECONDS = env_positive_int("PICKUP_CATALOG_IMPORT_JOB_STALE_SECONDS", 120)
+# Conjuntos de tokens de alocação (02.02.20 e retiradas concluídas) em cache no
+# processo, invalidados por lote ativo e revisões de base/ordens.
+EQUIPMENT_ALLOCATION_TOKEN_CACHE = env_flag("EQUIPMENT_ALLOCATION_TOKEN_CACHE", True)
 
 def parse_cors_origins(value: str):
     if not value:
@@ -8,7 +8,7 @@ from sqlalchemy import inspect, text
 from app.routes import tasks, auth, users, routines, deliveries, pickups, pickup_catalog as pickup_catalog_routes, equipments
 from app.database.base import Base
 from app.database.session import engine, SessionLocal
-from app.models import task, user, assignment, routine, delivery, pickup, pickup_catalog, equipment
+from app.models import task, user, assignment, routine, delivery, pickup, pickup_catalog, equipment, code_token
 from app.core.config import (
     ADMIN_EMAIL,
     ADMIN_PASSWORD,
@@ -20,6 +20,10 @@ from app.core.config import (
 )
 from app.core.security import get_password_hash
 from app.models.user import User
+from app.services.code_tokens import backfill_code_keys, backfill_code_tokens
+from app.services.equipment_allocation_state import rebuild_allocation_state
+from app.services.pickup_catalog_jobs import fail_interrupted_import_jobs, resume_queued_import_jobs
+from app.services.pickup_catalog_reclassify import backfill_material_buckets, reclassify_stale_inventory_items
 
 logger = logging.getLogger("uvicorn.error")
 app = FastAPI(title="Gestão de Tarefas")
@@ -97,42 +101,132 @@ def ensure_pickup_catalog_columns():
             conn.execute(text("ALTER TABLE pickup_catalog_inventory_items ADD COLUMN comodato_number VARCHAR"))
         if "invoice_issue_date" not in columns:
             conn.execute(text("ALTER TABLE pickup_catalog_inventory_items ADD COLUMN invoice_issue_date VARCHAR"))
+        if "classifier_version" not in columns:
+            conn.execute(
+                text(
+                    "ALTER TABLE pickup_catalog_inventory_items "
+                    "ADD COLUMN classifier_version INTEGER DEFAULT 0"
+                )
+            )
+        # Preenchida pelo backfill_code_keys (NULL = ainda não calculada).
+        if "rg_key" not in columns:
+            conn.execute(text("ALTER TABLE pickup_catalog_inventory_items ADD COLUMN rg_key VARCHAR"))
+        # Preenchida pelo backfill_material_buckets (NULL = ainda não calculada).
+        if "material_bucket" not in columns:
+            conn.execute(text("ALTER TABLE pickup_catalog_inventory_items ADD COLUMN material_bucket VARCHAR(40)"))
 
 
-def ensure_pickup_catalog_item_type_overrides():
+def ensure_pickup_catalog_client_columns():
     inspector = inspect(engine)
-    if "pickup_catalog_inventory_items" not in inspector.get_table_names():
+    if "pickup_catalog_clients" not in inspector.get_table_names():
         return
-
+    columns = [col["name"] for col in inspector.get_columns("pickup_catalog_clients")]
     with engine.begin() as conn:
-        conn.execute(
-            text(
-                "UPDATE pickup_catalog_inventory_items "
-                "SET item_type = 'jogo_mesa' "
-                "WHERE (LOWER(COALESCE(description, '')) LIKE '%cj de mesa plastica%' "
-                "OR LOWER(COALESCE(description, '')) LIKE '%mesa jogos%' "
-                "OR LOWER(COALESCE(description, '')) LIKE '%jogos mesa%' "
-                "OR LOWER(COALESCE(description, '')) LIKE '%jogo de mesa%' "
-                "OR LOWER(COALESCE(description, '')) LIKE '%jogos de mesa%') "
-                "AND LOWER(TRIM(COALESCE(item_type, ''))) <> 'jogo_mesa'"
-            )
-        )
-        conn.execute(
-            text(
-                "UPDATE pickup_catalog_inventory_items "
-                "SET item_type = 'caixa_termica' "
-                "WHERE LOWER(COALESCE(description, '')) LIKE '%caixa termica%' "
-                "AND LOWER(TRIM(COALESCE(item_type, ''))) <> 'caixa_termica'"
-            )
-        )
-        conn.execute(
-            text(
-                "UPDATE pickup_catalog_inventory_items "
-                "SET item_type = 'refrigerador' "
-                "WHERE LOWER(COALESCE(description, '')) LIKE '%visa cooler%' "
-                "AND LOWER(TRIM(COALESCE(item_type, ''))) <> 'refrigerador'"
+        # Falso em todas as linhas: o próximo 01.20.11 é relido mesmo se idêntico.
+        if "in_clients_file" not in columns:
+            conn.execute(
+                text("ALTER TABLE pickup_catalog_clients ADD COLUMN in_clients_file BOOLEAN NOT NULL DEFAULT FALSE")
             )
-        )
+
+
+def ensure_pickup_catalog_batch_columns():
+    inspector = inspect(engine)
+    if "pickup_catalog_upload_batches" not in inspector.get_table_names():
+        return
+    columns = [col["name"] for col in inspector.get_columns("pickup_catalog_upload_batches")]
+    with engine.begin() as conn:
+        if "activated_at" not in columns:
+            conn.execute(text("ALTER TABLE pickup_catalog_upload_batches ADD COLUMN activated_at TIMESTAMP"))
+        if "clients_sha256" not in columns:
+            conn.execute(text("ALTER TABLE pickup_catalog_upload_batches ADD COLUMN clients_sha256 VARCHAR(64) DEFAULT ''"))
+        if "inventory_sha256" not in columns:
+            conn.execute(text("ALTER TABLE pickup_catalog_upload_batches ADD COLUMN inventory_sha256 VARCHAR(64) DEFAULT ''"))
+        if "import_profile" not in columns:
+            conn.execute(text("ALTER TABLE pickup_catalog_upload_batches ADD COLUMN import_profile TEXT"))
+
+
+def ensure_pickup_catalog_import_job_columns():
+    inspector = inspect(engine)
+    if "pickup_catalog_import_jobs" not in inspector.get_table_names():
+        return
+    columns = [col["name"] for col in inspector.get_columns("pickup_catalog_import_jobs")]
+    with engine.begin() as conn:
+        if "clients_sha256" not in columns:
+            conn.execute(text("ALTER TABLE pickup_catalog_import_jobs ADD COLUMN clients_sha256 VARCHAR(64) DEFAULT ''"))
+        if "inventory_sha256" not in columns:
+            conn.execute(text("ALTER TABLE pickup_catalog_import_jobs ADD COLUMN inventory_sha256 VARCHAR(64) DEFAULT ''"))
+        if "dry_run" not in columns:
+            conn.execute(text("ALTER TABLE pickup_catalog_import_jobs ADD COLUMN dry_run BOOLEAN DEFAULT FALSE"))
+        if "heartbeat_at" not in columns:
+            conn.execute(text("ALTER TABLE pickup_catalog_import_jobs ADD COLUMN heartbeat_at TIMESTAMP"))
+
+
+def reclassify_pickup_catalog_item_types():
+    inspector = inspect(engine)
+    if "pickup_catalog_inventory_items" not in inspector.get_table_names():
+        return
+
+    db = SessionLocal()
+    try:
+        reclassified = reclassify_stale_inventory_items(db)
+    finally:
+        db.close()
+    if reclassified:
+        logger.info("Itens da base 02.02.20 reclassificados: %s.", reclassified)
+
+
+def backfill_pickup_catalog_material_buckets():
+    inspector = inspect(engine)
+    if "pickup_catalog_inventory_items" not in inspector.get_table_names():
+        return
+
+    db = SessionLocal()
+    try:
+        filled = backfill_material_buckets(db)
+    finally:
+        db.close()
+    if filled:
+        logger.info("Tipo resolvido (material_bucket) preenchido: %s itens.", filled)
+
+
+def recover_pickup_catalog_import_jobs():
+    db = SessionLocal()
+    try:
+        interrupted = fail_interrupted_import_jobs(db)
+    finally:
+        db.close()
+    if interrupted:
+        logger.warning("Importações da base de retiradas interrompidas no reinício: %s.", interrupted)
+    resume_queued_import_jobs()
+
+
+def backfill_rg_tag_code_keys():
+    db = SessionLocal()
+    try:
+        filled = backfill_code_keys(db)
+    finally:
+        db.close()
+    if filled:
+        logger.info("Chaves rg_key/tag_key/model_key preenchidas: %s linhas.", filled)
+
+
+def rebuild_equipment_allocation_state():
+    db = SessionLocal()
+    try:
+        rows = rebuild_allocation_state(db)
+    finally:
+        db.close()
+    logger.info("Estado de alocação dos refrigeradores recalculado: %s equipamentos.", rows)
+
+
+def backfill_pickup_catalog_code_tokens():
+    db = SessionLocal()
+    try:
+        indexed = backfill_code_tokens(db)
+    finally:
+        db.close()
+    if indexed:
+        logger.info("Tokens de RG/etiqueta indexados: %s.", indexed)
 
 
 def ensure_pickup_catalog_order_columns():
@@ -232,6 +326,8 @@ def ensure_pickup_catalog_order_item_columns():
             conn.execute(text("ALTER TABLE pickup_catalog_order_items ADD COLUMN comodato_number VARCHAR"))
         if "refrigerator_condition" not in columns:
             conn.execute(text("ALTER TABLE pickup_catalog_order_items ADD COLUMN refrigerator_condition VARCHAR"))
+        if "rg_key" not in columns:
+            conn.execute(text("ALTER TABLE pickup_catalog_order_items ADD COLUMN rg_key VARCHAR"))
         conn.execute(
             text(
                 "UPDATE pickup_catalog_order_items "
@@ -274,6 +370,12 @@ def ensure_equipment_columns():
         )
         if "voltage" not in columns:
             conn.execute(text("ALTER TABLE equipments ADD COLUMN voltage VARCHAR DEFAULT ''"))
+        if "rg_key" not in columns:
+            conn.execute(text("ALTER TABLE equipments ADD COLUMN rg_key VARCHAR"))
+        if "tag_key" not in columns:
+            conn.execute(text("ALTER TABLE equipments ADD COLUMN tag_key VARCHAR"))
+        if "model_key" not in columns:
+            conn.execute(text("ALTER TABLE equipments ADD COLUMN model_key VARCHAR"))
         conn.execute(
             text(
                 "UPDATE equipments "
@@ -368,6 +470,54 @@ def ensure_pickup_catalog_indexes():
                         "ON pickup_catalog_inventory_items (client_id, batch_id)"
                     )
                 )
+            if not _has_index_with_columns(inventory_indexes, ["classifier_version"]):
+                conn.execute(
+                    text(
+                        "CREATE INDEX IF NOT EXISTS "
+                        "idx_pickup_catalog_inventory_items_classifier_version "
+                        "ON pickup_catalog_inventory_items (classifier_version)"
+                    )
+                )
+            if not _has_index_with_columns(inventory_indexes, ["rg_key"]):
+                conn.execute(
+                    text(
+                        "CREATE INDEX IF NOT EXISTS "
+                        "idx_pickup_catalog_inventory_items_rg_key "
+                        "ON pickup_catalog_inventory_items (rg_key)"
+                    )
+                )
+            if not _has_index_with_columns(inventory_indexes, ["material_bucket"]):
+                conn.execute(
+                    text(
+                        "CREATE INDEX IF NOT EXISTS "
+                        "idx_pickup_catalog_inventory_items_material_bucket "
+                        "ON pickup_catalog_inventory_items (material_bucket)"
+                    )
+                )
+
+        if "pickup_catalog_order_items" in table_names:
+            order_item_indexes = inspector.get_indexes("pickup_catalog_order_items")
+
+            if not _has_index_with_columns(order_item_indexes, ["rg_key"]):
+                conn.execute(
+                    text(
+                        "CREATE INDEX IF NOT EXISTS "
+                        "idx_pickup_catalog_order_items_rg_key "
+                        "ON pickup_catalog_order_items (rg_key)"
+                    )
+                )
+
+        if "equipments" in table_names:
+            equipment_indexes = inspector.get_indexes("equipments")
+
+            if not _has_index_with_columns(equipment_indexes, ["rg_key"]):
+                conn.execute(
+                    text("CREATE INDEX IF NOT EXISTS idx_equipments_rg_key ON equipments (rg_key)")
+                )
+            if not _has_index_with_columns(equipment_indexes, ["tag_key"]):
+                conn.execute(
+                    text("CREATE INDEX IF NOT EXISTS idx_equipments_tag_key ON equipments (tag_key)")
+                )
 
 
 def ensure_admin_user():
@@ -406,11 +556,19 @@ def run_db_bootstrap() -> None:
         ("ensure_pickup_columns", ensure_pickup_columns),
         ("ensure_user_permissions_column", ensure_user_permissions_column),
         ("ensure_pickup_catalog_columns", ensure_pickup_catalog_columns),
-        ("ensure_pickup_catalog_item_type_overrides", ensure_pickup_catalog_item_type_overrides),
+        ("ensure_pickup_catalog_client_columns", ensure_pickup_catalog_client_columns),
+        ("ensure_pickup_catalog_batch_columns", ensure_pickup_catalog_batch_columns),
+        ("ensure_pickup_catalog_import_job_columns", ensure_pickup_catalog_import_job_columns),
         ("ensure_pickup_catalog_order_columns", ensure_pickup_catalog_order_columns),
         ("ensure_pickup_catalog_order_item_columns", ensure_pickup_catalog_order_item_columns),
         ("ensure_equipment_columns", ensure_equipment_columns),
         ("ensure_pickup_catalog_indexes", ensure_pickup_catalog_indexes),
+        ("reclassify_pickup_catalog_item_types", reclassify_pickup_catalog_item_types),
+        ("backfill_pickup_catalog_material_buckets", backfill_pickup_catalog_material_buckets),
+        ("backfill_rg_tag_code_keys", backfill_rg_tag_code_keys),
+        ("backfill_pickup_catalog_code_tokens", backfill_pickup_catalog_code_tokens),
+        ("rebuild_equipment_allocation_state", rebuild_equipment_allocation_state),
+        ("recover_pickup_catalog_import_jobs", recover_pickup_catalog_import_jobs),
         ("ensure_admin_user", ensure_admin_user),
     ]
     for step_name, step_fn in steps:
@@ -1,9 +1,12 @@
 from app.models.assignment import Assignment  # noqa: F401
+from app.models.code_token import CodeToken  # noqa: F401
 from app.models.delivery import Delivery  # noqa: F401
-from app.models.equipment import Equipment  # noqa: F401
+from app.models.equipment import Equipment, EquipmentAllocationState  # noqa: F401
 from app.models.pickup import Pickup  # noqa: F401
 from app.models.pickup_catalog import (  # noqa: F401
+    PickupCatalogActiveBatch,
     PickupCatalogClient,
+    PickupCatalogImportJob,
     PickupCatalogInventoryItem,
     PickupCatalogOrder,
     PickupCatalogOrderItem,
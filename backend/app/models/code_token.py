@@ -0,0 +1,16 @@
+from sqlalchemy import Column, ForeignKey, Index, Integer, String
+
+from app.database.base import Base
+
+
+class CodeToken(Base):
+    # Variantes de RG/etiqueta (ver build_code_tokens) apontando para a linha de
+    # origem; cada linha preenche só uma das três referências.
+    __tablename__ = "code_tokens"
+    __table_args__ = (Index("ix_code_tokens_token", "token"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    token = Column(String(120), nullable=False)
+    inventory_item_id = Column(Integer, ForeignKey("pickup_catalog_inventory_items.id"), nullable=True, index=True)
+    equipment_id = Column(Integer, ForeignKey("equipments.id"), nullable=True, index=True)
+    order_item_id = Column(Integer, ForeignKey("pickup_catalog_order_items.id"), nullable=True, index=True)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, DateTime, Index, Integer, String, Text, UniqueConstraint, func
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Index, Integer, String, Text, UniqueConstraint, func
 
 from app.database.base import Base
 
@@ -19,8 +19,23 @@ class Equipment(Base):
     voltage = Column(String(40), nullable=False, default="")
     rg_code = Column(String(120), nullable=True, index=True)
     tag_code = Column(String(120), nullable=True, index=True)
+    # rg_code/tag_code sem espaços e em maiúsculas (code_key); NULL até o backfill.
+    rg_key = Column(String(120), nullable=True, index=True)
+    tag_key = Column(String(120), nullable=True, index=True)
+    # model_name normalizado para ordenação (model_key); NULL até o backfill.
+    model_key = Column(String(120), nullable=True)
     status = Column(String(20), nullable=False, default="novo", index=True)
     client_name = Column(String(180), nullable=True, index=True)
     notes = Column(Text, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class EquipmentAllocationState(Base):
+    # Alocação efetiva de cada refrigerador (consta no 02.02.20 e não voltou por
+    # retirada concluída). Mantida por quem altera equipamentos, a base ou as ordens.
+    __tablename__ = "equipment_allocation_state"
+
+    equipment_id = Column(Integer, ForeignKey("equipments.id"), primary_key=True)
+    still_allocated = Column(Boolean, nullable=False, default=False, index=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
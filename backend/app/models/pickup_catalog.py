@@ -1,4 +1,4 @@
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Text, func
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String, Text, func
 
 from app.database.base import Base
 
@@ -21,6 +21,9 @@ class PickupCatalogClient(Base):
     responsavel_cliente = Column(String(120), default="")
     responsavel_retirada = Column(String(120), default="")
     responsavel_conferencia = Column(String(120), default="")
+    # Listado no último 01.20.11 processado: reenviado sem mudança, o arquivo não
+    # é relido e os clientes mantidos saem daqui.
+    in_clients_file = Column(Boolean, default=False, nullable=False)
 
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
@@ -32,10 +35,53 @@ class PickupCatalogUploadBatch(Base):
     id = Column(Integer, primary_key=True, index=True)
     clients_file_name = Column(String(255), default="")
     inventory_file_name = Column(String(255), default="")
+    # SHA-256 dos arquivos que geraram o lote; reenvio idêntico é ignorado.
+    clients_sha256 = Column(String(64), default="")
+    inventory_sha256 = Column(String(64), default="")
     clients_count = Column(Integer, default=0)
     inventory_clients = Column(Integer, default=0)
     open_items = Column(Integer, default=0)
+    # Resumo JSON por etapa (tempo, CPU, linhas, memória) da importação que gerou o lote.
+    import_profile = Column(Text, default="")
     uploaded_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
+    # Preenchido quando o lote passa a ser servido; lotes nunca ativados são descartáveis.
+    activated_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class PickupCatalogActiveBatch(Base):
+    # Linha única (id=1) apontando o lote servido às leituras; a troca de lote
+    # é só a atualização deste ponteiro.
+    __tablename__ = "pickup_catalog_active_batch"
+
+    id = Column(Integer, primary_key=True)
+    batch_id = Column(Integer, ForeignKey("pickup_catalog_upload_batches.id"), nullable=True)
+    activated_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class PickupCatalogImportJob(Base):
+    __tablename__ = "pickup_catalog_import_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    status = Column(String(20), default="na_fila", nullable=False, index=True)
+    stage = Column(String(40), default="")
+    rows_processed = Column(Integer, default=0)
+    incremental = Column(Boolean, default=False, nullable=False)
+    dry_run = Column(Boolean, default=False, nullable=False)
+    clients_file_name = Column(String(255), default="")
+    inventory_file_name = Column(String(255), default="")
+    clients_spool_path = Column(String(512), default="")
+    inventory_spool_path = Column(String(512), default="")
+    clients_sha256 = Column(String(64), default="")
+    inventory_sha256 = Column(String(64), default="")
+    requested_by = Column(String(120), default="")
+    error = Column(Text, default="")
+    result = Column(Text, default="")
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    # Renovado pelo processo que roda o job; parado, o job foi interrompido.
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
 
 
 class PickupCatalogInventoryItem(Base):
@@ -47,13 +93,18 @@ class PickupCatalogInventoryItem(Base):
 
     description = Column(String(255), nullable=False)
     item_type = Column(String(40), default="outro", index=True)
+    # Tipo resolvido para as telas de equipamentos (resolve_material_bucket); NULL até o backfill.
+    material_bucket = Column(String(40), nullable=True, index=True)
     open_quantity = Column(Integer, default=0)
     rg = Column(String(120), default="")
+    # rg sem espaços e em maiúsculas (code_key); NULL até o backfill.
+    rg_key = Column(String(120), nullable=True, index=True)
     comodato_number = Column(String(120), default="")
     invoice_issue_date = Column(String(40), default="")
     volume_key = Column(String(20), default="")
     source_baixados = Column(Integer, default=0)
     product_code = Column(String(120), default="")
+    classifier_version = Column(Integer, default=0, nullable=False, index=True)
 
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
@@ -108,6 +159,7 @@ class PickupCatalogOrderItem(Base):
     quantity = Column(Integer, default=0)
     quantity_text = Column(String(120), default="")
     rg = Column(String(120), default="")
+    rg_key = Column(String(120), nullable=True, index=True)
     comodato_number = Column(String(120), default="")
     refrigerator_condition = Column(String(20), default="")
     volume_key = Column(String(20), default="")
@@ -1,29 +1,25 @@
 import csv
-import io
 import re
-import unicodedata
 from collections import defaultdict
 from datetime import datetime
+from pathlib import Path
 from typing import Literal, Optional
 
 from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile, status
-from sqlalchemy import func, or_
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import case, func, or_, select
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from app.core.auth import require_any_permission, require_permission
 from app.database.deps import get_db
-from app.models.equipment import Equipment
-from app.models.pickup_catalog import (
-    PickupCatalogClient,
-    PickupCatalogInventoryItem,
-    PickupCatalogOrder,
-    PickupCatalogOrderItem,
-    PickupCatalogUploadBatch,
-)
+from app.models.code_token import CodeToken
+from app.models.equipment import Equipment, EquipmentAllocationState
+from app.models.pickup_catalog import PickupCatalogClient, PickupCatalogInventoryItem
 from app.models.user import User
 from app.schemas.equipment import (
     EquipmentAllocatedRefrigeratorItemOut,
+    EquipmentAllocationCacheStatsOut,
     EquipmentAllocationLookupItemOut,
     EquipmentAllocationLookupOut,
     EquipmentAllocationSyncOut,
@@ -42,7 +38,48 @@ from app.schemas.equipment import (
     EquipmentSummaryOut,
     EquipmentUpdate,
 )
-from app.services.pickup_catalog_csv import classify_item_type
+from app.services.allocation_token_cache import (
+    allocation_token_cache,
+    inventory_revision,
+    orders_revision,
+)
+from app.services.code_tokens import (
+    build_code_tokens,
+    code_key,
+    code_key_in,
+    delete_equipment_tokens,
+    model_key,
+    sync_equipment_tokens,
+)
+from app.services.csv_source import (
+    CsvUploadInvalidArchiveError,
+    CsvUploadTooLargeError,
+    CsvUploadTooManyLinesError,
+    decode_csv_sample,
+    detect_csv_encoding,
+    is_zip_upload_name,
+    iter_csv_file_lines,
+    open_csv_buffer,
+    spool_upload,
+    spool_zip_archive,
+    spool_zip_member,
+    upload_inner_suffix,
+)
+from app.services.equipment_allocation_state import (
+    allocated_020220_tokens,
+    allocation_state_filter,
+    apply_active_inventory_filter,
+    delete_allocation_state,
+    equipment_lookup_tokens,
+    refresh_allocation_state,
+)
+from app.services.material_bucket import (
+    MATERIAL_TYPE_ALIASES,
+    material_type_bucket,
+    normalize_lookup_text,
+    resolve_material_bucket,
+)
+from app.services.pickup_catalog_import import active_batch_id, uses_batched_inventory
 
 router = APIRouter(prefix="/equipments", tags=["Equipments"])
 get_equipments_viewer = require_any_permission("equipments.view", "equipments.manage")
@@ -82,6 +119,10 @@ ALLOWED_CSV_UPLOAD_CONTENT_TYPES = {
     "text/plain",
     "application/vnd.ms-excel",
     "application/octet-stream",
+    "application/gzip",
+    "application/x-gzip",
+    "application/zip",
+    "application/x-zip-compressed",
 }
 MAX_EQUIPMENT_IMPORT_CSV_BYTES = 5 * 1024 * 1024
 MAX_EQUIPMENT_IMPORT_CSV_LINES = 10000
@@ -102,52 +143,6 @@ VOLTAGE_ALIASES = {
 }
 SORT_OPTIONS = {"newest", "oldest"}
 MATERIAL_GROUP_OPTIONS = {"todos", "refrigerador", "outros"}
-MATERIAL_TYPE_ALIASES = {
-    "refrigerador": "refrigerador",
-    "refrigeradores": "refrigerador",
-    "geladeira": "refrigerador",
-    "geladeiras": "refrigerador",
-    "frigobar": "refrigerador",
-    "frigorifico": "refrigerador",
-    "cervejeira": "refrigerador",
-    "caixa termica": "caixa_termica",
-    "caixa_termica": "caixa_termica",
-    "caixa termicas": "caixa_termica",
-    "caixas termicas": "caixa_termica",
-    "cx termica": "caixa_termica",
-    "jogo mesa": "jogo_mesa",
-    "jogos mesa": "jogo_mesa",
-    "jogo de mesa": "jogo_mesa",
-    "jogos de mesa": "jogo_mesa",
-    "jogo_mesa": "jogo_mesa",
-    "garrafeira": "garrafeira",
-    "vasilhame caixa": "vasilhame_caixa",
-    "vasilhame_caixa": "vasilhame_caixa",
-    "vasilhame garrafa": "vasilhame_garrafa",
-    "vasilhame_garrafa": "vasilhame_garrafa",
-    "chopeira": "outro",
-    "choppeira": "outro",
-    "balde": "outro",
-    "baldes": "outro",
-    "testeira": "outro",
-    "compressor": "outro",
-    "totem": "outro",
-    "cooler carrinho": "outro",
-    "coller carrinho": "outro",
-    "cooler_carrinho": "outro",
-    "inflavel": "outro",
-    "empilhadeira": "outro",
-    "calca": "outro",
-    "cartucho": "outro",
-    "ombrelone": "outro",
-    "ombrellone": "outro",
-    "camera fria": "outro",
-    "camera_fria": "outro",
-    "camara fria": "outro",
-    "dispensador": "outro",
-    "outro": "outro",
-    "outros": "outro",
-}
 INVOICE_DATE_FORMATS = ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y", "%d/%m/%y", "%Y/%m/%d")
 IMPORT_CSV_HEADERS = {
     "tipo": {"tipo", "type"},
@@ -167,55 +162,64 @@ def digits_only(value: str) -> str:
     return re.sub(r"\D+", "", str(value or ""))
 
 
-def normalize_lookup_text(value: str) -> str:
-    normalized = normalize_spaces(value).lower()
-    without_accents = unicodedata.normalize("NFD", normalized)
-    without_accents = "".join(ch for ch in without_accents if unicodedata.category(ch) != "Mn")
-    without_accents = without_accents.replace("-", " ").replace("_", " ")
-    return re.sub(r"\s+", " ", without_accents).strip()
-
-
-def _decode_import_csv(raw_bytes: bytes) -> str:
-    for encoding in ("utf-8-sig", "utf-8", "cp1252", "latin-1"):
-        try:
-            return raw_bytes.decode(encoding)
-        except UnicodeDecodeError:
-            continue
-    raise HTTPException(status_code=422, detail="Não foi possível ler o CSV enviado.")
+def _sniff_import_csv(spool_path: Path) -> tuple[str, str]:
+    with open_csv_buffer(spool_path) as buffer:
+        encoding = detect_csv_encoding(buffer)
+        return encoding, _sniff_csv_delimiter(decode_csv_sample(buffer, encoding))
 
 
-async def _read_csv_upload_bytes(
+async def _spool_csv_upload(
     upload: UploadFile,
     *,
     max_bytes: int,
     max_lines: int,
     label: str,
-) -> bytes:
+) -> Path:
     file_name = str(getattr(upload, "filename", "") or "").strip()
-    suffix = Path(file_name).suffix.lower()
-    if suffix and suffix not in ALLOWED_CSV_UPLOAD_SUFFIXES:
-        raise HTTPException(status_code=400, detail=f"{label} deve estar em formato CSV ou TXT.")
+    is_zip = is_zip_upload_name(file_name)
+    suffix = upload_inner_suffix(file_name)
+    if not is_zip and suffix and suffix not in ALLOWED_CSV_UPLOAD_SUFFIXES:
+        raise HTTPException(status_code=400, detail=f"{label} deve estar em formato CSV ou TXT (ou .gz/.zip).")
 
     content_type = str(getattr(upload, "content_type", "") or "").strip().lower()
     if content_type not in ALLOWED_CSV_UPLOAD_CONTENT_TYPES:
         raise HTTPException(status_code=400, detail=f"Tipo de arquivo invÃ¡lido para {label}.")
 
-    raw_bytes = await upload.read(max_bytes + 1)
-    if len(raw_bytes) > max_bytes:
+    archive_path: Path | None = None
+    try:
+        if is_zip:
+            archive_path, members = await spool_zip_archive(upload, max_bytes=max_bytes)
+            if len(members) != 1 or upload_inner_suffix(members[0]) not in ALLOWED_CSV_UPLOAD_SUFFIXES:
+                raise HTTPException(status_code=400, detail=f"{label}: o .zip deve conter um único arquivo CSV ou TXT.")
+            spool_path = await run_in_threadpool(
+                spool_zip_member,
+                archive_path,
+                members[0],
+                max_bytes=max_bytes,
+                max_lines=max_lines,
+            )
+        else:
+            spool_path = await spool_upload(upload, max_bytes=max_bytes, max_lines=max_lines)
+    except CsvUploadTooLargeError as exc:
         raise HTTPException(
             status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
             detail=f"{label} excede o limite de {max_bytes // (1024 * 1024)} MB.",
-        )
-    if not raw_bytes:
-        raise HTTPException(status_code=400, detail=f"{label} vazio.")
-
-    line_count = raw_bytes.count(b"\n") + (1 if raw_bytes else 0)
-    if line_count > max_lines + 1:
+        ) from exc
+    except CsvUploadTooManyLinesError as exc:
         raise HTTPException(
             status_code=422,
             detail=f"{label} excede o limite de {max_lines} linhas.",
-        )
-    return raw_bytes
+        ) from exc
+    except CsvUploadInvalidArchiveError as exc:
+        raise HTTPException(status_code=400, detail=f"{label}: {exc}.") from exc
+    finally:
+        if archive_path is not None:
+            archive_path.unlink(missing_ok=True)
+
+    if spool_path.stat().st_size == 0:
+        spool_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=400, detail=f"{label} vazio.")
+    return spool_path
 
 
 def _sniff_csv_delimiter(text: str) -> str:
@@ -349,24 +353,6 @@ def ensure_unique_codes(
         if tag_query.first():
             raise HTTPException(status_code=409, detail="Etiqueta já cadastrada.")
 
-def _inventory_uses_batches(db: Session) -> bool:
-    return (
-        db.query(PickupCatalogInventoryItem.id)
-        .filter(PickupCatalogInventoryItem.batch_id.isnot(None))
-        .first()
-        is not None
-    )
-
-
-def _latest_inventory_batch_id(db: Session) -> Optional[int]:
-    row = (
-        db.query(PickupCatalogUploadBatch.id)
-        .order_by(PickupCatalogUploadBatch.id.desc())
-        .first()
-    )
-    return int(row[0]) if row else None
-
-
 def _normalize_sort(value: str) -> Literal["newest", "oldest"]:
     normalized = normalize_lookup_text(value)
     if normalized in SORT_OPTIONS:
@@ -395,20 +381,10 @@ def _normalize_year(value: str) -> str:
     return text
 
 
-def _material_type_bucket(value: str) -> str:
-    normalized = normalize_lookup_text(value)
-    mapped = MATERIAL_TYPE_ALIASES.get(normalized, "")
-    if mapped in {"vasilhame_caixa", "vasilhame_garrafa", "garrafeira"}:
-        return "garrafeira"
-    if mapped in {"refrigerador", "jogo_mesa", "caixa_termica"}:
-        return mapped
-    return "outro"
-
-
 def _normalize_material_type(value: str) -> str:
     normalized = normalize_lookup_text(value)
     if normalized in MATERIAL_TYPE_ALIASES:
-        return _material_type_bucket(MATERIAL_TYPE_ALIASES[normalized])
+        return material_type_bucket(MATERIAL_TYPE_ALIASES[normalized])
     raise HTTPException(status_code=422, detail="Tipo de material inválido.")
 
 
@@ -423,118 +399,8 @@ def _parse_inventory_issue_date(raw_date: Optional[str], fallback: Optional[date
     return fallback or datetime(1900, 1, 1)
 
 
-def _apply_inventory_base_filter(query, db: Session):
-    filtered = query.filter(PickupCatalogInventoryItem.open_quantity > 0)
-    if not _inventory_uses_batches(db):
-        return filtered
-    latest_batch_id = _latest_inventory_batch_id(db)
-    if latest_batch_id is None:
-        return filtered.filter(PickupCatalogInventoryItem.id == -1)
-    return filtered.filter(PickupCatalogInventoryItem.batch_id == latest_batch_id)
-
-
 def _build_code_lookup_tokens(value: Optional[str]) -> set[str]:
-    normalized = normalize_spaces(value or "")
-    if not normalized:
-        return set()
-    upper = normalized.upper()
-    compact = re.sub(r"[^A-Z0-9]+", "", upper)
-    digits = digits_only(upper)
-    tokens = {upper}
-    if compact:
-        tokens.add(compact)
-    if digits:
-        tokens.add(digits)
-    return {token for token in tokens if token}
-
-
-def _build_equipment_lookup_tokens(rg_code: Optional[str], tag_code: Optional[str]) -> set[str]:
-    tokens: set[str] = set()
-    tokens.update(_build_code_lookup_tokens(rg_code))
-    tokens.update(_build_code_lookup_tokens(tag_code))
-    return tokens
-
-
-def _refrigerator_allocated_tokens_from_020220(db: Session) -> set[str]:
-    inventory_rows = _apply_inventory_base_filter(
-        db.query(
-            PickupCatalogInventoryItem.item_type.label("item_type"),
-            PickupCatalogInventoryItem.description.label("description"),
-            PickupCatalogInventoryItem.rg.label("rg_code"),
-        ),
-        db=db,
-    ).all()
-
-    allocated_tokens: set[str] = set()
-    for row in inventory_rows:
-        item_type_value = normalize_spaces(row.item_type)
-        mapped_type = _material_type_bucket(item_type_value)
-        if mapped_type != "refrigerador":
-            inferred = _material_type_bucket(classify_item_type(normalize_spaces(row.description)))
-            if inferred != "refrigerador":
-                continue
-        allocated_tokens.update(_build_code_lookup_tokens(row.rg_code))
-
-    return allocated_tokens
-
-
-def _is_refrigerator_pickup_item(
-    item_type: Optional[str],
-    description: Optional[str],
-    rg_code: Optional[str],
-) -> bool:
-    normalized_type = normalize_spaces(item_type or "")
-    if _material_type_bucket(normalized_type) == "refrigerador":
-        return True
-
-    inferred_type = _material_type_bucket(classify_item_type(normalize_spaces(description or "")))
-    if inferred_type == "refrigerador":
-        return True
-
-    normalized_rg = normalize_spaces(rg_code or "")
-    if not normalized_rg:
-        return False
-
-    compact_rg = re.sub(r"[^A-Z0-9]+", "", normalized_rg.upper())
-    if compact_rg in {"S", "SIM", "N", "NA", "NAO", "SEM"}:
-        return False
-    return any(char.isdigit() for char in compact_rg)
-
-
-def _returned_refrigerator_tokens_from_concluded_pickups(db: Session) -> set[str]:
-    rows = (
-        db.query(
-            PickupCatalogOrderItem.item_type.label("item_type"),
-            PickupCatalogOrderItem.description.label("description"),
-            PickupCatalogOrderItem.rg.label("rg_code"),
-        )
-        .join(
-            PickupCatalogOrder,
-            PickupCatalogOrder.id == PickupCatalogOrderItem.order_id,
-        )
-        .filter(PickupCatalogOrder.status == "concluida")
-        .all()
-    )
-
-    returned_tokens: set[str] = set()
-    for row in rows:
-        if not _is_refrigerator_pickup_item(row.item_type, row.description, row.rg_code):
-            continue
-        returned_tokens.update(_build_code_lookup_tokens(row.rg_code))
-    return returned_tokens
-
-
-def _is_equipment_still_allocated(
-    equipment: Equipment,
-    allocated_tokens_020220: set[str],
-    returned_tokens: set[str],
-) -> bool:
-    equipment_tokens = _build_equipment_lookup_tokens(equipment.rg_code, equipment.tag_code)
-    if not equipment_tokens:
-        return False
-    if not allocated_tokens_020220.intersection(equipment_tokens):
-        return False
-    return not returned_tokens.intersection(equipment_tokens)
+    return build_code_tokens(value)
 
 
 def _is_refrigerator_allocated_in_020220(
@@ -542,16 +408,29 @@ def _is_refrigerator_allocated_in_020220(
     rg_code: Optional[str],
     tag_code: Optional[str],
     *,
-    allocated_tokens: Optional[set[str]] = None,
+    allocated_tokens: Optional[frozenset[str]] = None,
 ) -> bool:
-    equipment_tokens = _build_equipment_lookup_tokens(rg_code, tag_code)
+    equipment_tokens = equipment_lookup_tokens(rg_code, tag_code)
     if not equipment_tokens:
         return False
 
-    tokens = allocated_tokens if allocated_tokens is not None else _refrigerator_allocated_tokens_from_020220(db)
+    tokens = (
+        allocated_tokens
+        if allocated_tokens is not None
+        else allocated_020220_tokens(db, tokens=equipment_tokens)
+    )
     return bool(tokens.intersection(equipment_tokens))
 
 
+def _model_sort_key(db: Session):
+    # Mesma ordem do sort em Python (lower() Unicode, comparação por code point).
+    # Linhas ainda sem model_key (antes do backfill) caem no lower() do banco.
+    sort_key = func.coalesce(Equipment.model_key, func.lower(Equipment.model_name))
+    if db.get_bind().dialect.name == "postgresql":
+        return sort_key.collate("C")
+    return sort_key
+
+
 def _build_page_meta(limit: int, offset: int, total: int) -> EquipmentPageMetaOut:
     return EquipmentPageMetaOut(
         limit=limit,
@@ -730,8 +609,8 @@ def refrigerators_overview(
         .all()
     )
 
-    use_batches = _inventory_uses_batches(db)
-    latest_batch_id = _latest_inventory_batch_id(db) if use_batches else None
+    use_batches = uses_batched_inventory(db)
+    latest_batch_id = active_batch_id(db) if use_batches else None
 
     def apply_allocados_filter(query):
         filtered = query.filter(
@@ -916,32 +795,19 @@ def list_available_refrigerators_for_comodato(
             )
         )
 
-    rows = query.order_by(Equipment.created_at.desc(), Equipment.id.desc()).all()
-    if not rows:
-        return []
-    allocated_tokens_020220 = _refrigerator_allocated_tokens_from_020220(db)
-    returned_tokens = _returned_refrigerator_tokens_from_concluded_pickups(db)
-
-    filtered_rows: list[Equipment] = []
-    for row in rows:
-        if _is_equipment_still_allocated(
-            row,
-            allocated_tokens_020220=allocated_tokens_020220,
-            returned_tokens=returned_tokens,
-        ):
-            continue
-        filtered_rows.append(row)
-
-    sorted_rows = sorted(
-        filtered_rows,
-        key=lambda item: (
-            0 if normalize_lookup_text(item.status) == "novo" else 1,
-            normalize_spaces(item.model_name).lower(),
-            int(item.id),
-        ),
-    )
-
-    paged_rows = sorted_rows[offset: offset + limit]
+    with allocation_state_filter(db, still_allocated=False) as not_allocated:
+        paged_rows = (
+            query.outerjoin(EquipmentAllocationState, EquipmentAllocationState.equipment_id == Equipment.id)
+            .filter(not_allocated)
+            .order_by(
+                case((Equipment.status == "novo", 0), else_=1),
+                _model_sort_key(db),
+                Equipment.id.asc(),
+            )
+            .offset(offset)
+            .limit(limit)
+            .all()
+        )
     return [
         EquipmentNewRefrigeratorItemOut(
             id=int(item.id),
@@ -992,39 +858,29 @@ def list_non_allocated_refrigerators(
             )
         )
 
-    rows = query.order_by(Equipment.created_at.desc(), Equipment.id.desc()).all()
-    allocated_tokens_020220 = _refrigerator_allocated_tokens_from_020220(db)
-    returned_tokens = _returned_refrigerator_tokens_from_concluded_pickups(db)
-
     counters = {"novo": 0, "disponivel": 0, "recap": 0, "sucata": 0}
-    eligible_rows: list[Equipment] = []
-    for row in rows:
-        if _is_equipment_still_allocated(
-            row,
-            allocated_tokens_020220=allocated_tokens_020220,
-            returned_tokens=returned_tokens,
+    dashboard_total = 0
+    with allocation_state_filter(db, still_allocated=False) as not_allocated:
+        query = query.outerjoin(
+            EquipmentAllocationState, EquipmentAllocationState.equipment_id == Equipment.id
+        ).filter(not_allocated)
+
+        for status_value, qty in query.with_entities(Equipment.status, func.count(Equipment.id)).group_by(
+            Equipment.status
         ):
-            continue
-        status_value = normalize_lookup_text(row.status)
-        if status_value in counters:
-            counters[status_value] += 1
-        eligible_rows.append(row)
-
-    if normalized_status == "todos":
-        filtered_rows = eligible_rows
-    else:
-        filtered_rows = [
-            row
-            for row in eligible_rows
-            if normalize_lookup_text(row.status) == normalized_status
-        ]
-
-    if normalized_sort == "oldest":
-        filtered_rows = list(reversed(filtered_rows))
-
-    dashboard_total = len(eligible_rows)
-    total = len(filtered_rows)
-    paged_rows = filtered_rows[offset: offset + limit]
+            dashboard_total += int(qty or 0)
+            normalized_value = normalize_lookup_text(status_value)
+            if normalized_value in counters:
+                counters[normalized_value] += int(qty or 0)
+
+        if normalized_status != "todos":
+            query = query.filter(Equipment.status == normalized_status)
+        total = int(query.count() or 0)
+        if normalized_sort == "oldest":
+            query = query.order_by(Equipment.created_at.asc(), Equipment.id.asc())
+        else:
+            query = query.order_by(Equipment.created_at.desc(), Equipment.id.desc())
+        paged_rows = query.offset(offset).limit(limit).all()
     items = [
         EquipmentNewRefrigeratorItemOut(
             id=int(item.id),
@@ -1058,15 +914,11 @@ def sync_refrigerators_allocation_status(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_equipments_manager),
 ):
-    rows = (
-        db.query(Equipment)
-        .filter(
-            Equipment.category == "refrigerador",
-            Equipment.status.in_(["novo", "disponivel"]),
-        )
-        .all()
+    query = db.query(Equipment).filter(
+        Equipment.category == "refrigerador",
+        Equipment.status.in_(["novo", "disponivel"]),
     )
-    scanned_count = len(rows)
+    scanned_count = int(query.count() or 0)
     if scanned_count == 0:
         return EquipmentAllocationSyncOut(
             scanned_count=0,
@@ -1075,28 +927,17 @@ def sync_refrigerators_allocation_status(
             updated_ids=[],
         )
 
-    allocated_tokens_020220 = _refrigerator_allocated_tokens_from_020220(db)
-    returned_tokens = _returned_refrigerator_tokens_from_concluded_pickups(db)
-    if not allocated_tokens_020220:
-        return EquipmentAllocationSyncOut(
-            scanned_count=scanned_count,
-            matched_020220_count=0,
-            updated_count=0,
-            updated_ids=[],
+    with allocation_state_filter(db, still_allocated=True) as still_allocated:
+        rows = (
+            query.outerjoin(EquipmentAllocationState, EquipmentAllocationState.equipment_id == Equipment.id)
+            .filter(still_allocated)
+            .order_by(Equipment.id.asc())
+            .all()
         )
 
     updated_ids: list[int] = []
     matched_count = 0
     for row in rows:
-        if returned_tokens and _build_equipment_lookup_tokens(row.rg_code, row.tag_code).intersection(returned_tokens):
-            continue
-        if not _is_refrigerator_allocated_in_020220(
-            db,
-            rg_code=row.rg_code,
-            tag_code=row.tag_code,
-            allocated_tokens=allocated_tokens_020220,
-        ):
-            continue
         matched_count += 1
         row.status = "alocado"
         row.client_name = normalize_optional_text(row.client_name)
@@ -1118,7 +959,7 @@ def list_inventory_material_month_options(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_equipments_viewer),
 ):
-    rows = _apply_inventory_base_filter(
+    rows = apply_active_inventory_filter(
         db.query(
             PickupCatalogInventoryItem.invoice_issue_date.label("invoice_issue_date"),
             PickupCatalogInventoryItem.created_at.label("created_at"),
@@ -1157,9 +998,10 @@ def list_inventory_materials(
     normalized_item_type = _normalize_material_type(item_type_filter) if normalize_spaces(item_type_filter or "") else ""
     search = normalize_spaces(q or "")
 
-    base_query = _apply_inventory_base_filter(
+    base_query = apply_active_inventory_filter(
         db.query(
             PickupCatalogInventoryItem.id.label("inventory_item_id"),
+            PickupCatalogInventoryItem.material_bucket.label("material_bucket"),
             PickupCatalogInventoryItem.item_type.label("item_type"),
             PickupCatalogInventoryItem.description.label("model_name"),
             PickupCatalogInventoryItem.rg.label("rg_code"),
@@ -1172,10 +1014,27 @@ def list_inventory_materials(
         ).join(PickupCatalogClient, PickupCatalogClient.id == PickupCatalogInventoryItem.client_id),
         db=db,
     )
+    # Grupo e tipo filtrados no banco pelo material_bucket gravado na importação.
+    # Linhas ainda sem a coluna (backfill_pickup_catalog_material_buckets roda em
+    # background no bootstrap) passam pelo filtro e são resolvidas abaixo.
+    material_bucket = PickupCatalogInventoryItem.material_bucket
+    if normalized_group == "refrigerador":
+        base_query = base_query.filter(or_(material_bucket == "refrigerador", material_bucket.is_(None)))
+    elif normalized_group == "outros":
+        base_query = base_query.filter(or_(material_bucket != "refrigerador", material_bucket.is_(None)))
+    if normalized_item_type:
+        base_query = base_query.filter(or_(material_bucket == normalized_item_type, material_bucket.is_(None)))
 
     rows = list(base_query.all())
     normalized_rows = []
     for row in rows:
+        item_type = row.material_bucket or resolve_material_bucket(row.item_type, row.model_name)
+        if normalized_group == "refrigerador" and item_type != "refrigerador":
+            continue
+        if normalized_group == "outros" and item_type == "refrigerador":
+            continue
+        if normalized_item_type and item_type != normalized_item_type:
+            continue
         parsed_date = _parse_inventory_issue_date(row.invoice_issue_date, row.created_at)
         invoice_month = parsed_date.strftime("%Y-%m")
         invoice_year = invoice_month[:4]
@@ -1183,13 +1042,10 @@ def list_inventory_materials(
             continue
         if normalized_month and invoice_month != normalized_month:
             continue
-        stored_bucket = _material_type_bucket(normalize_spaces(row.item_type))
-        inferred_bucket = _material_type_bucket(classify_item_type(normalize_spaces(row.model_name)))
-        resolved_item_type = inferred_bucket if stored_bucket == "outro" and inferred_bucket != "outro" else stored_bucket
         normalized_rows.append(
             {
                 "inventory_item_id": int(row.inventory_item_id),
-                "item_type": resolved_item_type,
+                "item_type": item_type,
                 "model_name": normalize_spaces(row.model_name),
                 "rg_code": normalize_spaces(row.rg_code),
                 "client_code": normalize_spaces(row.client_code),
@@ -1202,14 +1058,6 @@ def list_inventory_materials(
             }
         )
 
-    if normalized_group == "refrigerador":
-        normalized_rows = [item for item in normalized_rows if item["item_type"] == "refrigerador"]
-    elif normalized_group == "outros":
-        normalized_rows = [item for item in normalized_rows if item["item_type"] != "refrigerador"]
-
-    if normalized_item_type:
-        normalized_rows = [item for item in normalized_rows if item["item_type"] == normalized_item_type]
-
     if search:
         normalized_rows = [
             item for item in normalized_rows
@@ -1269,7 +1117,7 @@ def lookup_allocated_material(
     if resolved_tag_code:
         equipment_from_tag = (
             db.query(Equipment.rg_code, Equipment.tag_code)
-            .filter(func.upper(func.coalesce(Equipment.tag_code, "")) == resolved_tag_code)
+            .filter(code_key_in(Equipment.tag_key, Equipment.tag_code, [code_key(resolved_tag_code)]))
             .order_by(Equipment.id.desc())
             .first()
         )
@@ -1280,7 +1128,7 @@ def lookup_allocated_material(
     if not resolved_tag_code and resolved_rg_code:
         equipment_from_rg = (
             db.query(Equipment.tag_code)
-            .filter(func.upper(func.coalesce(Equipment.rg_code, "")) == resolved_rg_code)
+            .filter(code_key_in(Equipment.rg_key, Equipment.rg_code, [code_key(resolved_rg_code)]))
             .order_by(Equipment.id.desc())
             .first()
         )
@@ -1289,7 +1137,7 @@ def lookup_allocated_material(
 
     output_rg_code = resolved_rg_code or normalized_rg_code
     output_tag_code = resolved_tag_code or normalized_tag_code
-    target_tokens = _build_equipment_lookup_tokens(output_rg_code, output_tag_code)
+    target_tokens = equipment_lookup_tokens(output_rg_code, output_tag_code)
     if not target_tokens:
         return EquipmentAllocationLookupOut(
             rg_code=output_rg_code,
@@ -1298,7 +1146,9 @@ def lookup_allocated_material(
             items=[],
         )
 
-    base_rows = _apply_inventory_base_filter(
+    # Itens casados pelo índice code_tokens (mesmas variantes de _build_code_lookup_tokens).
+    matched_item_ids = select(CodeToken.inventory_item_id).where(CodeToken.token.in_(sorted(target_tokens)))
+    matched_rows = apply_active_inventory_filter(
         db.query(
             PickupCatalogInventoryItem.id.label("inventory_item_id"),
             PickupCatalogInventoryItem.description.label("model_name"),
@@ -1308,16 +1158,12 @@ def lookup_allocated_material(
             PickupCatalogClient.client_code.label("client_code"),
             PickupCatalogClient.nome_fantasia.label("nome_fantasia"),
             PickupCatalogClient.setor.label("setor"),
-        ).join(PickupCatalogClient, PickupCatalogClient.id == PickupCatalogInventoryItem.client_id),
+        )
+        .join(PickupCatalogClient, PickupCatalogClient.id == PickupCatalogInventoryItem.client_id)
+        .filter(PickupCatalogInventoryItem.id.in_(matched_item_ids)),
         db=db,
     ).all()
 
-    matched_rows = []
-    for row in base_rows:
-        row_tokens = _build_code_lookup_tokens(row.rg_code)
-        if target_tokens.intersection(row_tokens):
-            matched_rows.append(row)
-
     matched_rows.sort(
         key=lambda item: (
             _parse_inventory_issue_date(item.invoice_issue_date, item.created_at),
@@ -1349,22 +1195,46 @@ def lookup_allocated_material(
     )
 
 
+@router.get("/allocations/cache-stats", response_model=EquipmentAllocationCacheStatsOut)
+def get_allocation_cache_stats(
+    current_user: User = Depends(get_equipments_viewer),
+):
+    return EquipmentAllocationCacheStatsOut(
+        enabled=allocation_token_cache.enabled,
+        inventory_revision=inventory_revision(),
+        orders_revision=orders_revision(),
+        sets=allocation_token_cache.stats(),
+    )
+
+
 @router.post("/refrigerators/import-csv", response_model=EquipmentBulkImportResultOut)
 async def import_refrigerators_csv(
     csv_file: UploadFile = File(...),
+    dry_run: bool = Query(default=False),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_equipments_manager),
 ):
-    raw_bytes = await _read_csv_upload_bytes(
+    spool_path = await _spool_csv_upload(
         csv_file,
         max_bytes=MAX_EQUIPMENT_IMPORT_CSV_BYTES,
         max_lines=MAX_EQUIPMENT_IMPORT_CSV_LINES,
         label="Arquivo CSV",
     )
+    try:
+        # Leitura do CSV e gravação no banco fora do event loop.
+        return await run_in_threadpool(_import_refrigerators_from_csv, spool_path, db, dry_run=dry_run)
+    finally:
+        spool_path.unlink(missing_ok=True)
+
 
-    text = _decode_import_csv(raw_bytes)
-    delimiter = _sniff_csv_delimiter(text)
-    reader = csv.DictReader(io.StringIO(text), delimiter=delimiter)
+def _import_refrigerators_from_csv(
+    spool_path: Path,
+    db: Session,
+    *,
+    dry_run: bool = False,
+) -> EquipmentBulkImportResultOut:
+    encoding, delimiter = _sniff_import_csv(spool_path)
+    reader = csv.DictReader(iter_csv_file_lines(spool_path, encoding), delimiter=delimiter)
     if not reader.fieldnames:
         raise HTTPException(status_code=422, detail="CSV sem cabeçalho.")
     header_map = _resolve_import_header_map([str(item or "") for item in reader.fieldnames])
@@ -1377,7 +1247,7 @@ async def import_refrigerators_csv(
         if normalized_tag:
             existing_tag_codes.add(normalized_tag)
 
-    base_inventory_tokens = _refrigerator_allocated_tokens_from_020220(db)
+    base_inventory_tokens = allocated_020220_tokens(db)
 
     total_rows = 0
     imported_count = 0
@@ -1440,7 +1310,7 @@ async def import_refrigerators_csv(
             if len(errors) < 30:
                 errors.append(f"Linha {index}: RG inválido.")
             continue
-        equipment_tokens = _build_equipment_lookup_tokens(rg_code, tag_code)
+        equipment_tokens = equipment_lookup_tokens(rg_code, tag_code)
 
         if any(token in seen_import_rg_tokens for token in rg_tokens):
             duplicates_in_file += 1
@@ -1472,6 +1342,9 @@ async def import_refrigerators_csv(
                 voltage=voltage,
                 rg_code=rg_code,
                 tag_code=tag_code,
+                rg_key=code_key(rg_code),
+                tag_key=code_key(tag_code),
+                model_key=model_key(model_name),
                 status="novo",
                 client_name=None,
                 notes=None,
@@ -1482,9 +1355,14 @@ async def import_refrigerators_csv(
         if tag_code:
             seen_import_tags.add(tag_code)
 
-    if pending_rows:
+    # Com dry_run as mesmas validações rodam, mas nada é gravado.
+    if pending_rows and not dry_run:
         try:
             db.add_all(pending_rows)
+            db.flush()
+            for row in pending_rows:
+                sync_equipment_tokens(db, row)
+            refresh_allocation_state(db, [row.id for row in pending_rows])
             db.commit()
         except IntegrityError as exc:
             db.rollback()
@@ -1497,6 +1375,7 @@ async def import_refrigerators_csv(
             ) from exc
 
     return EquipmentBulkImportResultOut(
+        dry_run=dry_run,
         total_rows=total_rows,
         imported_count=imported_count,
         duplicated_by_rg=duplicated_by_rg,
@@ -1562,12 +1441,18 @@ def create_equipment(
         voltage=resolved_voltage,
         rg_code=rg_code,
         tag_code=tag_code,
+        rg_key=code_key(rg_code),
+        tag_key=code_key(tag_code),
+        model_key=model_key(model_name),
         status=resolved_status,
         client_name=client_name,
         notes=notes,
     )
     try:
         db.add(row)
+        db.flush()
+        sync_equipment_tokens(db, row)
+        refresh_allocation_state(db, [row.id])
         db.commit()
         db.refresh(row)
     except IntegrityError as exc:
@@ -1654,11 +1539,17 @@ def update_equipment(
     row.voltage = next_voltage
     row.rg_code = next_rg_code
     row.tag_code = next_tag_code
+    row.rg_key = code_key(next_rg_code)
+    row.tag_key = code_key(next_tag_code)
+    row.model_key = model_key(next_model_name)
     row.status = next_status
     row.client_name = next_client_name
     row.notes = next_notes
 
     try:
+        db.flush()
+        sync_equipment_tokens(db, row)
+        refresh_allocation_state(db, [row.id])
         db.commit()
         db.refresh(row)
     except IntegrityError as exc:
@@ -1682,6 +1573,8 @@ def delete_equipment(
             detail="Não é permitido excluir equipamento alocado. Atualize o status antes de excluir.",
         )
 
+    delete_equipment_tokens(db, row.id)
+    delete_allocation_state(db, [row.id])
     db.delete(row)
     db.commit()
     return None
@@ -1,14 +1,18 @@
+import hashlib
 import json
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 from io import BytesIO
 from pathlib import Path
 import re
-from typing import Any
+import sys
+from typing import Any, Iterator
 from urllib.parse import quote
 from urllib.request import urlopen
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
 from sqlalchemy import func, or_
 from sqlalchemy.orm import Session, load_only
@@ -24,6 +28,7 @@ from app.core.permissions import has_permission
 from app.database.deps import get_db
 from app.models.pickup_catalog import (
     PickupCatalogClient,
+    PickupCatalogImportJob,
     PickupCatalogInventoryItem,
     PickupCatalogOrder,
     PickupCatalogOrderItem,
@@ -39,7 +44,9 @@ from app.schemas.pickup_catalog import (
     PickupCatalogOrderEmailRequestBulkOut,
     PickupCatalogOrderBulkStatusUpdateIn,
     PickupCatalogOrderBulkStatusUpdateOut,
+    PickupCatalogImportJobOut,
     PickupCatalogInventoryItemOut,
+    PickupCatalogItemTypeRulesReloadOut,
     PickupCatalogOrderOut,
     PickupCatalogOrderEmailOtherOut,
     PickupCatalogOrderEmailRefrigeratorOut,
@@ -48,17 +55,41 @@ from app.schemas.pickup_catalog import (
     PickupCatalogPdfRequest,
     PickupCatalogStats,
     PickupCatalogStatusOut,
+    PickupCatalogUploadBatchOut,
+)
+from app.services.allocation_token_cache import bump_orders_revision
+from app.services.code_tokens import code_key, code_key_in, delete_order_tokens, index_order_item_tokens
+from app.services.csv_source import (
+    CsvUploadInvalidArchiveError,
+    CsvUploadTooLargeError,
+    CsvUploadTooManyLinesError,
+    is_zip_upload_name,
+    spool_upload,
+    spool_zip_archive,
+    spool_zip_member,
+    upload_inner_suffix,
+)
+from app.services.equipment_allocation_state import (
+    equipment_ids_for_orders,
+    rebuild_allocation_state,
+    refresh_allocation_state,
 )
 from app.services.pickup_catalog_csv import (
     CLIENT_FORM_FIELDS,
     calculate_bottles_for_crates,
     canonical_code,
+    configure_item_type_rules,
     item_type_label,
-    load_clients_csv,
-    load_inventory_csv,
-    merge_clients_with_inventory_snapshots,
+)
+from app.services.pickup_catalog_import import active_batch_id, activate_batch, uses_batched_inventory
+from app.services.pickup_catalog_jobs import (
+    JOB_STATUS_RUNNING,
+    fail_interrupted_import_jobs,
+    import_job_payload,
+    submit_import_job,
 )
 from app.services.pickup_catalog_pdf import build_withdrawal_pdf
+from app.services.pickup_catalog_reclassify import reclassify_stale_inventory_items
 
 router = APIRouter(prefix="/pickup-catalog", tags=["PickupCatalog"])
 
@@ -105,19 +136,32 @@ FOLLOWUP_MINUTE = 30
 MAX_ORDERS_PAGE_SIZE = 200
 DEFAULT_ORDERS_PAGE_SIZE = 60
 CEP_LOOKUP_CACHE: dict[str, str] = {}
-ALLOWED_CSV_UPLOAD_SUFFIXES = {".csv", ".txt"}
+ALLOWED_CSV_UPLOAD_SUFFIXES = {".csv", ".txt", ".xlsx"}
+XLSX_UPLOAD_SUFFIXES = {".xlsx"}
 ALLOWED_CSV_UPLOAD_CONTENT_TYPES = {
     "",
     "text/csv",
     "application/csv",
     "text/plain",
     "application/vnd.ms-excel",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
     "application/octet-stream",
+    "application/gzip",
+    "application/x-gzip",
+    "application/zip",
+    "application/x-zip-compressed",
 }
 MAX_CLIENTS_CSV_UPLOAD_BYTES = PICKUP_CATALOG_CLIENTS_CSV_MAX_BYTES
 MAX_INVENTORY_CSV_UPLOAD_BYTES = PICKUP_CATALOG_INVENTORY_CSV_MAX_BYTES
 MAX_CLIENTS_CSV_LINES = PICKUP_CATALOG_CLIENTS_CSV_MAX_LINES
 MAX_INVENTORY_CSV_LINES = PICKUP_CATALOG_INVENTORY_CSV_MAX_LINES
+# Papel de cada arquivo do upload: (limite de bytes, limite de linhas, rótulo).
+CATALOG_UPLOAD_ROLES = {
+    "clients": (MAX_CLIENTS_CSV_UPLOAD_BYTES, MAX_CLIENTS_CSV_LINES, "CSV 01.20.11"),
+    "inventory": (MAX_INVENTORY_CSV_UPLOAD_BYTES, MAX_INVENTORY_CSV_LINES, "CSV 02.02.20"),
+}
+# Dentro de um .zip, o papel de cada membro vem do número do relatório no nome.
+CATALOG_ZIP_MEMBER_MARKERS = (("012011", "clients"), ("020220", "inventory"))
 get_pickup_catalog_status_access = require_any_permission(
     "pickups.create_order",
     "pickups.import_base",
@@ -263,38 +307,124 @@ def _today_brazil_date() -> str:
     return _now_brazil().strftime("%d/%m/%Y")
 
 
-async def _read_csv_upload_bytes(
+@contextmanager
+def _csv_upload_errors(label: str, max_bytes: int, max_lines: int) -> Iterator[None]:
+    try:
+        yield
+    except CsvUploadTooLargeError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"{label} excede o limite de {max_bytes // (1024 * 1024)} MB.",
+        ) from exc
+    except CsvUploadTooManyLinesError as exc:
+        raise HTTPException(
+            status_code=422,
+            detail=f"{label} excede o limite de {max_lines} linhas.",
+        ) from exc
+    except CsvUploadInvalidArchiveError as exc:
+        raise HTTPException(status_code=400, detail=f"{label}: {exc}.") from exc
+
+
+def _check_csv_upload_suffix(file_name: str, label: str) -> str:
+    suffix = upload_inner_suffix(file_name)
+    if suffix and suffix not in ALLOWED_CSV_UPLOAD_SUFFIXES:
+        raise HTTPException(status_code=400, detail=f"{label} deve estar em formato CSV, TXT ou XLSX (ou .gz/.zip).")
+    return suffix
+
+
+def _csv_upload_max_lines(suffix: str, max_lines: int) -> int:
+    # Planilha é um zip: contar "\n" nos bytes comprimidos não mede linhas.
+    # Vale só o limite de tamanho.
+    return sys.maxsize if suffix in XLSX_UPLOAD_SUFFIXES else max_lines
+
+
+def _non_empty_spool(spool_path: Path) -> Path | None:
+    if spool_path.stat().st_size == 0:
+        spool_path.unlink(missing_ok=True)
+        return None
+    return spool_path
+
+
+async def _spool_csv_upload(
     upload: UploadFile,
     *,
     max_bytes: int,
     max_lines: int,
     label: str,
-) -> bytes:
+    digest: Any | None = None,
+) -> Path | None:
     file_name = _safe_text(getattr(upload, "filename", ""))
-    suffix = Path(file_name).suffix.lower()
-    if suffix and suffix not in ALLOWED_CSV_UPLOAD_SUFFIXES:
-        raise HTTPException(status_code=400, detail=f"{label} deve estar em formato CSV ou TXT.")
+    suffix = _check_csv_upload_suffix(file_name, label)
 
     content_type = _safe_text(getattr(upload, "content_type", "")).lower()
     if content_type not in ALLOWED_CSV_UPLOAD_CONTENT_TYPES:
         raise HTTPException(status_code=400, detail=f"Tipo de arquivo invÃ¡lido para {label}.")
+    max_lines = _csv_upload_max_lines(suffix, max_lines)
 
-    raw_bytes = await upload.read(max_bytes + 1)
-    if len(raw_bytes) > max_bytes:
-        raise HTTPException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail=f"{label} excede o limite de {max_bytes // (1024 * 1024)} MB.",
-        )
-    if not raw_bytes:
-        return b""
+    with _csv_upload_errors(label, max_bytes, max_lines):
+        spool_path = await spool_upload(upload, max_bytes=max_bytes, max_lines=max_lines, digest=digest)
+    return _non_empty_spool(spool_path)
 
-    line_count = raw_bytes.count(b"\n") + (1 if raw_bytes else 0)
-    if line_count > max_lines + 1:
-        raise HTTPException(
-            status_code=422,
-            detail=f"{label} excede o limite de {max_lines} linhas.",
-        )
-    return raw_bytes
+
+def _zip_member_role(member: str, fallback: str | None) -> str | None:
+    digits = "".join(char for char in Path(member).name if char.isdigit())
+    for marker, role in CATALOG_ZIP_MEMBER_MARKERS:
+        if marker in digits:
+            return role
+    return fallback
+
+
+async def _spool_catalog_zip(
+    upload: UploadFile,
+    *,
+    field_role: str,
+    digests: dict[str, Any],
+) -> dict[str, tuple[Path, str]]:
+    # Um .zip pode trazer um ou os dois relatórios; cada membro é extraído em
+    # streaming com os limites do seu papel, medidos nos bytes descomprimidos.
+    field_label = CATALOG_UPLOAD_ROLES[field_role][2]
+    content_type = _safe_text(getattr(upload, "content_type", "")).lower()
+    if content_type not in ALLOWED_CSV_UPLOAD_CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Tipo de arquivo invÃ¡lido para {field_label}.")
+
+    archive_max_bytes = max(limits[0] for limits in CATALOG_UPLOAD_ROLES.values())
+    with _csv_upload_errors(field_label, archive_max_bytes, 0):
+        archive_path, members = await spool_zip_archive(upload, max_bytes=archive_max_bytes)
+    spooled: dict[str, tuple[Path, str]] = {}
+    try:
+        if not members:
+            raise HTTPException(status_code=400, detail=f"{field_label}: o .zip está vazio.")
+        for member in members:
+            role = _zip_member_role(member, field_role if len(members) == 1 else None)
+            if role is None:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Não foi possível identificar {member} no .zip (use 012011 ou 020220 no nome).",
+                )
+            if role in spooled:
+                raise HTTPException(status_code=400, detail=f"O .zip traz mais de um {CATALOG_UPLOAD_ROLES[role][2]}.")
+            max_bytes, max_lines, label = CATALOG_UPLOAD_ROLES[role]
+            suffix = _check_csv_upload_suffix(member, label)
+            max_lines = _csv_upload_max_lines(suffix, max_lines)
+            with _csv_upload_errors(label, max_bytes, max_lines):
+                spool_path = await run_in_threadpool(
+                    spool_zip_member,
+                    archive_path,
+                    member,
+                    max_bytes=max_bytes,
+                    max_lines=max_lines,
+                    digest=digests[role],
+                )
+            spool_path = _non_empty_spool(spool_path)
+            if spool_path is not None:
+                spooled[role] = (spool_path, Path(member).name)
+    except BaseException:
+        for spool_path, _ in spooled.values():
+            spool_path.unlink(missing_ok=True)
+        raise
+    finally:
+        archive_path.unlink(missing_ok=True)
+    return spooled
 
 
 def _is_after_followup_time(now_brazil: datetime) -> bool:
@@ -379,22 +509,6 @@ def _client_payload_from_model(client: PickupCatalogClient | None, fallback_code
     }
 
 
-def _apply_payload_to_client(client: PickupCatalogClient, payload: dict[str, str]) -> None:
-    client.nome_fantasia = _safe_text(payload.get("nome_fantasia"))
-    client.razao_social = _safe_text(payload.get("razao_social"))
-    client.cnpj_cpf = _safe_text(payload.get("cnpj_cpf"))
-    client.setor = _safe_text(payload.get("setor"))
-    client.telefone = _safe_text(payload.get("telefone"))
-    client.endereco = _safe_text(payload.get("endereco"))
-    client.bairro = _safe_text(payload.get("bairro"))
-    client.cidade = _safe_text(payload.get("cidade"))
-    client.cep = _safe_text(payload.get("cep"))
-    client.inscricao_estadual = _safe_text(payload.get("inscricao_estadual"))
-    client.responsavel_cliente = _safe_text(payload.get("responsavel_cliente"))
-    client.responsavel_retirada = _safe_text(payload.get("responsavel_retirada"))
-    client.responsavel_conferencia = _safe_text(payload.get("responsavel_conferencia"))
-
-
 def _merge_client_form_with_db(form_client: dict[str, str], model: PickupCatalogClient | None) -> dict[str, str]:
     merged = dict(form_client)
     if not model:
@@ -500,7 +614,7 @@ def _build_summary(lines: list[dict[str, Any]]) -> str:
 
 
 def _normalize_code_key(value: Any) -> str:
-    return re.sub(r"\s+", "", _safe_text(value)).upper()
+    return code_key(value)
 
 
 def _looks_like_refrigerator(item_type: Any, rg_value: Any) -> bool:
@@ -589,7 +703,7 @@ def _apply_refrigerator_condition_to_equipments(
         db.query(Equipment)
         .filter(
             Equipment.category == "refrigerador",
-            func.replace(func.upper(Equipment.rg_code), " ", "").in_(normalized_rgs),
+            code_key_in(Equipment.rg_key, Equipment.rg_code, normalized_rgs),
         )
         .all()
     )
@@ -598,6 +712,12 @@ def _apply_refrigerator_condition_to_equipments(
         equipment.client_name = None
 
 
+def _refresh_allocation_state_for_orders(db: Session, order_ids: list[int]) -> None:
+    # Depois do commit do status: o conjunto de retiradas concluídas já é o novo.
+    refresh_allocation_state(db, equipment_ids_for_orders(db, order_ids))
+    db.commit()
+
+
 def _equipment_by_type(items: list[PickupCatalogInventoryItem]) -> dict[str, list[dict[str, Any]]]:
     grouped: dict[str, dict[str, dict[str, Any]]] = {}
     for item in items:
@@ -640,45 +760,17 @@ def _open_equipment_summary(items: list[PickupCatalogInventoryItem], selected_ty
     return lines
 
 
-def _prepare_merged_clients(
-    client_rows: dict[str, dict[str, str]],
-    inventory_rows: dict[str, list[dict[str, Any]]],
-) -> dict[str, dict[str, str]]:
-    merged = merge_clients_with_inventory_snapshots(client_rows, inventory_rows)
-    for code, payload in merged.items():
-        payload["client_code"] = _safe_text(payload.get("client_code")) or code
-    return merged
-
-
-def _latest_batch_id(db: Session) -> int | None:
-    row = (
-        db.query(PickupCatalogUploadBatch.id)
-        .order_by(PickupCatalogUploadBatch.id.desc())
-        .first()
-    )
-    return int(row[0]) if row else None
-
-
-def _uses_batched_inventory(db: Session) -> bool:
-    return (
-        db.query(PickupCatalogInventoryItem.id)
-        .filter(PickupCatalogInventoryItem.batch_id.isnot(None))
-        .first()
-        is not None
-    )
-
-
 def _load_inventory_items_for_client(db: Session, client_id: int) -> list[PickupCatalogInventoryItem]:
     query = db.query(PickupCatalogInventoryItem).filter(
         PickupCatalogInventoryItem.client_id == client_id,
         PickupCatalogInventoryItem.open_quantity > 0,
     )
 
-    if _uses_batched_inventory(db):
-        latest_batch_id = _latest_batch_id(db)
-        if latest_batch_id is None:
+    if uses_batched_inventory(db):
+        current_batch_id = active_batch_id(db)
+        if current_batch_id is None:
             return []
-        query = query.filter(PickupCatalogInventoryItem.batch_id == latest_batch_id)
+        query = query.filter(PickupCatalogInventoryItem.batch_id == current_batch_id)
 
     return query.order_by(PickupCatalogInventoryItem.item_type.asc(), PickupCatalogInventoryItem.description.asc()).all()
 
@@ -705,7 +797,8 @@ def _order_out(order: PickupCatalogOrder, has_refrigerator: bool = False) -> Pic
 
 
 def _latest_status(db: Session) -> tuple[bool, PickupCatalogStats, datetime | None]:
-    latest_batch = db.query(PickupCatalogUploadBatch).order_by(PickupCatalogUploadBatch.id.desc()).first()
+    current_batch_id = active_batch_id(db)
+    latest_batch = db.get(PickupCatalogUploadBatch, current_batch_id) if current_batch_id is not None else None
     if latest_batch:
         stats = PickupCatalogStats(
             clients_count=int(latest_batch.clients_count or 0),
@@ -812,75 +905,6 @@ def _safe_filename_chunk(text: str) -> str:
     return chunk.strip("_") or "sem_codigo"
 
 
-def _load_existing_clients_rows(db: Session) -> dict[str, dict[str, str]]:
-    clients = db.query(PickupCatalogClient).all()
-    rows: dict[str, dict[str, str]] = {}
-    for client in clients:
-        code = canonical_code(_safe_text(client.client_code))
-        if not code:
-            continue
-        payload = _client_payload_from_model(client, fallback_code=code)
-        payload["client_code"] = _safe_text(payload.get("client_code")) or code
-        rows[code] = payload
-    return rows
-
-
-def _load_existing_inventory_rows(db: Session) -> dict[str, list[dict[str, Any]]]:
-    query = db.query(PickupCatalogInventoryItem)
-    if _uses_batched_inventory(db):
-        latest_batch_id = _latest_batch_id(db)
-        if latest_batch_id is None:
-            return {}
-        query = query.filter(PickupCatalogInventoryItem.batch_id == latest_batch_id)
-
-    inventory_items = query.order_by(
-        PickupCatalogInventoryItem.client_id.asc(),
-        PickupCatalogInventoryItem.id.asc(),
-    ).all()
-    if not inventory_items:
-        return {}
-
-    client_ids = sorted({
-        int(item.client_id)
-        for item in inventory_items
-        if int(item.client_id or 0) > 0
-    })
-    clients_by_id: dict[int, PickupCatalogClient] = {}
-    if client_ids:
-        client_rows = (
-            db.query(PickupCatalogClient)
-            .filter(PickupCatalogClient.id.in_(client_ids))
-            .all()
-        )
-        clients_by_id = {int(client.id): client for client in client_rows}
-
-    result: dict[str, list[dict[str, Any]]] = {}
-    row_number = 0
-    for item in inventory_items:
-        client = clients_by_id.get(int(item.client_id or 0))
-        code = canonical_code(_safe_text(getattr(client, "client_code", "")))
-        if not code:
-            continue
-
-        row_number += 1
-        client_snapshot = _client_payload_from_model(client, fallback_code=code)
-        result.setdefault(code, []).append({
-            "id": f"db_{row_number}",
-            "description": _safe_text(item.description),
-            "open_quantity": int(item.open_quantity or 0),
-            "item_type": _safe_text(item.item_type) or "outro",
-            "rg": _safe_text(item.rg),
-            "comodato_number": _safe_text(item.comodato_number),
-            "issue_date": _safe_text(item.invoice_issue_date),
-            "volume_key": _safe_text(item.volume_key),
-            "source_baixados": int(item.source_baixados or 0),
-            "product_code": _safe_text(item.product_code),
-            "client_snapshot": client_snapshot,
-        })
-
-    return result
-
-
 @router.get("/status", response_model=PickupCatalogStatusOut)
 def get_status(
     db: Session = Depends(get_db),
@@ -890,155 +914,157 @@ def get_status(
     return PickupCatalogStatusOut(dataset_ready=dataset_ready, loaded_at=loaded_at, stats=stats)
 
 
-@router.post("/upload-csv")
+@router.post(
+    "/upload-csv",
+    response_model=PickupCatalogImportJobOut,
+    status_code=status.HTTP_202_ACCEPTED,
+)
 async def upload_csv(
     clients_csv: UploadFile | None = File(default=None),
     inventory_csv: UploadFile | None = File(default=None),
+    incremental: bool = Query(default=False),
+    dry_run: bool = Query(default=False),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_pickup_catalog_import_access),
 ):
-    clients_bytes = (
-        await _read_csv_upload_bytes(
-            clients_csv,
-            max_bytes=MAX_CLIENTS_CSV_UPLOAD_BYTES,
-            max_lines=MAX_CLIENTS_CSV_LINES,
-            label="CSV 01.20.11",
-        )
-        if clients_csv
-        else b""
-    )
-    inventory_bytes = (
-        await _read_csv_upload_bytes(
-            inventory_csv,
-            max_bytes=MAX_INVENTORY_CSV_UPLOAD_BYTES,
-            max_lines=MAX_INVENTORY_CSV_LINES,
-            label="CSV 02.02.20",
-        )
-        if inventory_csv
-        else b""
-    )
-
-    has_clients_upload = bool(clients_bytes)
-    has_inventory_upload = bool(inventory_bytes)
-    if not has_clients_upload and not has_inventory_upload:
-        raise HTTPException(
-            status_code=400,
-            detail="Envie ao menos um arquivo CSV (01.20.11 ou 02.02.20).",
-        )
-
+    # A importação roda em segundo plano; os CSVs ficam em disco até o job terminar.
+    # Com dry_run, o job só valida os arquivos e nada é gravado na base.
+    # Cada campo aceita CSV/TXT/XLSX, .gz ou um .zip com um ou os dois relatórios.
+    spooled: dict[str, tuple[Path, str]] = {}
+    digests = {role: hashlib.sha256() for role in CATALOG_UPLOAD_ROLES}
+    submitted = False
     try:
-        clients_rows = (
-            load_clients_csv(clients_bytes)
-            if has_clients_upload
-            else _load_existing_clients_rows(db)
-        )
-        inventory_rows = (
-            load_inventory_csv(inventory_bytes)
-            if has_inventory_upload
-            else _load_existing_inventory_rows(db)
-        )
-        merged_clients = _prepare_merged_clients(clients_rows, inventory_rows)
-    except ValueError as exc:
-        raise HTTPException(status_code=422, detail=str(exc)) from exc
+        for field_role, upload in (("clients", clients_csv), ("inventory", inventory_csv)):
+            if not upload:
+                continue
+            file_name = _safe_text(upload.filename)
+            if is_zip_upload_name(file_name):
+                sources = await _spool_catalog_zip(upload, field_role=field_role, digests=digests)
+            else:
+                max_bytes, max_lines, label = CATALOG_UPLOAD_ROLES[field_role]
+                spool_path = await _spool_csv_upload(
+                    upload,
+                    max_bytes=max_bytes,
+                    max_lines=max_lines,
+                    label=label,
+                    digest=digests[field_role],
+                )
+                sources = {field_role: (spool_path, file_name)} if spool_path is not None else {}
+            duplicated = [role for role in sources if role in spooled]
+            for role, source in sources.items():
+                if role in duplicated:
+                    source[0].unlink(missing_ok=True)
+                else:
+                    spooled[role] = source
+            if duplicated:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"{CATALOG_UPLOAD_ROLES[duplicated[0]][2]} foi enviado mais de uma vez.",
+                )
 
-    # A importação funciona como "snapshot": sempre substitui a base anterior
-    # para evitar crescimento contínuo de armazenamento.
-    db.query(PickupCatalogInventoryItem).delete(synchronize_session=False)
-    db.query(PickupCatalogUploadBatch).delete(synchronize_session=False)
-
-    all_codes = sorted(merged_clients.keys())
-    referenced_client_ids = {
-        int(row[0])
-        for row in (
-            db.query(PickupCatalogOrder.client_id)
-            .filter(PickupCatalogOrder.client_id.isnot(None))
-            .distinct()
-            .all()
+        if not spooled:
+            raise HTTPException(
+                status_code=400,
+                detail="Envie ao menos um arquivo CSV (01.20.11 ou 02.02.20).",
+            )
+
+        clients_path, clients_file_name = spooled.get("clients", (None, ""))
+        inventory_path, inventory_file_name = spooled.get("inventory", (None, ""))
+        # Gravação do job (commit/refresh) fora do event loop.
+        job = await run_in_threadpool(
+            submit_import_job,
+            db,
+            clients_path=clients_path,
+            inventory_path=inventory_path,
+            clients_file_name=clients_file_name,
+            inventory_file_name=inventory_file_name,
+            incremental=incremental,
+            dry_run=dry_run,
+            clients_sha256=digests["clients"].hexdigest() if clients_path else "",
+            inventory_sha256=digests["inventory"].hexdigest() if inventory_path else "",
+            requested_by=_safe_text(getattr(current_user, "name", "")) or _safe_text(getattr(current_user, "email", "")),
         )
-        if row and row[0] is not None
-    }
+        submitted = True
+        return PickupCatalogImportJobOut(**import_job_payload(job))
+    finally:
+        if not submitted:
+            for spool_path, _ in spooled.values():
+                spool_path.unlink(missing_ok=True)
 
-    stale_clients_query = db.query(PickupCatalogClient)
-    if all_codes:
-        stale_clients_query = stale_clients_query.filter(~PickupCatalogClient.client_code.in_(all_codes))
-    if referenced_client_ids:
-        stale_clients_query = stale_clients_query.filter(~PickupCatalogClient.id.in_(referenced_client_ids))
-    stale_clients_query.delete(synchronize_session=False)
 
-    batch = PickupCatalogUploadBatch(
-        clients_file_name=_safe_text(clients_csv.filename) if has_clients_upload and clients_csv else "",
-        inventory_file_name=_safe_text(inventory_csv.filename) if has_inventory_upload and inventory_csv else "",
+@router.get("/import-jobs/{job_id}", response_model=PickupCatalogImportJobOut)
+def get_import_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_pickup_catalog_import_access),
+):
+    job = db.get(PickupCatalogImportJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Importação não encontrada.")
+    # Job de um processo encerrado (heartbeat parado) aparece como falho, sem
+    # esperar o próximo bootstrap.
+    if job.status == JOB_STATUS_RUNNING and fail_interrupted_import_jobs(db):
+        db.refresh(job)
+    return PickupCatalogImportJobOut(**import_job_payload(job))
+
+
+def _upload_batch_out(batch: PickupCatalogUploadBatch, current_batch_id: int | None) -> PickupCatalogUploadBatchOut:
+    return PickupCatalogUploadBatchOut(
+        id=batch.id,
+        active=batch.id == current_batch_id,
+        clients_file_name=_safe_text(batch.clients_file_name),
+        inventory_file_name=_safe_text(batch.inventory_file_name),
+        clients_count=int(batch.clients_count or 0),
+        inventory_clients=int(batch.inventory_clients or 0),
+        open_items=int(batch.open_items or 0),
+        uploaded_at=batch.uploaded_at,
+        activated_at=batch.activated_at,
+        import_profile=json.loads(batch.import_profile) if _safe_text(batch.import_profile) else None,
     )
-    db.add(batch)
-    db.flush()
 
-    existing_clients: dict[str, PickupCatalogClient] = {}
-    if all_codes:
-        existing_rows = db.query(PickupCatalogClient).filter(PickupCatalogClient.client_code.in_(all_codes)).all()
-        existing_clients = {row.client_code: row for row in existing_rows}
 
-    for code, payload in merged_clients.items():
-        client_model = existing_clients.get(code)
-        if not client_model:
-            client_model = PickupCatalogClient(client_code=code)
-            db.add(client_model)
-            existing_clients[code] = client_model
-        _apply_payload_to_client(client_model, payload)
-
-    db.flush()
-
-    open_items = 0
-    for code, items in inventory_rows.items():
-        client_model = existing_clients.get(code)
-        if not client_model:
-            client_model = PickupCatalogClient(client_code=code)
-            db.add(client_model)
-            db.flush()
-            existing_clients[code] = client_model
-
-        for item in items:
-            db.add(
-                PickupCatalogInventoryItem(
-                    client_id=client_model.id,
-                    batch_id=batch.id,
-                    description=_safe_text(item.get("description")),
-                    item_type=_safe_text(item.get("item_type")) or "outro",
-                    open_quantity=int(item.get("open_quantity", 0) or 0),
-                    rg=_safe_text(item.get("rg")),
-                    comodato_number=_safe_text(item.get("comodato_number")),
-                    invoice_issue_date=_safe_text(item.get("issue_date")),
-                    volume_key=_safe_text(item.get("volume_key")),
-                    source_baixados=int(item.get("source_baixados", 0) or 0),
-                    product_code=_safe_text(item.get("product_code")),
-                )
-            )
-            open_items += 1
+@router.get("/batches", response_model=list[PickupCatalogUploadBatchOut])
+def list_upload_batches(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_pickup_catalog_import_access),
+):
+    current_batch_id = active_batch_id(db)
+    batches = db.query(PickupCatalogUploadBatch).order_by(PickupCatalogUploadBatch.id.desc()).all()
+    return [_upload_batch_out(batch, current_batch_id) for batch in batches]
 
-    batch.clients_count = len(merged_clients)
-    batch.inventory_clients = len(inventory_rows)
-    batch.open_items = open_items
 
+@router.post("/batches/{batch_id}/activate", response_model=PickupCatalogUploadBatchOut)
+def activate_upload_batch(
+    batch_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_pickup_catalog_import_access),
+):
+    # Volta para um lote mantido; lotes nunca ativados podem estar incompletos.
+    batch = db.get(PickupCatalogUploadBatch, batch_id)
+    if batch is None or batch.activated_at is None:
+        raise HTTPException(status_code=404, detail="Lote não encontrado ou indisponível para ativação.")
+    activate_batch(db, batch.id)
     db.commit()
+    rebuild_allocation_state(db)
+    db.refresh(batch)
+    return _upload_batch_out(batch, batch.id)
 
-    if has_clients_upload and has_inventory_upload:
-        message = "Dados gravados com sucesso. Base anterior substituída."
-    elif has_clients_upload:
-        message = "Dados gravados com sucesso. Atualização parcial aplicada (01.20.11)."
-    else:
-        message = "Dados gravados com sucesso. Atualização parcial aplicada (02.02.20)."
 
-    return {
-        "message": message,
-        "updated_sources": {
-            "clients_012011": has_clients_upload,
-            "inventory_020220": has_inventory_upload,
-        },
-        "stats": {
-            "clients_count": batch.clients_count,
-            "inventory_clients": batch.inventory_clients,
-            "open_items": batch.open_items,
-        },
-    }
+@router.post("/item-type-rules/reload", response_model=PickupCatalogItemTypeRulesReloadOut)
+def reload_item_type_rules(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_pickup_catalog_import_access),
+):
+    try:
+        rules_version = configure_item_type_rules()
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+
+    reclassified = reclassify_stale_inventory_items(db)
+    return PickupCatalogItemTypeRulesReloadOut(
+        rules_version=rules_version,
+        reclassified_items=reclassified,
+    )
 
 
 @router.get("/client/{client_code}", response_model=PickupCatalogClientOut)
@@ -1186,6 +1212,8 @@ def update_order_status(
     order.email_request_updated_at = _now_brazil()
     order.email_request_updated_by = _safe_text(getattr(current_user, "name", "")) or _safe_text(getattr(current_user, "email", ""))
     db.commit()
+    bump_orders_revision()
+    _refresh_allocation_state_for_orders(db, [order_id])
     db.refresh(order)
     return _order_out(order, has_refrigerator=has_refrigerator)
 
@@ -1249,6 +1277,8 @@ def bulk_update_order_status(
                 _apply_refrigerator_condition_to_equipments(db, order_refrigerator_items, refrigerator_condition)
 
     db.commit()
+    bump_orders_revision()
+    _refresh_allocation_state_for_orders(db, order_ids)
 
     output_orders = (
         db.query(PickupCatalogOrder)
@@ -1305,7 +1335,7 @@ def get_order_email_request(
     if normalized_rgs:
         matched_equipments = (
             db.query(Equipment)
-            .filter(func.replace(func.upper(Equipment.rg_code), " ", "").in_(normalized_rgs))
+            .filter(code_key_in(Equipment.rg_key, Equipment.rg_code, normalized_rgs))
             .all()
         )
         equipment_by_rg = {
@@ -1423,6 +1453,7 @@ def delete_order(
             detail="A exclusao e permitida apenas para ordens canceladas.",
         )
 
+    delete_order_tokens(db, order_id)
     (
         db.query(PickupCatalogOrderItem)
         .filter(PickupCatalogOrderItem.order_id == order_id)
@@ -1581,10 +1612,13 @@ def create_order_pdf(
                 quantity=int(line.get("quantity", 0) or 0),
                 quantity_text=_safe_text(line.get("quantity_text")),
                 rg=_safe_text(line.get("rg")),
+                rg_key=code_key(line.get("rg")),
                 comodato_number=_safe_text(line.get("comodato_number")),
                 volume_key=_safe_text(line.get("volume_key")),
             )
         )
+    db.flush()
+    index_order_item_tokens(db, order.id)
 
     db.commit()
 
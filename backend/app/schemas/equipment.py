@@ -156,6 +156,7 @@ class EquipmentInventoryMaterialListOut(BaseModel):
 
 
 class EquipmentBulkImportResultOut(BaseModel):
+    dry_run: bool = False
     total_rows: int
     imported_count: int
     duplicated_by_rg: int
@@ -185,6 +186,23 @@ class EquipmentAllocationLookupOut(BaseModel):
     items: list[EquipmentAllocationLookupItemOut]
 
 
+class EquipmentAllocationCacheSetOut(BaseModel):
+    name: str
+    hits: int
+    misses: int
+    hit_rate: float
+    last_rebuild_ms: float
+    total_rebuild_ms: float
+    tokens: int
+
+
+class EquipmentAllocationCacheStatsOut(BaseModel):
+    enabled: bool
+    inventory_revision: int
+    orders_revision: int
+    sets: list[EquipmentAllocationCacheSetOut]
+
+
 class EquipmentAllocationSyncOut(BaseModel):
     scanned_count: int
     matched_020220_count: int
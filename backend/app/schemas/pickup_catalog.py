@@ -18,6 +18,42 @@ class PickupCatalogStatusOut(BaseModel):
     stats: PickupCatalogStats
 
 
+class PickupCatalogItemTypeRulesReloadOut(BaseModel):
+    rules_version: int
+    reclassified_items: int = 0
+
+
+class PickupCatalogImportJobOut(BaseModel):
+    id: int
+    status: str
+    stage: str = ""
+    rows_processed: int = 0
+    rows_per_second: float = 0.0
+    incremental: bool = False
+    dry_run: bool = False
+    clients_file_name: str = ""
+    inventory_file_name: str = ""
+    requested_by: str = ""
+    error: str = ""
+    result: Optional[dict] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+class PickupCatalogUploadBatchOut(BaseModel):
+    id: int
+    active: bool = False
+    clients_file_name: str = ""
+    inventory_file_name: str = ""
+    clients_count: int = 0
+    inventory_clients: int = 0
+    open_items: int = 0
+    uploaded_at: Optional[datetime] = None
+    activated_at: Optional[datetime] = None
+    import_profile: Optional[dict] = None
+
+
 class PickupCatalogClientData(BaseModel):
     client_code: str = ""
     nome_fantasia: str = ""
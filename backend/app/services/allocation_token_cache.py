@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Callable, Hashable, Iterable
+
+from app.core.config import EQUIPMENT_ALLOCATION_TOKEN_CACHE
+
+
+# Conjuntos de tokens de RG/etiqueta usados nas telas de equipamentos (alocados
+# na base 02.02.20 e devolvidos por retiradas concluídas), guardados no processo.
+# Cada conjunto é reconstruído quando a chave muda: lote ativo + revisão da base
+# para o 02.02.20, revisão das ordens para as retiradas. As revisões sobem depois
+# do commit de quem altera os dados (importação, reclassificação, status de ordem).
+ALLOCATED_020220_TOKENS = "allocated_020220"
+RETURNED_PICKUP_TOKENS = "returned_pickups"
+
+_revision_lock = threading.Lock()
+_revisions = {"inventory": 0, "orders": 0}
+
+
+def bump_inventory_revision() -> None:
+    with _revision_lock:
+        _revisions["inventory"] += 1
+
+
+def bump_orders_revision() -> None:
+    with _revision_lock:
+        _revisions["orders"] += 1
+
+
+def inventory_revision() -> int:
+    return _revisions["inventory"]
+
+
+def orders_revision() -> int:
+    return _revisions["orders"]
+
+
+class TokenSetCache:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._entries: dict[str, tuple[Hashable, frozenset[str]]] = {}
+        self._stats: dict[str, dict[str, Any]] = {}
+
+    def _stat(self, name: str) -> dict[str, Any]:
+        return self._stats.setdefault(
+            name,
+            {"hits": 0, "misses": 0, "last_rebuild_ms": 0.0, "total_rebuild_ms": 0.0, "tokens": 0},
+        )
+
+    def get(self, name: str, key: Hashable, build: Callable[[], Iterable[str]]) -> frozenset[str]:
+        with self._lock:
+            stat = self._stat(name)
+            entry = self._entries.get(name)
+            if self.enabled and entry is not None and entry[0] == key:
+                stat["hits"] += 1
+                return entry[1]
+            stat["misses"] += 1
+
+        # A reconstrução roda fora da trava: duas requisições simultâneas podem
+        # reconstruir o mesmo conjunto, e a última gravação vale.
+        started = time.perf_counter()
+        value = frozenset(build())
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        with self._lock:
+            stat = self._stat(name)
+            stat["last_rebuild_ms"] = elapsed_ms
+            stat["total_rebuild_ms"] = round(stat["total_rebuild_ms"] + elapsed_ms, 1)
+            stat["tokens"] = len(value)
+            if self.enabled:
+                self._entries[name] = (key, value)
+        return value
+
+    def stats(self) -> list[dict[str, Any]]:
+        with self._lock:
+            rows = []
+            for name in sorted(self._stats):
+                stat = self._stats[name]
+                requests = stat["hits"] + stat["misses"]
+                rows.append(
+                    {
+                        "name": name,
+                        **stat,
+                        "hit_rate": round(stat["hits"] / requests, 4) if requests else 0.0,
+                    }
+                )
+            return rows
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._stats.clear()
+
+
+allocation_token_cache = TokenSetCache(enabled=EQUIPMENT_ALLOCATION_TOKEN_CACHE)
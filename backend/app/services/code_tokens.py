@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import re
+from typing import Any, Iterable
+
+from sqlalchemy import and_, bindparam, delete, exists, func, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from app.models.code_token import CodeToken
+from app.models.equipment import Equipment
+from app.models.pickup_catalog import PickupCatalogInventoryItem, PickupCatalogOrderItem
+from app.services.pg_copy import copy_rows
+
+
+# Índice persistido das variantes de RG/etiqueta: a consulta de alocação vira um
+# join indexado em vez de gerar os tokens de toda a base 02.02.20 a cada pedido.
+# Os tokens são gravados junto com as linhas de origem (importação, cadastro de
+# equipamentos, ordens de retirada) e apagados antes delas.
+CODE_TOKEN_CHUNK_ROWS = 5000
+CODE_TOKEN_DELETE_CHUNK = 1000
+
+_SPACES_RE = re.compile(r"\s+")
+_NON_ALNUM_RE = re.compile(r"[^A-Z0-9]+")
+_NON_DIGIT_RE = re.compile(r"\D+")
+
+
+def code_key(value: Any) -> str:
+    # Chave de igualdade de RG/etiqueta (sem espaços, maiúsculas), gravada nas
+    # colunas rg_key/tag_key para a comparação usar índice.
+    return _SPACES_RE.sub("", str(value or "").strip()).upper()
+
+
+def code_key_in(key_column: Any, code_column: Any, keys: Iterable[str]) -> Any:
+    # Filtro pela chave indexada. Linhas ainda sem chave (o backfill_code_keys
+    # roda em background no bootstrap) caem na comparação normalizada antiga.
+    keys = list(keys)
+    return or_(
+        key_column.in_(keys),
+        and_(key_column.is_(None), func.replace(func.upper(code_column), " ", "").in_(keys)),
+    )
+
+
+def model_key(value: Any) -> str:
+    # Chave de ordenação do modelo (lower() do Python). O lower() do SQLite só
+    # trata ASCII: "Única" ficaria fora de ordem.
+    return _SPACES_RE.sub(" ", str(value or "").strip()).lower()
+
+
+def build_code_tokens(value: str | None) -> set[str]:
+    # Até três variantes: como digitado (maiúsculas), só letras/dígitos e só dígitos.
+    normalized = _SPACES_RE.sub(" ", str(value or "").strip())
+    if not normalized:
+        return set()
+    upper = normalized.upper()
+    compact = _NON_ALNUM_RE.sub("", upper)
+    digits = _NON_DIGIT_RE.sub("", upper)
+    tokens = {upper}
+    if compact:
+        tokens.add(compact)
+    if digits:
+        tokens.add(digits)
+    return {token for token in tokens if token}
+
+
+def _token_rows(column: str, rows: Iterable[tuple[Any, ...]]) -> list[dict[str, Any]]:
+    # Cada linha de entrada é (id, valor, valor, ...); tokens repetidos na mesma
+    # linha de origem são gravados uma vez só.
+    token_rows: list[dict[str, Any]] = []
+    for row_id, *values in rows:
+        tokens: set[str] = set()
+        for value in values:
+            tokens.update(build_code_tokens(value))
+        token_rows.extend({"token": token, column: int(row_id)} for token in tokens)
+    return token_rows
+
+
+def _copy_token_rows(db: Session, column: str, token_rows: list[dict[str, Any]]) -> None:
+    copy_rows(
+        db,
+        CodeToken.__tablename__,
+        ("token", column),
+        [(row["token"], row[column]) for row in token_rows],
+    )
+
+
+def _insert_tokens(db: Session, column: str, rows: Iterable[tuple[Any, ...]]) -> int:
+    # COPY no PostgreSQL (como os itens em pickup_catalog_bulk); executemany nos demais.
+    token_rows = _token_rows(column, rows)
+    if not token_rows:
+        return 0
+    if db.get_bind().dialect.name == "postgresql":
+        _copy_token_rows(db, column, token_rows)
+        return len(token_rows)
+    table = CodeToken.__table__
+    for start in range(0, len(token_rows), CODE_TOKEN_CHUNK_ROWS):
+        db.execute(insert(table), token_rows[start:start + CODE_TOKEN_CHUNK_ROWS])
+    return len(token_rows)
+
+
+def _delete_tokens_by_ids(db: Session, column: str, row_ids: list[int]) -> None:
+    table = CodeToken.__table__
+    for start in range(0, len(row_ids), CODE_TOKEN_DELETE_CHUNK):
+        chunk = row_ids[start:start + CODE_TOKEN_DELETE_CHUNK]
+        db.execute(delete(table).where(table.c[column].in_(chunk)))
+
+
+def index_inventory_tokens(db: Session, batch_id: int | None) -> int:
+    # Indexa os itens do lote que ainda não têm tokens: o lote novo inteiro no
+    # snapshot, só os inseridos/alterados no incremental. Paginado por id.
+    items = PickupCatalogInventoryItem.__table__
+    tokens = CodeToken.__table__
+    batch_filter = items.c.batch_id.is_(None) if batch_id is None else items.c.batch_id == batch_id
+    written = 0
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(items.c.id, items.c.rg)
+            .where(
+                batch_filter,
+                items.c.id > last_id,
+                items.c.rg != "",
+                ~exists().where(tokens.c.inventory_item_id == items.c.id),
+            )
+            .order_by(items.c.id.asc())
+            .limit(CODE_TOKEN_CHUNK_ROWS)
+        ).all()
+        if not rows:
+            return written
+        written += _insert_tokens(db, "inventory_item_id", rows)
+        last_id = int(rows[-1][0])
+
+
+def delete_inventory_item_tokens(db: Session, item_ids: list[int]) -> None:
+    _delete_tokens_by_ids(db, "inventory_item_id", [int(item_id) for item_id in item_ids])
+
+
+def delete_batch_inventory_tokens(db: Session, batch_id: int | None) -> None:
+    items = PickupCatalogInventoryItem.__table__
+    tokens = CodeToken.__table__
+    batch_filter = items.c.batch_id.is_(None) if batch_id is None else items.c.batch_id == batch_id
+    db.execute(delete(tokens).where(tokens.c.inventory_item_id.in_(select(items.c.id).where(batch_filter))))
+
+
+def sync_equipment_tokens(db: Session, equipment: Equipment) -> None:
+    # Regrava os tokens do equipamento (o id já precisa existir: flush antes).
+    tokens = CodeToken.__table__
+    db.execute(delete(tokens).where(tokens.c.equipment_id == equipment.id))
+    _insert_tokens(db, "equipment_id", [(equipment.id, equipment.rg_code, equipment.tag_code)])
+
+
+def delete_equipment_tokens(db: Session, equipment_id: int) -> None:
+    tokens = CodeToken.__table__
+    db.execute(delete(tokens).where(tokens.c.equipment_id == equipment_id))
+
+
+def index_order_item_tokens(db: Session, order_id: int) -> int:
+    order_items = PickupCatalogOrderItem.__table__
+    rows = db.execute(
+        select(order_items.c.id, order_items.c.rg).where(
+            order_items.c.order_id == order_id,
+            order_items.c.rg != "",
+        )
+    ).all()
+    return _insert_tokens(db, "order_item_id", rows)
+
+
+def delete_order_tokens(db: Session, order_id: int) -> None:
+    order_items = PickupCatalogOrderItem.__table__
+    tokens = CodeToken.__table__
+    db.execute(
+        delete(tokens).where(
+            tokens.c.order_item_id.in_(select(order_items.c.id).where(order_items.c.order_id == order_id))
+        )
+    )
+
+
+def backfill_code_tokens(db: Session) -> int:
+    # Bases gravadas antes do índice: indexa o que ainda não tem tokens, lote a
+    # lote (cada um confirmado separadamente). Nas execuções seguintes só
+    # encontra linhas sem RG/etiqueta e termina logo.
+    items = PickupCatalogInventoryItem.__table__
+    equipments = Equipment.__table__
+    order_items = PickupCatalogOrderItem.__table__
+    tokens = CodeToken.__table__
+
+    written = 0
+    batch_ids = [row[0] for row in db.execute(select(items.c.batch_id).distinct()).all()]
+    for batch_id in batch_ids:
+        written += index_inventory_tokens(db, batch_id)
+        db.commit()
+
+    for column, table, code_columns in (
+        ("equipment_id", equipments, (equipments.c.rg_code, equipments.c.tag_code)),
+        ("order_item_id", order_items, (order_items.c.rg,)),
+    ):
+        last_id = 0
+        while True:
+            rows = db.execute(
+                select(table.c.id, *code_columns)
+                .where(
+                    table.c.id > last_id,
+                    or_(*(code_column != "" for code_column in code_columns)),
+                    ~exists().where(tokens.c[column] == table.c.id),
+                )
+                .order_by(table.c.id.asc())
+                .limit(CODE_TOKEN_CHUNK_ROWS)
+            ).all()
+            if not rows:
+                break
+            written += _insert_tokens(db, column, rows)
+            db.commit()
+            last_id = int(rows[-1][0])
+    return written
+
+
+def backfill_code_keys(db: Session) -> int:
+    # Linhas gravadas antes das colunas rg_key/tag_key/model_key (NULL), em
+    # lotes por id; cada lote é confirmado separadamente.
+    written = 0
+    for table, key_columns in (
+        (
+            Equipment.__table__,
+            (("rg_key", "rg_code", code_key), ("tag_key", "tag_code", code_key), ("model_key", "model_name", model_key)),
+        ),
+        (PickupCatalogInventoryItem.__table__, (("rg_key", "rg", code_key),)),
+        (PickupCatalogOrderItem.__table__, (("rg_key", "rg", code_key),)),
+    ):
+        statement = (
+            update(table)
+            .where(table.c.id == bindparam("row_id"))
+            .values({key: bindparam(f"new_{key}") for key, _, _ in key_columns})
+        )
+        last_id = 0
+        while True:
+            rows = db.execute(
+                select(table.c.id, *(table.c[source] for _, source, _ in key_columns))
+                .where(
+                    table.c.id > last_id,
+                    or_(*(table.c[key].is_(None) for key, _, _ in key_columns)),
+                )
+                .order_by(table.c.id.asc())
+                .limit(CODE_TOKEN_CHUNK_ROWS)
+            ).all()
+            if not rows:
+                break
+            db.execute(
+                statement,
+                [
+                    {
+                        "row_id": int(row[0]),
+                        **{
+                            f"new_{key}": build_key(row[index + 1])
+                            for index, (key, _, build_key) in enumerate(key_columns)
+                        },
+                    }
+                    for row in rows
+                ],
+            )
+            db.commit()
+            written += len(rows)
+            last_id = int(rows[-1][0])
+    return written
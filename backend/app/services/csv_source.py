@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import codecs
+import hashlib
+import mmap
+import os
+import tempfile
+import zipfile
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Any, Iterator
+
+import anyio.to_thread
+
+from app.core.config import CSV_UPLOAD_SPOOL_DIR
+
+
+# Uploads são copiados para disco em blocos e lidos via mmap: a memória usada
+# pelo parse não cresce com o tamanho do arquivo.
+UPLOAD_SPOOL_CHUNK_BYTES = 1024 * 1024
+CSV_DECODE_CHUNK_BYTES = 1024 * 1024
+CSV_SAMPLE_BYTES = 16 * 1024
+# Planilhas .xlsx são pacotes zip; o tipo é detectado pelo conteúdo, já que o
+# spool do upload sempre grava com sufixo .csv.
+XLSX_MAGIC = b"PK\x03\x04"
+# Uploads .gz são descomprimidos durante a cópia para o spool; .zip precisa de
+# acesso aleatório (diretório no fim do arquivo), então o pacote é copiado antes
+# e cada membro é extraído em streaming. Limites e hash valem sempre para os
+# bytes descomprimidos. Nas funções async só a leitura do upload fica no event
+# loop; descompressão, gravação e hash de cada bloco rodam numa thread.
+GZIP_MAGIC = b"\x1f\x8b"
+GZIP_UPLOAD_SUFFIX = ".gz"
+ZIP_UPLOAD_SUFFIX = ".zip"
+# Bytes sem caractere definido no cp1252; qualquer outro byte decodifica.
+CP1252_UNDEFINED_BYTES = (b"\x81", b"\x8d", b"\x8f", b"\x90", b"\x9d")
+
+CsvSource = bytes | str | Path
+
+
+class CsvUploadTooLargeError(ValueError):
+    pass
+
+
+class CsvUploadTooManyLinesError(ValueError):
+    pass
+
+
+class CsvUploadInvalidArchiveError(ValueError):
+    pass
+
+
+def _new_spool_file() -> IO[bytes]:
+    return tempfile.NamedTemporaryFile(
+        prefix="csv-upload-",
+        suffix=".csv",
+        dir=CSV_UPLOAD_SPOOL_DIR or None,
+        delete=False,
+    )
+
+
+class _SpoolSink:
+    # Limites conferidos durante a cópia; com digest (ex.: hashlib.sha256()),
+    # o hash sai da mesma passada.
+    def __init__(self, handle: IO[bytes], max_bytes: int, max_lines: int, digest: Any | None):
+        self.handle = handle
+        self.max_bytes = max_bytes
+        self.max_lines = max_lines
+        self.digest = digest
+        self.total_bytes = 0
+        self.newlines = 0
+
+    def write(self, chunk: bytes) -> None:
+        if not chunk:
+            return
+        self.total_bytes += len(chunk)
+        if self.total_bytes > self.max_bytes:
+            raise CsvUploadTooLargeError(self.max_bytes)
+        self.newlines += chunk.count(b"\n")
+        if self.newlines > self.max_lines:
+            raise CsvUploadTooManyLinesError(self.max_lines)
+        if self.digest is not None:
+            self.digest.update(chunk)
+        self.handle.write(chunk)
+
+
+class _GzipStream:
+    # Descompressão incremental; max_length limita cada saída a um bloco, então
+    # um arquivo "bomba" estoura o limite de bytes sem alocar tudo de uma vez.
+    def __init__(self) -> None:
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._member_started = False
+
+    def feed(self, chunk: bytes) -> Iterator[bytes]:
+        try:
+            pending = bool(chunk)
+            while pending:
+                self._member_started = True
+                data = self._decompressor.decompress(chunk, UPLOAD_SPOOL_CHUNK_BYTES)
+                yield data
+                if self._decompressor.eof:
+                    # Arquivos .gz concatenados: cada membro tem seu cabeçalho.
+                    chunk = self._decompressor.unused_data
+                    self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    self._member_started = False
+                    pending = bool(chunk)
+                else:
+                    # Saída cheia sem entrada pendente: ainda pode haver bytes no zlib.
+                    chunk = self._decompressor.unconsumed_tail
+                    pending = bool(chunk) or len(data) == UPLOAD_SPOOL_CHUNK_BYTES
+        except zlib.error as exc:
+            raise CsvUploadInvalidArchiveError("arquivo .gz inválido") from exc
+
+    def finish(self) -> None:
+        if self._member_started:
+            raise CsvUploadInvalidArchiveError("arquivo .gz incompleto")
+
+
+def _write_gzip_chunk(sink: _SpoolSink, gzip_stream: _GzipStream, chunk: bytes) -> None:
+    for data in gzip_stream.feed(chunk):
+        sink.write(data)
+
+
+async def spool_upload(upload: Any, *, max_bytes: int, max_lines: int, digest: Any | None = None) -> Path:
+    # Arquivos gzip (detectados pelo conteúdo) são gravados já descomprimidos.
+    handle = _new_spool_file()
+    spool_path = Path(handle.name)
+    try:
+        with handle:
+            sink = _SpoolSink(handle, max_bytes, max_lines, digest)
+            chunk = await upload.read(UPLOAD_SPOOL_CHUNK_BYTES)
+            gzip_stream = _GzipStream() if chunk[:len(GZIP_MAGIC)] == GZIP_MAGIC else None
+            while chunk:
+                if gzip_stream is None:
+                    await anyio.to_thread.run_sync(sink.write, chunk)
+                else:
+                    await anyio.to_thread.run_sync(_write_gzip_chunk, sink, gzip_stream, chunk)
+                chunk = await upload.read(UPLOAD_SPOOL_CHUNK_BYTES)
+            if gzip_stream is not None:
+                gzip_stream.finish()
+    except BaseException:
+        spool_path.unlink(missing_ok=True)
+        raise
+    return spool_path
+
+
+def is_zip_upload_name(file_name: str) -> bool:
+    return str(file_name or "").strip().lower().endswith(ZIP_UPLOAD_SUFFIX)
+
+
+def upload_inner_suffix(file_name: str) -> str:
+    # "020220.csv.gz" -> ".csv": a extensão que importa é a do conteúdo.
+    suffixes = [suffix.lower() for suffix in Path(str(file_name or "").strip()).suffixes]
+    if suffixes and suffixes[-1] == GZIP_UPLOAD_SUFFIX:
+        suffixes.pop()
+    return suffixes[-1] if suffixes else ""
+
+
+async def spool_zip_archive(upload: Any, *, max_bytes: int) -> tuple[Path, list[str]]:
+    # Copia o .zip (comprimido) e devolve os nomes dos arquivos dentro dele.
+    handle = _new_spool_file()
+    archive_path = Path(handle.name)
+    try:
+        with handle:
+            total_bytes = 0
+            while chunk := await upload.read(UPLOAD_SPOOL_CHUNK_BYTES):
+                total_bytes += len(chunk)
+                if total_bytes > max_bytes:
+                    raise CsvUploadTooLargeError(max_bytes)
+                await anyio.to_thread.run_sync(handle.write, chunk)
+        members = await anyio.to_thread.run_sync(_zip_member_names, archive_path)
+    except BaseException:
+        archive_path.unlink(missing_ok=True)
+        raise
+    return archive_path, members
+
+
+def _zip_member_names(archive_path: Path) -> list[str]:
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            return [
+                info.filename
+                for info in archive.infolist()
+                if not info.is_dir()
+                and not info.filename.startswith("__MACOSX/")
+                and not Path(info.filename).name.startswith(".")
+            ]
+    except zipfile.BadZipFile as exc:
+        raise CsvUploadInvalidArchiveError("arquivo .zip inválido") from exc
+
+
+def spool_zip_member(
+    archive_path: Path,
+    member: str,
+    *,
+    max_bytes: int,
+    max_lines: int,
+    digest: Any | None = None,
+) -> Path:
+    # Síncrona (inflate + gravação + hash): chamar de handlers async numa thread.
+    handle = _new_spool_file()
+    spool_path = Path(handle.name)
+    try:
+        with handle, zipfile.ZipFile(archive_path) as archive, archive.open(member) as source:
+            sink = _SpoolSink(handle, max_bytes, max_lines, digest)
+            while chunk := source.read(UPLOAD_SPOOL_CHUNK_BYTES):
+                sink.write(chunk)
+    except (zipfile.BadZipFile, zlib.error) as exc:
+        spool_path.unlink(missing_ok=True)
+        raise CsvUploadInvalidArchiveError(f"membro {member} do .zip inválido") from exc
+    except BaseException:
+        spool_path.unlink(missing_ok=True)
+        raise
+    return spool_path
+
+
+@contextmanager
+def open_csv_buffer(source: CsvSource) -> Iterator[bytes | mmap.mmap]:
+    if isinstance(source, bytes):
+        yield source
+        return
+
+    with open(source, "rb") as handle:
+        # mmap não aceita arquivos vazios.
+        if os.fstat(handle.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield buffer
+
+
+def is_xlsx_source(source: CsvSource) -> bool:
+    if isinstance(source, bytes):
+        return source[:len(XLSX_MAGIC)] == XLSX_MAGIC
+    with open(source, "rb") as handle:
+        return handle.read(len(XLSX_MAGIC)) == XLSX_MAGIC
+
+
+def csv_sha256(source: CsvSource) -> str:
+    digest = hashlib.sha256()
+    with open_csv_buffer(source) as buffer:
+        for offset in range(0, len(buffer), UPLOAD_SPOOL_CHUNK_BYTES):
+            digest.update(buffer[offset:offset + UPLOAD_SPOOL_CHUNK_BYTES])
+    return digest.hexdigest()
+
+
+def _is_valid_utf8(buffer: bytes | mmap.mmap) -> bool:
+    # Para no primeiro erro; blocos ASCII (a maioria) não são decodificados.
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        for offset in range(0, len(buffer), CSV_DECODE_CHUNK_BYTES):
+            chunk = buffer[offset:offset + CSV_DECODE_CHUNK_BYTES]
+            if chunk.isascii() and not decoder.getstate()[0]:
+                continue
+            decoder.decode(chunk)
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def detect_csv_encoding(buffer: bytes | mmap.mmap) -> str:
+    # Mesma precedência de antes (utf-8-sig, cp1252, latin-1), sem decodificar o
+    # arquivo inteiro por tentativa: o cp1252 só falha nos bytes indefinidos, e o
+    # latin-1 aceita qualquer byte.
+    if _is_valid_utf8(buffer):
+        return "utf-8-sig"
+    # find() por byte usa memchr; bem mais rápido que uma classe de regex.
+    if all(buffer.find(undefined) == -1 for undefined in CP1252_UNDEFINED_BYTES):
+        return "cp1252"
+    return "latin-1"
+
+
+def decode_csv_sample(buffer: bytes | mmap.mmap, encoding: str) -> str:
+    decoder = codecs.getincrementaldecoder(encoding)()
+    return decoder.decode(buffer[:CSV_SAMPLE_BYTES])
+
+
+def chunk_encoding(encoding: str) -> str:
+    # Trechos a partir do meio do arquivo não têm BOM.
+    return "utf-8" if encoding == "utf-8-sig" else encoding
+
+
+def iter_csv_lines(
+    buffer: bytes | mmap.mmap,
+    encoding: str,
+    start: int = 0,
+    end: int | None = None,
+) -> Iterator[str]:
+    # Linhas físicas terminadas em "\n", como io.StringIO entregaria ao csv.reader.
+    stop = len(buffer) if end is None else end
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ""
+    for offset in range(start, stop, CSV_DECODE_CHUNK_BYTES):
+        block = pending + decoder.decode(buffer[offset:min(offset + CSV_DECODE_CHUNK_BYTES, stop)])
+        lines = block.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def iter_csv_file_lines(source: CsvSource, encoding: str) -> Iterator[str]:
+    with open_csv_buffer(source) as buffer:
+        yield from iter_csv_lines(buffer, encoding)
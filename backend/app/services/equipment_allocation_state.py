@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import re
+from contextlib import contextmanager
+from typing import Any, Iterable, Iterator, Optional
+
+from sqlalchemy import Integer, delete, exists, func, insert, or_, select
+from sqlalchemy.orm import Session, aliased
+
+from app.models.code_token import CodeToken
+from app.models.equipment import Equipment, EquipmentAllocationState
+from app.models.pickup_catalog import (
+    PickupCatalogInventoryItem,
+    PickupCatalogOrder,
+    PickupCatalogOrderItem,
+    PickupCatalogUploadBatch,
+)
+from app.services.allocation_token_cache import (
+    ALLOCATED_020220_TOKENS,
+    RETURNED_PICKUP_TOKENS,
+    allocation_token_cache,
+    inventory_revision,
+    orders_revision,
+)
+from app.services.code_tokens import build_code_tokens
+from app.services.key_set import key_set
+from app.services.material_bucket import material_type_bucket, resolve_material_bucket
+from app.services.pickup_catalog_csv import classify_item_type
+from app.services.pickup_catalog_import import active_batch_id, uses_batched_inventory
+
+
+# Tabela equipment_allocation_state: um refrigerador segue "alocado" quando algum
+# token do RG/etiqueta aparece na base 02.02.20 ativa e não aparece em retirada
+# concluída. Quem altera essas fontes recalcula as linhas afetadas
+# (refresh_allocation_state); as telas de equipamentos só leem a tabela.
+STATE_CHUNK_ROWS = 5000
+
+_SPACES_RE = re.compile(r"\s+")
+_NON_ALNUM_RE = re.compile(r"[^A-Z0-9]+")
+
+
+def _normalize_spaces(value: Any) -> str:
+    return _SPACES_RE.sub(" ", str(value or "").strip())
+
+
+def apply_active_inventory_filter(query, db: Session):
+    # Itens em aberto do lote ativo (durante uma importação, o novo lote ainda não é lido).
+    filtered = query.filter(PickupCatalogInventoryItem.open_quantity > 0)
+    if not uses_batched_inventory(db):
+        return filtered
+    batch_id = active_batch_id(db)
+    if batch_id is None:
+        return filtered.filter(PickupCatalogInventoryItem.id == -1)
+    return filtered.filter(PickupCatalogInventoryItem.batch_id == batch_id)
+
+
+def equipment_lookup_tokens(rg_code: Optional[str], tag_code: Optional[str]) -> set[str]:
+    tokens: set[str] = set()
+    tokens.update(build_code_tokens(rg_code))
+    tokens.update(build_code_tokens(tag_code))
+    return tokens
+
+
+def allocated_020220_tokens(db: Session, tokens: Optional[set[str]] = None) -> frozenset[str]:
+    # Com `tokens`, só os itens casados pelo índice code_tokens são lidos (sem
+    # cache); sem, vale o conjunto inteiro guardado por lote ativo/revisão.
+    if tokens is not None:
+        return frozenset(_scan_allocated_020220_tokens(db, tokens))
+    batch_id = active_batch_id(db)
+    uploaded_at = (
+        db.query(PickupCatalogUploadBatch.uploaded_at).filter(PickupCatalogUploadBatch.id == batch_id).scalar()
+        if batch_id is not None
+        else None
+    )
+    return allocation_token_cache.get(
+        ALLOCATED_020220_TOKENS,
+        (batch_id, uploaded_at, inventory_revision()),
+        lambda: _scan_allocated_020220_tokens(db),
+    )
+
+
+def _scan_allocated_020220_tokens(db: Session, tokens: Optional[set[str]] = None) -> set[str]:
+    # Linhas sem material_bucket (backfill ainda em andamento) são resolvidas aqui.
+    material_bucket = PickupCatalogInventoryItem.material_bucket
+    query = db.query(
+        PickupCatalogInventoryItem.rg.label("rg_code"),
+        material_bucket.label("material_bucket"),
+        PickupCatalogInventoryItem.item_type.label("item_type"),
+        PickupCatalogInventoryItem.description.label("description"),
+    ).filter(or_(material_bucket == "refrigerador", material_bucket.is_(None)))
+    if tokens is not None:
+        query = query.filter(
+            PickupCatalogInventoryItem.id.in_(
+                select(CodeToken.inventory_item_id).where(CodeToken.token.in_(sorted(tokens)))
+            )
+        )
+
+    allocated_tokens: set[str] = set()
+    for row in apply_active_inventory_filter(query, db=db).all():
+        if row.material_bucket is None and resolve_material_bucket(row.item_type, row.description) != "refrigerador":
+            continue
+        allocated_tokens.update(build_code_tokens(row.rg_code))
+    return allocated_tokens
+
+
+def _is_refrigerator_pickup_item(
+    item_type: Optional[str],
+    description: Optional[str],
+    rg_code: Optional[str],
+) -> bool:
+    if material_type_bucket(_normalize_spaces(item_type)) == "refrigerador":
+        return True
+
+    if material_type_bucket(classify_item_type(_normalize_spaces(description))) == "refrigerador":
+        return True
+
+    normalized_rg = _normalize_spaces(rg_code)
+    if not normalized_rg:
+        return False
+
+    compact_rg = _NON_ALNUM_RE.sub("", normalized_rg.upper())
+    if compact_rg in {"S", "SIM", "N", "NA", "NAO", "SEM"}:
+        return False
+    return any(char.isdigit() for char in compact_rg)
+
+
+def returned_pickup_tokens(db: Session) -> frozenset[str]:
+    # O último status_updated_at entra na chave: logo após o commit de uma mudança
+    # de status o conjunto já é refeito, antes mesmo da revisão subir.
+    last_status_change = db.query(func.max(PickupCatalogOrder.status_updated_at)).scalar()
+    return allocation_token_cache.get(
+        RETURNED_PICKUP_TOKENS,
+        (orders_revision(), last_status_change),
+        lambda: _scan_returned_pickup_tokens(db),
+    )
+
+
+def _scan_returned_pickup_tokens(db: Session) -> set[str]:
+    rows = (
+        db.query(
+            PickupCatalogOrderItem.item_type.label("item_type"),
+            PickupCatalogOrderItem.description.label("description"),
+            PickupCatalogOrderItem.rg.label("rg_code"),
+        )
+        .join(PickupCatalogOrder, PickupCatalogOrder.id == PickupCatalogOrderItem.order_id)
+        .filter(PickupCatalogOrder.status == "concluida")
+        .all()
+    )
+
+    returned_tokens: set[str] = set()
+    for row in rows:
+        if _is_refrigerator_pickup_item(row.item_type, row.description, row.rg_code):
+            returned_tokens.update(build_code_tokens(row.rg_code))
+    return returned_tokens
+
+
+def is_equipment_still_allocated(
+    rg_code: Optional[str],
+    tag_code: Optional[str],
+    allocated_tokens: frozenset[str],
+    returned_tokens: frozenset[str],
+) -> bool:
+    equipment_tokens = equipment_lookup_tokens(rg_code, tag_code)
+    if not equipment_tokens or not allocated_tokens.intersection(equipment_tokens):
+        return False
+    return not returned_tokens.intersection(equipment_tokens)
+
+
+def refresh_allocation_state(db: Session, equipment_ids: Iterable[int] | None = None) -> int:
+    # Regrava as linhas dos equipamentos informados (None = todos). Equipamentos
+    # que deixaram de ser refrigeradores perdem a linha. Não faz commit; quem
+    # muda a base 02.02.20 ou as ordens chama depois do commit e da revisão,
+    # para os conjuntos em cache já refletirem a mudança.
+    table = EquipmentAllocationState.__table__
+    ids = None if equipment_ids is None else sorted({int(item) for item in equipment_ids})
+    if ids is not None and not ids:
+        return 0
+
+    query = db.query(Equipment.id, Equipment.rg_code, Equipment.tag_code).filter(
+        Equipment.category == "refrigerador"
+    )
+    if ids is None:
+        db.execute(delete(table))
+        rows = query.all()
+    else:
+        rows = []
+        for start in range(0, len(ids), STATE_CHUNK_ROWS):
+            chunk = ids[start:start + STATE_CHUNK_ROWS]
+            db.execute(delete(table).where(table.c.equipment_id.in_(chunk)))
+            rows.extend(query.filter(Equipment.id.in_(chunk)).all())
+    if not rows:
+        return 0
+
+    allocated_tokens = allocated_020220_tokens(db)
+    returned_tokens = returned_pickup_tokens(db)
+    state_rows = [
+        {
+            "equipment_id": int(row.id),
+            "still_allocated": is_equipment_still_allocated(
+                row.rg_code,
+                row.tag_code,
+                allocated_tokens,
+                returned_tokens,
+            ),
+        }
+        for row in rows
+    ]
+    for start in range(0, len(state_rows), STATE_CHUNK_ROWS):
+        db.execute(insert(table), state_rows[start:start + STATE_CHUNK_ROWS])
+    return len(state_rows)
+
+
+@contextmanager
+def allocation_state_filter(db: Session, still_allocated: bool) -> Iterator[Any]:
+    # Condição para consultas com outerjoin em EquipmentAllocationState.
+    # Refrigeradores ainda sem linha (rebuild do bootstrap em andamento, falha
+    # no refresh após a importação) são calculados pelos tokens, sem gravar.
+    table = EquipmentAllocationState.__table__
+    condition = table.c.still_allocated.is_(still_allocated)
+    missing_rows = (
+        db.query(Equipment.id, Equipment.rg_code, Equipment.tag_code)
+        .filter(
+            Equipment.category == "refrigerador",
+            ~exists().where(table.c.equipment_id == Equipment.id),
+        )
+        .all()
+    )
+    fallback_ids: list[int] = []
+    if missing_rows:
+        allocated_tokens = allocated_020220_tokens(db)
+        returned_tokens = returned_pickup_tokens(db)
+        fallback_ids = [
+            int(row.id)
+            for row in missing_rows
+            if is_equipment_still_allocated(row.rg_code, row.tag_code, allocated_tokens, returned_tokens)
+            == still_allocated
+        ]
+    if not fallback_ids:
+        yield condition
+        return
+    with key_set(db, fallback_ids, Integer) as fallback:
+        yield or_(condition, exists().where(fallback.c.key == Equipment.id))
+
+
+def rebuild_allocation_state(db: Session) -> int:
+    # Todas as linhas, em transação própria: depois de importações e
+    # reclassificações (já confirmadas) e no bootstrap.
+    rows = refresh_allocation_state(db)
+    db.commit()
+    return rows
+
+
+def delete_allocation_state(db: Session, equipment_ids: list[int]) -> None:
+    # Antes de apagar o equipamento (a linha referencia equipments.id). Não faz commit.
+    if equipment_ids:
+        table = EquipmentAllocationState.__table__
+        db.execute(delete(table).where(table.c.equipment_id.in_([int(item) for item in equipment_ids])))
+
+
+def equipment_ids_for_orders(db: Session, order_ids: list[int]) -> list[int]:
+    # Equipamentos com algum token de RG/etiqueta igual aos itens das ordens.
+    if not order_ids:
+        return []
+    equipment_tokens = aliased(CodeToken)
+    order_tokens = aliased(CodeToken)
+    rows = db.execute(
+        select(equipment_tokens.equipment_id)
+        .join(order_tokens, order_tokens.token == equipment_tokens.token)
+        .join(PickupCatalogOrderItem, PickupCatalogOrderItem.id == order_tokens.order_item_id)
+        .where(
+            PickupCatalogOrderItem.order_id.in_([int(item) for item in order_ids]),
+            equipment_tokens.equipment_id.isnot(None),
+        )
+        .distinct()
+    ).all()
+    return [int(row[0]) for row in rows]
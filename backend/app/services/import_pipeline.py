@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Iterator, Sequence
+
+from app.services.import_profile import ImportProfiler
+
+
+# Etapas de uma importação rodando ao mesmo tempo, cada uma numa thread, ligadas
+# por filas limitadas: quando a etapa seguinte atrasa, a anterior fica parada na
+# fila cheia (backpressure) e a memória não passa de alguns blocos por fila.
+# O consumidor final roda na thread de quem chama, dona da sessão do banco.
+# Falha em qualquer etapa cancela as demais e é relançada no consumidor.
+PIPELINE_POLL_SECONDS = 0.1
+
+_END = object()
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _Pipeline:
+    def __init__(self, queue_chunks: int):
+        self.queue_chunks = max(1, int(queue_chunks))
+        self.cancelled = threading.Event()
+        self.error: BaseException | None = None
+        self.records: dict[str, dict[str, Any]] = {}
+        self._error_lock = threading.Lock()
+
+    def fail(self, exc: BaseException) -> None:
+        with self._error_lock:
+            if self.error is None:
+                self.error = exc
+        self.cancelled.set()
+
+    def put(self, target: queue.Queue, item: Any, waits: list[float]) -> None:
+        started = time.perf_counter()
+        try:
+            while True:
+                if self.cancelled.is_set():
+                    raise _Cancelled
+                try:
+                    target.put(item, timeout=PIPELINE_POLL_SECONDS)
+                    return
+                except queue.Full:
+                    continue
+        finally:
+            waits[0] += time.perf_counter() - started
+
+    def drain(self, source: queue.Queue, waits: list[float]) -> Iterator[Any]:
+        while True:
+            started = time.perf_counter()
+            try:
+                while True:
+                    if self.cancelled.is_set():
+                        raise _Cancelled
+                    try:
+                        item = source.get(timeout=PIPELINE_POLL_SECONDS)
+                        break
+                    except queue.Empty:
+                        continue
+            finally:
+                waits[0] += time.perf_counter() - started
+            if item is _END:
+                return
+            yield item
+
+    def run_stage(
+        self,
+        name: str,
+        items: Callable[[list[float]], Iterable[Any]],
+        func: Callable[[Any], Any] | None,
+        target: queue.Queue,
+    ) -> None:
+        waits = [0.0]
+        chunks = 0
+        wall_started = time.perf_counter()
+        cpu_started = time.thread_time()
+        try:
+            for item in items(waits):
+                self.put(target, func(item) if func is not None else item, waits)
+                chunks += 1
+            self.put(target, _END, waits)
+        except _Cancelled:
+            pass
+        except BaseException as exc:
+            self.fail(exc)
+        finally:
+            self.records[name] = _stage_record(name, chunks, wall_started, cpu_started, waits[0])
+
+
+def _stage_record(name: str, chunks: int, wall_started: float, cpu_started: float, wait: float) -> dict[str, Any]:
+    return {
+        "stage": name,
+        "rows_in": chunks,
+        "rows_out": chunks,
+        "wall_ms": round((time.perf_counter() - wall_started) * 1000, 1),
+        "cpu_ms": round((time.thread_time() - cpu_started) * 1000, 1),
+        "wait_ms": round(wait * 1000, 1),
+    }
+
+
+@contextmanager
+def run_pipeline(
+    producer: tuple[str, Iterable[Any]],
+    stages: Sequence[tuple[str, Callable[[Any], Any]]],
+    *,
+    queue_chunks: int,
+    consumer_name: str,
+    profiler: ImportProfiler | None = None,
+    part_of: str = "",
+) -> Iterator[Iterator[Any]]:
+    # `producer` é iterado na sua própria thread; cada etapa de `stages` recebe um
+    # bloco e devolve o bloco seguinte. O contexto entrega os blocos da última
+    # etapa, na ordem de produção. No perfil, rows_* contam blocos e wait_ms é o
+    # tempo parado em filas (cheias na saída ou vazias na entrada).
+    pipeline = _Pipeline(queue_chunks)
+    queues = [queue.Queue(maxsize=pipeline.queue_chunks) for _ in range(len(stages) + 1)]
+    producer_name, producer_items = producer
+    threads = [
+        threading.Thread(
+            target=pipeline.run_stage,
+            args=(producer_name, lambda waits: producer_items, None, queues[0]),
+            name=f"pipeline-{producer_name}",
+            daemon=True,
+        )
+    ]
+    for index, (name, func) in enumerate(stages):
+        upstream = queues[index]
+        threads.append(
+            threading.Thread(
+                target=pipeline.run_stage,
+                args=(name, lambda waits, upstream=upstream: pipeline.drain(upstream, waits), func, queues[index + 1]),
+                name=f"pipeline-{name}",
+                daemon=True,
+            )
+        )
+
+    consumer_waits = [0.0]
+    wall_started = time.perf_counter()
+    cpu_started = time.thread_time()
+    consumed = 0
+
+    def results() -> Iterator[Any]:
+        nonlocal consumed
+        try:
+            for item in pipeline.drain(queues[-1], consumer_waits):
+                consumed += 1
+                yield item
+        except _Cancelled:
+            raise pipeline.error  # type: ignore[misc]
+
+    for thread in threads:
+        thread.start()
+    try:
+        yield results()
+    except BaseException as exc:
+        pipeline.fail(exc)
+        raise
+    finally:
+        pipeline.cancelled.set()
+        for thread in threads:
+            thread.join()
+        if profiler is not None:
+            for name in (producer_name, *(name for name, _ in stages)):
+                if name in pipeline.records:
+                    profiler.add_part(pipeline.records[name], part_of=part_of)
+            consumer_record = _stage_record(consumer_name, consumed, wall_started, cpu_started, consumer_waits[0])
+            profiler.add_part(consumer_record, part_of=part_of)
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, ContextManager, Iterator
+
+
+# Medição por etapa das importações: tempo de parede, CPU da thread que importa
+# (o parse paralelo roda em outros processos e fica fora do CPU), linhas de
+# entrada/saída e, opcionalmente, pico de memória via tracemalloc. O tracemalloc
+# deixa o Python bem mais lento, por isso só liga quando pedido.
+class ImportProfiler:
+    def __init__(self, *, trace_memory: bool = False):
+        self.trace_memory = bool(trace_memory)
+        self.stages: list[dict[str, Any]] = []
+        self._started_tracing = False
+        self._started_at = time.perf_counter()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    @contextmanager
+    def stage(self, name: str, rows_in: int = 0) -> Iterator[dict[str, Any]]:
+        # Etapas não se aninham: o pico do tracemalloc é zerado a cada início.
+        record: dict[str, Any] = {"stage": name, "rows_in": int(rows_in), "rows_out": 0}
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        wall_started = time.perf_counter()
+        cpu_started = time.thread_time()
+        try:
+            yield record
+        finally:
+            record["wall_ms"] = round((time.perf_counter() - wall_started) * 1000, 1)
+            record["cpu_ms"] = round((time.thread_time() - cpu_started) * 1000, 1)
+            if self.trace_memory:
+                record["peak_memory_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+            self.stages.append(record)
+
+    def timed(self, name: str, func: Callable[..., Any]) -> Callable[..., Any]:
+        # Acumula o tempo de uma função chamada linha a linha (ex.: classificação)
+        # dentro de outra etapa; vira uma etapa própria em add_timed().
+        totals = {"calls": 0, "wall": 0.0}
+
+        def wrapper(*args: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                totals["calls"] += 1
+                totals["wall"] += time.perf_counter() - started
+
+        wrapper.totals = totals  # type: ignore[attr-defined]
+        wrapper.stage_name = name  # type: ignore[attr-defined]
+        return wrapper
+
+    def add_timed(self, wrapper: Callable[..., Any], *, part_of: str) -> None:
+        totals = getattr(wrapper, "totals", None)
+        if not totals or not totals["calls"]:
+            return
+        self.stages.append({
+            "stage": getattr(wrapper, "stage_name", "timed"),
+            "part_of": part_of,
+            "rows_in": totals["calls"],
+            "rows_out": totals["calls"],
+            "wall_ms": round(totals["wall"] * 1000, 1),
+        })
+
+    def add_part(self, record: dict[str, Any], *, part_of: str) -> None:
+        # Etapas medidas fora de stage(), ex.: threads do pipeline de importação.
+        self.stages.append({**record, "part_of": part_of})
+
+    def close(self) -> None:
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "trace_memory": self.trace_memory,
+            "total_wall_ms": round((time.perf_counter() - self._started_at) * 1000, 1),
+            "stages": [dict(stage) for stage in self.stages],
+        }
+
+
+def profile_stage(
+    profiler: ImportProfiler | None,
+    name: str,
+    rows_in: int = 0,
+) -> ContextManager[dict[str, Any]]:
+    if profiler is None:
+        return nullcontext({})
+    return profiler.stage(name, rows_in)
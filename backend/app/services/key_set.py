@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import itertools
+from contextlib import contextmanager
+from typing import Any, Iterable, Iterator
+
+from sqlalchemy import Column, MetaData, String, Table, func, insert, literal
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import ColumnElement, FromClause, Select
+from sqlalchemy.types import TypeEngine
+
+
+# Conjuntos grandes de chaves (dezenas de milhares de códigos) viram uma tabela
+# para JOIN / NOT EXISTS em vez de listas IN gigantes, que estouram o limite de
+# parâmetros do SQLite e geram planos ruins no PostgreSQL. No PostgreSQL a lista
+# vai num único parâmetro array aberto com unnest(); nos demais bancos, numa
+# tabela temporária da conexão da sessão, removida ao sair do bloco.
+# Em ambos os casos a coluna exposta é `.c.key`.
+# Consultas repetidas a cada bloco da importação (poucos milhares de códigos)
+# usam select_matching_keys: nos demais bancos, IN em lotes abaixo do limite de
+# parâmetros do SQLite (999 nas versões antigas), sem criar tabela a cada bloco.
+KEY_SET_INSERT_CHUNK = 10000
+KEY_SET_IN_CHUNK = 900
+KEY_SET_IN_MAX_KEYS = 20000
+
+_key_set_counter = itertools.count(1)
+
+
+def _is_postgresql(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+@contextmanager
+def key_set(
+    db: Session,
+    keys: Iterable[Any],
+    key_type: TypeEngine | type[TypeEngine] = String,
+) -> Iterator[FromClause]:
+    values = list(dict.fromkeys(keys))
+
+    if _is_postgresql(db):
+        array_type = ARRAY(key_type() if isinstance(key_type, type) else key_type)
+        yield func.unnest(literal(values, array_type)).table_valued("key").render_derived()
+        return
+
+    table = Table(
+        f"tmp_key_set_{next(_key_set_counter)}",
+        MetaData(),
+        Column("key", key_type, primary_key=True),
+        prefixes=["TEMPORARY"],
+    )
+    connection = db.connection()
+    table.create(connection)
+    try:
+        for start in range(0, len(values), KEY_SET_INSERT_CHUNK):
+            connection.execute(
+                insert(table),
+                [{"key": value} for value in values[start:start + KEY_SET_INSERT_CHUNK]],
+            )
+        yield table
+    finally:
+        # Um rollback no meio do bloco já descarta a tabela criada na transação.
+        table.drop(connection, checkfirst=True)
+
+
+def select_matching_keys(
+    db: Session,
+    statement: Select,
+    column: ColumnElement,
+    keys: Iterable[Any],
+    key_type: TypeEngine | type[TypeEngine] = String,
+) -> Iterator[Row]:
+    # Linhas de `statement` com `column` entre as chaves. Acima de
+    # KEY_SET_IN_MAX_KEYS os lotes IN viram muitas consultas; aí a tabela
+    # temporária compensa.
+    values = list(dict.fromkeys(keys))
+    if not values:
+        return
+    if _is_postgresql(db) or len(values) > KEY_SET_IN_MAX_KEYS:
+        with key_set(db, values, key_type) as wanted:
+            yield from db.execute(statement.join(wanted, wanted.c.key == column))
+        return
+    for start in range(0, len(values), KEY_SET_IN_CHUNK):
+        yield from db.execute(statement.where(column.in_(values[start:start + KEY_SET_IN_CHUNK])))
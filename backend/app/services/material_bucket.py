@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import functools
+import re
+import unicodedata
+from typing import Any
+
+from app.services.pickup_catalog_csv import classify_item_type
+
+
+# Tipo de material resolvido (refrigerador, garrafeira, jogo_mesa, caixa_termica,
+# outro) gravado em material_bucket na importação: as telas de equipamentos
+# filtram por grupo/tipo no banco em vez de reclassificar a descrição a cada pedido.
+MATERIAL_BUCKET_CACHE_SIZE = 4096
+
+MATERIAL_TYPE_ALIASES = {
+    "refrigerador": "refrigerador",
+    "refrigeradores": "refrigerador",
+    "geladeira": "refrigerador",
+    "geladeiras": "refrigerador",
+    "frigobar": "refrigerador",
+    "frigorifico": "refrigerador",
+    "cervejeira": "refrigerador",
+    "caixa termica": "caixa_termica",
+    "caixa_termica": "caixa_termica",
+    "caixa termicas": "caixa_termica",
+    "caixas termicas": "caixa_termica",
+    "cx termica": "caixa_termica",
+    "jogo mesa": "jogo_mesa",
+    "jogos mesa": "jogo_mesa",
+    "jogo de mesa": "jogo_mesa",
+    "jogos de mesa": "jogo_mesa",
+    "jogo_mesa": "jogo_mesa",
+    "garrafeira": "garrafeira",
+    "vasilhame caixa": "vasilhame_caixa",
+    "vasilhame_caixa": "vasilhame_caixa",
+    "vasilhame garrafa": "vasilhame_garrafa",
+    "vasilhame_garrafa": "vasilhame_garrafa",
+    "chopeira": "outro",
+    "choppeira": "outro",
+    "balde": "outro",
+    "baldes": "outro",
+    "testeira": "outro",
+    "compressor": "outro",
+    "totem": "outro",
+    "cooler carrinho": "outro",
+    "coller carrinho": "outro",
+    "cooler_carrinho": "outro",
+    "inflavel": "outro",
+    "empilhadeira": "outro",
+    "calca": "outro",
+    "cartucho": "outro",
+    "ombrelone": "outro",
+    "ombrellone": "outro",
+    "camera fria": "outro",
+    "camera_fria": "outro",
+    "camara fria": "outro",
+    "dispensador": "outro",
+    "outro": "outro",
+    "outros": "outro",
+}
+
+
+def normalize_lookup_text(value: str) -> str:
+    normalized = re.sub(r"\s+", " ", str(value or "").strip()).lower()
+    without_accents = unicodedata.normalize("NFD", normalized)
+    without_accents = "".join(ch for ch in without_accents if unicodedata.category(ch) != "Mn")
+    without_accents = without_accents.replace("-", " ").replace("_", " ")
+    return re.sub(r"\s+", " ", without_accents).strip()
+
+
+@functools.lru_cache(maxsize=MATERIAL_BUCKET_CACHE_SIZE)
+def material_type_bucket(value: str) -> str:
+    normalized = normalize_lookup_text(value)
+    mapped = MATERIAL_TYPE_ALIASES.get(normalized, "")
+    if mapped in {"vasilhame_caixa", "vasilhame_garrafa", "garrafeira"}:
+        return "garrafeira"
+    if mapped in {"refrigerador", "jogo_mesa", "caixa_termica"}:
+        return mapped
+    return "outro"
+
+
+def resolve_material_bucket(item_type: Any, description: Any) -> str:
+    # item_type gravado vale; se cair em "outro", tenta a classificação da descrição.
+    stored_bucket = material_type_bucket(str(item_type or ""))
+    if stored_bucket != "outro":
+        return stored_bucket
+    return material_type_bucket(classify_item_type(re.sub(r"\s+", " ", str(description or "").strip())))
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import io
+from typing import Any, Iterable, Sequence
+
+from sqlalchemy.orm import Session
+
+
+# COPY ... FROM STDIN (FORMAT csv) do PostgreSQL. Nesse formato, campo vazio sem
+# aspas é NULL e "" entre aspas é texto vazio: None sai sem aspas e os demais
+# valores vão sempre entre aspas (um csv.writer com QUOTE_ALL gravaria None
+# como "" e a coluna ficaria com texto vazio em vez de NULL).
+
+
+def _copy_field(value: Any) -> str:
+    if value is None:
+        return ""
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def encode_copy_rows(rows: Iterable[Sequence[Any]]) -> str:
+    return "".join(",".join(_copy_field(value) for value in row) + "\n" for row in rows)
+
+
+def copy_rows(
+    db: Session,
+    table_name: str,
+    columns: Sequence[str],
+    rows: Sequence[Sequence[Any]],
+    chunk_rows: int | None = None,
+) -> None:
+    # Um COPY por bloco de chunk_rows linhas (None = todas de uma vez).
+    chunk_rows = chunk_rows or max(1, len(rows))
+    copy_sql = f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    raw_connection = db.connection().connection
+    with raw_connection.cursor() as cursor:
+        for start in range(0, len(rows), chunk_rows):
+            cursor.copy_expert(copy_sql, io.StringIO(encode_copy_rows(rows[start:start + chunk_rows])))
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+from typing import Any, Iterable
+
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.models.pickup_catalog import PickupCatalogClient, PickupCatalogInventoryItem
+from app.services.code_tokens import delete_inventory_item_tokens
+from app.services.key_set import select_matching_keys
+from app.services.pg_copy import copy_rows
+from app.services.pickup_catalog_csv import CLIENT_FORM_FIELDS
+
+
+# Escrita em massa da base de retiradas sem objetos ORM por linha: COPY e
+# INSERT ... ON CONFLICT no PostgreSQL; executemany via Core nos demais bancos.
+CLIENT_VALUE_FIELDS = tuple(field for field in CLIENT_FORM_FIELDS if field != "client_code")
+INVENTORY_INSERT_FIELDS = (
+    "client_id",
+    "batch_id",
+    "description",
+    "item_type",
+    "material_bucket",
+    "open_quantity",
+    "rg",
+    "rg_key",
+    "comodato_number",
+    "invoice_issue_date",
+    "volume_key",
+    "source_baixados",
+    "product_code",
+    "classifier_version",
+)
+BULK_CHUNK_SIZE = 1000
+COPY_CHUNK_ROWS = 10000
+
+
+def _safe_text(value: Any) -> str:
+    return str(value or "").strip()
+
+
+def _is_postgresql(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def _chunks(values: list[Any], size: int = BULK_CHUNK_SIZE) -> Iterable[list[Any]]:
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def upsert_clients(db: Session, clients: dict[str, dict[str, str]]) -> dict[str, int]:
+    # Devolve código -> id de todos os clientes gravados.
+    rows = [
+        {"client_code": code, **{field: _safe_text(payload.get(field)) for field in CLIENT_VALUE_FIELDS}}
+        for code, payload in clients.items()
+    ]
+    table = PickupCatalogClient.__table__
+    client_ids: dict[str, int] = {}
+
+    if _is_postgresql(db):
+        for chunk in _chunks(rows):
+            statement = pg_insert(table).values(chunk)
+            statement = statement.on_conflict_do_update(
+                index_elements=[table.c.client_code],
+                set_={
+                    **{field: statement.excluded[field] for field in CLIENT_VALUE_FIELDS},
+                    "updated_at": func.now(),
+                },
+            ).returning(table.c.id, table.c.client_code)
+            client_ids.update({code: int(client_id) for client_id, code in db.execute(statement)})
+        return client_ids
+
+    existing_ids = client_ids_by_code(db, list(clients))
+    updates = [
+        {"row_id": existing_ids[row["client_code"]], **{f"new_{field}": row[field] for field in CLIENT_VALUE_FIELDS}}
+        for row in rows
+        if row["client_code"] in existing_ids
+    ]
+    inserts = [row for row in rows if row["client_code"] not in existing_ids]
+    if updates:
+        db.execute(
+            update(table)
+            .where(table.c.id == bindparam("row_id"))
+            .values({field: bindparam(f"new_{field}") for field in CLIENT_VALUE_FIELDS}),
+            updates,
+        )
+    if inserts:
+        db.execute(insert(table), inserts)
+        existing_ids.update(client_ids_by_code(db, [row["client_code"] for row in inserts]))
+    return existing_ids
+
+
+def client_ids_by_code(db: Session, codes: list[str]) -> dict[str, int]:
+    if not codes:
+        return {}
+    table = PickupCatalogClient.__table__
+    statement = select(table.c.id, table.c.client_code)
+    return {
+        code: int(client_id)
+        for client_id, code in select_matching_keys(db, statement, table.c.client_code, codes)
+    }
+
+
+def _copy_inventory_rows(db: Session, rows: list[dict[str, Any]]) -> None:
+    copy_rows(
+        db,
+        PickupCatalogInventoryItem.__tablename__,
+        INVENTORY_INSERT_FIELDS,
+        [[row[field] for field in INVENTORY_INSERT_FIELDS] for row in rows],
+        COPY_CHUNK_ROWS,
+    )
+
+
+def insert_inventory_items(db: Session, rows: list[dict[str, Any]]) -> None:
+    if not rows:
+        return
+    if _is_postgresql(db):
+        _copy_inventory_rows(db, rows)
+        return
+    table = PickupCatalogInventoryItem.__table__
+    for chunk in _chunks(rows, COPY_CHUNK_ROWS):
+        db.execute(insert(table), chunk)
+
+
+def update_inventory_items(db: Session, rows: list[dict[str, Any]], fields: tuple[str, ...]) -> None:
+    # Cada linha traz "row_id" e os campos em "new_<campo>".
+    if not rows:
+        return
+    table = PickupCatalogInventoryItem.__table__
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam("row_id"))
+        .values({field: bindparam(f"new_{field}") for field in fields})
+    )
+    for chunk in _chunks(rows, COPY_CHUNK_ROWS):
+        db.execute(statement, chunk)
+
+
+def delete_inventory_items(db: Session, item_ids: list[int]) -> None:
+    delete_inventory_item_tokens(db, item_ids)
+    table = PickupCatalogInventoryItem.__table__
+    for chunk in _chunks(item_ids):
+        db.execute(delete(table).where(table.c.id.in_(chunk)))
@@ -1,10 +1,40 @@
 from __future__ import annotations
 
+import codecs
 import csv
+import functools
 import io
+import itertools
+import json
+import logging
+import mmap
+import multiprocessing
 import re
 import unicodedata
-from typing import Any
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack, contextmanager
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator
+
+from app.core.config import (
+    PICKUP_CATALOG_CSV_PARALLEL_MIN_BYTES,
+    PICKUP_CATALOG_CSV_PARSE_WORKERS,
+    PICKUP_CATALOG_ITEM_TYPE_RULES_FILE,
+)
+from app.services.csv_source import (
+    CsvSource,
+    chunk_encoding,
+    decode_csv_sample,
+    detect_csv_encoding,
+    is_xlsx_source,
+    iter_csv_lines,
+    open_csv_buffer,
+)
+from app.services.import_profile import ImportProfiler, profile_stage
+
+logger = logging.getLogger("uvicorn.error")
 
 
 CLIENT_FORM_FIELDS = [
@@ -117,6 +147,15 @@ ITEM_TYPE_LABELS = {
 
 BOTTLES_PER_CRATE = {"300ml": 24, "600ml": 24, "1l": 12}
 
+# Regras de classificação por descrição, versionadas em JSON. A ordem define a
+# prioridade: vence a primeira regra com alguma palavra-chave presente; cada
+# combinação em "all_of" exige todas as palavras. Ao alterar regras, incremente
+# "version" para que o job de reclassificação reprocesse a base.
+DEFAULT_ITEM_TYPE_RULES_FILE = Path(__file__).with_name("item_type_rules.json")
+
+# As mesmas poucas milhares de descrições se repetem em 100k+ linhas.
+ITEM_TYPE_CACHE_SIZE = 16384
+
 
 def canonical_code(value: str) -> str:
     text = (value or "").strip()
@@ -218,15 +257,6 @@ def normalize_header(name: str) -> str:
     return re.sub(r"\s+", " ", ascii_only).strip()
 
 
-def _decode_csv_bytes(raw_bytes: bytes) -> str:
-    for encoding in ("utf-8-sig", "cp1252", "latin-1"):
-        try:
-            return raw_bytes.decode(encoding)
-        except UnicodeDecodeError:
-            continue
-    raise ValueError("Não foi possível ler o CSV. Salve o arquivo em UTF-8 ou ANSI e tente novamente.")
-
-
 def _detect_delimiter(sample_text: str) -> str:
     sample = sample_text[:4000]
     try:
@@ -238,49 +268,214 @@ def _detect_delimiter(sample_text: str) -> str:
         return ";" if semicolons >= commas else ","
 
 
-def _read_csv_rows(raw_bytes: bytes) -> tuple[list[dict[str, str]], dict[str, list[str]]]:
-    text = _decode_csv_bytes(raw_bytes)
-    delimiter = _detect_delimiter(text)
-    reader = csv.reader(io.StringIO(text), delimiter=delimiter)
-    headers = next(reader, None)
+def _build_header_index(headers: list[str] | None) -> dict[str, list[int]]:
     if not headers:
         raise ValueError("CSV sem cabeçalho. Verifique o arquivo enviado.")
 
-    # Preserve duplicate headers (e.g. "CNPJ") with stable unique keys.
-    seen_headers: dict[str, int] = {}
-    unique_headers: list[str] = []
-    header_map: dict[str, list[str]] = {}
-
-    for raw_name in headers:
-        base_name = (raw_name or "").strip()
-        if not base_name:
-            base_name = "coluna"
-        seen_headers[base_name] = seen_headers.get(base_name, 0) + 1
-        count = seen_headers[base_name]
-        unique_name = base_name if count == 1 else f"{base_name}__{count}"
-        unique_headers.append(unique_name)
-        header_map.setdefault(normalize_header(base_name), []).append(unique_name)
-
-    rows: list[dict[str, str]] = []
-    for row in reader:
-        if len(row) < len(unique_headers):
-            row = row + [""] * (len(unique_headers) - len(row))
-        elif len(row) > len(unique_headers):
-            row = row[: len(unique_headers)]
-        rows.append({header: (row[idx] or "").strip() for idx, header in enumerate(unique_headers)})
-    return rows, header_map
+    # Cabeçalhos duplicados (ex.: "CNPJ") mantêm todas as posições, na ordem do arquivo.
+    header_index: dict[str, list[int]] = {}
+    for idx, raw_name in enumerate(headers):
+        base_name = (raw_name or "").strip() or "coluna"
+        header_index.setdefault(normalize_header(base_name), []).append(idx)
+    return header_index
+
+
+def _sniff_csv_buffer(
+    buffer: bytes | mmap.mmap,
+    profiler: ImportProfiler | None = None,
+    label: str = "",
+) -> tuple[str, str]:
+    with profile_stage(profiler, f"{label}.detect_encoding", len(buffer)):
+        encoding = detect_csv_encoding(buffer)
+    with profile_stage(profiler, f"{label}.detect_delimiter"):
+        delimiter = _detect_delimiter(decode_csv_sample(buffer, encoding))
+    return encoding, delimiter
+
+
+def _open_csv_reader(
+    buffer: bytes | mmap.mmap,
+    encoding: str,
+    delimiter: str,
+) -> tuple[Iterator[list[str]], dict[str, list[int]]]:
+    reader = csv.reader(iter_csv_lines(buffer, encoding), delimiter=delimiter)
+    header_index = _build_header_index(next(reader, None))
+    return reader, header_index
+
+
+def _xlsx_cell_text(value: Any) -> str:
+    # Células tipadas voltam ao texto que o CSV exportado traria.
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, (datetime, date)):
+        return value.strftime("%d/%m/%Y")
+    return str(value)
+
+
+class _XlsxRowReader:
+    # Mesma interface usada do csv.reader: iteração de listas de texto e line_num.
+    def __init__(self, rows: Iterator[tuple[Any, ...]]):
+        self._rows = rows
+        self.line_num = 0
+
+    def __iter__(self) -> _XlsxRowReader:
+        return self
+
+    def __next__(self) -> list[str]:
+        values = next(self._rows)
+        self.line_num += 1
+        return [_xlsx_cell_text(value) for value in values]
+
+
+@contextmanager
+def _open_xlsx_reader(source: CsvSource) -> Iterator[tuple[_XlsxRowReader, dict[str, list[int]]]]:
+    # Modo read-only do openpyxl: a planilha é lida em streaming do XML, sem
+    # carregar a pasta inteira. Só a primeira aba é importada.
+    try:
+        from openpyxl import load_workbook
+    except ImportError as exc:  # pragma: no cover - depende do ambiente
+        raise ValueError("Leitura de planilhas XLSX indisponível: instale o pacote openpyxl.") from exc
+
+    try:
+        workbook = load_workbook(
+            io.BytesIO(source) if isinstance(source, bytes) else source,
+            read_only=True,
+            data_only=True,
+        )
+    except Exception as exc:
+        raise ValueError("Planilha XLSX inválida ou corrompida.") from exc
+    try:
+        reader = _XlsxRowReader(workbook.worksheets[0].iter_rows(values_only=True))
+        yield reader, _build_header_index(next(reader, None))
+    finally:
+        workbook.close()
+
+
+def _load_xlsx(
+    kind: str,
+    source: CsvSource,
+    profiler: ImportProfiler | None,
+) -> Any:
+    label = "01.20.11" if kind == "clients" else "02.02.20"
+    with profile_stage(profiler, f"{kind}.read_rows") as record, _open_xlsx_reader(source) as (reader, header_index):
+        first_row = next(reader, None)
+        if first_row is None:
+            raise ValueError(f"Planilha {label} sem linhas de dados.")
+        rows = itertools.chain((first_row,), reader)
+        if kind == "clients":
+            result = _parse_client_rows(rows, *_client_layout(header_index))
+            record["rows_out"] = len(result)
+        else:
+            classify = (
+                profiler.timed("inventory.classify_item_type", classify_item_type)
+                if profiler is not None
+                else classify_item_type
+            )
+            result = _parse_inventory_rows(rows, _inventory_layout(header_index), classify=classify)
+            record["rows_out"] = sum(len(items) for items in result.values())
+        record["rows_in"] = max(0, reader.line_num - 1)
+    if kind != "clients" and profiler is not None:
+        profiler.add_timed(classify, part_of="inventory.read_rows")
+    return result
+
+
+def _plan_csv_chunks(
+    buffer: bytes | mmap.mmap,
+    encoding: str,
+    delimiter: str,
+    chunk_count: int,
+) -> tuple[list[str] | None, int, list[tuple[int, int]]]:
+    # Só o cabeçalho passa pelo csv.reader aqui. Os cortes são provisórios: o
+    # primeiro "\n" depois de cada fração do arquivo ("\n" é sempre 0x0A em
+    # UTF-8, cp1252 e latin-1). Um corte pode cair dentro de um campo entre aspas
+    # com quebra de linha; quem resolve é _parse_csv_in_pool, pela passagem de
+    # bastão entre trechos vizinhos.
+    # Devolve o cabeçalho, o byte inicial dos dados e os trechos (início, fim).
+    start = len(codecs.BOM_UTF8) if encoding == "utf-8-sig" and buffer[:3] == codecs.BOM_UTF8 else 0
+    header_span: dict[str, int] = {}
+    header_lines = _iter_chunk_lines(buffer, chunk_encoding(encoding), start, len(buffer), header_span)
+    reader = csv.reader(header_lines, delimiter=delimiter)
+    headers = next(reader, None)
+    body_start = header_span.get("position", len(buffer))
+    text_length = len(buffer)
+    target = max(1, (text_length - body_start) // max(1, chunk_count))
+
+    cuts = [body_start]
+    while cuts[-1] + target < text_length:
+        newline = buffer.find(b"\n", cuts[-1] + target)
+        if newline == -1 or newline + 1 >= text_length:
+            break
+        cuts.append(newline + 1)
+    cuts.append(text_length)
+    chunks = [(cuts[index], cuts[index + 1]) for index in range(len(cuts) - 1) if cuts[index] < cuts[index + 1]]
+    return headers, body_start, chunks
+
+
+def _iter_chunk_lines(
+    buffer: bytes | mmap.mmap,
+    encoding: str,
+    start: int,
+    end: int,
+    span: dict[str, Any],
+) -> Iterator[str]:
+    # Linhas físicas de [start, end) com o byte seguinte a cada uma em
+    # span["position"]; span["exhausted"] marca que o leitor pediu além do fim.
+    position = start
+    while position < end:
+        newline = buffer.find(b"\n", position, end)
+        stop = end if newline == -1 else newline + 1
+        line = buffer[position:stop].decode(encoding)
+        position = stop
+        span["position"] = position
+        yield line
+    span["exhausted"] = True
+
+
+def _iter_chunk_records(
+    buffer: bytes | mmap.mmap,
+    encoding: str,
+    delimiter: str,
+    start: int,
+    end: int,
+    final: bool,
+    span: dict[str, Any],
+) -> Iterator[list[str]]:
+    # O csv.reader não lê adiante: ao devolver um registro, a última linha
+    # consumida é a dele. Se o trecho acabou no meio de um registro (campo entre
+    # aspas que passa do corte), esse registro fica para o trecho seguinte e
+    # span["stop"] aponta o seu primeiro byte. No fim do arquivo vale o que o
+    # parse sequencial faria com aspas não fechadas.
+    span.update(rows=0, stop=end, position=start)
+    reader = csv.reader(_iter_chunk_lines(buffer, encoding, start, end, span), delimiter=delimiter)
+    while True:
+        record_start = span["position"]
+        row = next(reader, None)
+        if row is None:
+            return
+        if span.get("exhausted") and not final:
+            span["stop"] = record_start
+            return
+        span["rows"] += 1
+        yield row
+
+
+def _cell(row: list[str], idx: int | None) -> str:
+    if idx is None or idx >= len(row):
+        return ""
+    return (row[idx] or "").strip()
 
 
 def _pick_column(
-    normalized_to_raw: dict[str, list[str]],
+    header_index: dict[str, list[int]],
     aliases: list[str],
     required: bool = False,
     context_label: str = "",
-) -> str | None:
+) -> int | None:
     for alias in aliases:
         key = normalize_header(alias)
-        if key in normalized_to_raw and normalized_to_raw[key]:
-            return normalized_to_raw[key][0]
+        if key in header_index and header_index[key]:
+            return header_index[key][0]
     if required:
         raise ValueError(f"Coluna obrigatória não encontrada: {context_label or aliases[0]}.")
     return None
@@ -290,17 +485,23 @@ def _blank_client() -> dict[str, str]:
     return {field: "" for field in CLIENT_FORM_FIELDS}
 
 
+def _compile_client_plan(header_index: dict[str, list[int]]) -> tuple[tuple[str, int], ...]:
+    # Resolve os aliases uma única vez por arquivo: (campo, índice da coluna).
+    plan: list[tuple[str, int]] = []
+    for field, aliases in CLIENT_FIELD_ALIASES.items():
+        column = _pick_column(header_index, aliases, required=False)
+        if column is not None:
+            plan.append((field, column))
+    return tuple(plan)
+
+
 def _extract_client_payload_from_row(
-    row: dict[str, str],
-    header_map: dict[str, list[str]],
+    row: list[str],
+    plan: tuple[tuple[str, int], ...],
 ) -> dict[str, str]:
     payload = _blank_client()
-    for field, aliases in CLIENT_FIELD_ALIASES.items():
-        column = _pick_column(header_map, aliases, required=False)
-        if column:
-            payload[field] = _normalize_client_field(field, row.get(column, ""))
-    if payload.get("client_code"):
-        payload["client_code"] = payload["client_code"].strip()
+    for field, column in plan:
+        payload[field] = _normalize_client_field(field, _cell(row, column))
     return payload
 
 
@@ -322,228 +523,527 @@ def detect_volume_key(description: str) -> str:
     return ""
 
 
-def classify_item_type(description: str) -> str:
-    text = _normalized_description(description)
-
-    if (
-        "cj de mesa" in text
-        or "cj. mesa" in text
-        or "cj mesas" in text
-        or "mesa jogos" in text
-        or "jogos mesa" in text
-        or "jogo de mesa" in text
-        or "jogos de mesa" in text
-        or "jg mesa" in text
-        or "mesa bistro" in text
-        or "mesa madeira" in text
-    ):
-        return "jogo_mesa"
-
-    if "caixa termica" in text or "cx termica" in text:
-        return "caixa_termica"
-
-    if "chopeira" in text or "choppeira" in text:
-        return "chopeira"
-    if (
-        "barril chopp" in text
-        or "torre de chopp" in text
-        or "torre chopp" in text
-        or "cilindro co2" in text
-        or "choperia" in text
-        or "chopp" in text
-    ):
-        return "chopeira"
-
-    if "balde" in text or "baldes" in text:
-        return "balde"
-    if "testeira" in text:
-        return "testeira"
-    if "compressor" in text:
-        return "compressor"
-    if "totem" in text:
-        return "totem"
-    if "cooler carrinho" in text or "coller carrinho" in text:
-        return "cooler_carrinho"
-    if "inflavel" in text or "pit stop" in text or "portal trave" in text:
-        return "inflavel"
-    if "empilhadeira" in text:
-        return "empilhadeira"
-    if "calca" in text:
-        return "calca"
-    if "cartucho" in text or "toner" in text:
-        return "cartucho"
-    if "ombrelone" in text or "ombrellone" in text:
-        return "ombrelone"
-    if "camera fria" in text or "camara frig" in text:
-        return "camera_fria"
-    if "dispensador" in text:
-        return "dispensador"
-
-    if "garrafeira" in text or "gfa vidro" in text:
-        return "garrafeira"
-
-    if "visa cooler" in text or ("visa" in text and "cooler" in text):
-        return "refrigerador"
-
-    refrigerador_words = (
-        "refrigerador",
-        "geladeira",
-        "frigobar",
-        "cervejeira",
-        "horizontal",
-        "vertical",
-        "mini",
-    )
-    if any(word in text for word in refrigerador_words):
-        return "refrigerador"
-    if "equipamento refrigeracao" in text or "pre resfriador" in text or "cervegela" in text or "cervejela" in text:
-        return "refrigerador"
-
-    caixa_words = ("caixa", "cx ", "cx.", "engrad", "fardo")
-    garrafa_words = ("garrafa", "gfa", "vasilhame")
-    has_caixa = any(word in text for word in caixa_words)
-    has_garrafa = any(word in text for word in garrafa_words)
+ItemTypeRules = tuple[tuple[str, tuple[str | tuple[str, ...], ...]], ...]
 
-    if has_caixa:
-        return "vasilhame_caixa"
-    if has_garrafa:
-        return "vasilhame_garrafa"
 
+def read_item_type_rules(path: str | Path | None = None) -> tuple[int, ItemTypeRules]:
+    rules_path = Path(path or PICKUP_CATALOG_ITEM_TYPE_RULES_FILE or DEFAULT_ITEM_TYPE_RULES_FILE)
+    try:
+        data = json.loads(rules_path.read_text(encoding="utf-8"))
+        version = int(data["version"])
+        raw_rules = list(data["rules"])
+    except (OSError, ValueError, KeyError, TypeError) as exc:
+        raise ValueError(f"Arquivo de regras de tipo inválido: {rules_path}.") from exc
+
+    rules: list[tuple[str, tuple[str | tuple[str, ...], ...]]] = []
+    for raw_rule in raw_rules:
+        item_type = str(raw_rule.get("item_type") or "").strip()
+        if item_type not in ITEM_TYPE_LABELS:
+            raise ValueError(f"Tipo de item desconhecido nas regras: {item_type or '(vazio)'}.")
+        terms: list[str | tuple[str, ...]] = [str(keyword) for keyword in raw_rule.get("keywords", []) if keyword]
+        terms.extend(tuple(str(part) for part in combination) for combination in raw_rule.get("all_of", []) if combination)
+        rules.append((item_type, tuple(terms)))
+    return version, tuple(rules)
+
+
+def _compile_item_type_rules(
+    rules: ItemTypeRules,
+) -> tuple[re.Pattern[str], dict[str, int], tuple[tuple[int, tuple[str, ...]], ...], tuple[str, ...]]:
+    keyword_priority: dict[str, int] = {}
+    combinations: list[tuple[int, tuple[str, ...]]] = []
+    for priority, (_, terms) in enumerate(rules):
+        for term in terms:
+            if isinstance(term, str):
+                keyword_priority.setdefault(term, priority)
+            else:
+                combinations.append((priority, tuple(term)))
+
+    # Lookahead para achar todas as posições (inclusive sobrepostas); em cada
+    # posição a alternância devolve a palavra-chave de maior prioridade.
+    ordered = sorted(keyword_priority, key=lambda keyword: keyword_priority[keyword])
+    pattern = re.compile("(?=(" + "|".join(re.escape(keyword) for keyword in ordered) + "))")
+    item_types = tuple(item_type for item_type, _ in rules)
+    return pattern, keyword_priority, tuple(sorted(combinations)), item_types
+
+
+ITEM_TYPE_RULES_VERSION, ITEM_TYPE_RULES = read_item_type_rules()
+_ITEM_TYPE_MATCHER = _compile_item_type_rules(ITEM_TYPE_RULES)
+
+
+def configure_item_type_rules(path: str | Path | None = None) -> int:
+    global ITEM_TYPE_RULES, ITEM_TYPE_RULES_VERSION, _ITEM_TYPE_MATCHER
+
+    version, rules = read_item_type_rules(path)
+    _ITEM_TYPE_MATCHER = _compile_item_type_rules(rules)
+    ITEM_TYPE_RULES, ITEM_TYPE_RULES_VERSION = rules, version
+    classify_item_type.cache_clear()
+    return version
+
+
+def item_type_rules_version() -> int:
+    return ITEM_TYPE_RULES_VERSION
+
+
+@functools.lru_cache(maxsize=ITEM_TYPE_CACHE_SIZE)
+def classify_item_type(description: str) -> str:
+    text = _normalized_description(description)
+    pattern, keyword_priority, combinations, rule_types = _ITEM_TYPE_MATCHER
+
+    best = len(rule_types)
+    for match in pattern.finditer(text):
+        priority = keyword_priority[match.group(1)]
+        if priority < best:
+            best = priority
+            if best == 0:
+                break
+
+    for priority, parts in combinations:
+        if priority >= best:
+            break
+        if all(part in text for part in parts):
+            best = priority
+            break
+
+    if best < len(rule_types):
+        return rule_types[best]
     return "outro"
 
 
-def load_clients_csv(raw_bytes: bytes) -> dict[str, dict[str, str]]:
-    rows, header_map = _read_csv_rows(raw_bytes)
-    if not rows:
-        raise ValueError("CSV 01.20.11 sem linhas de dados.")
+def _use_parallel_parse(buffer: bytes | mmap.mmap, workers: int | None, min_parallel_bytes: int | None) -> int:
+    worker_count = PICKUP_CATALOG_CSV_PARSE_WORKERS if workers is None else workers
+    threshold = PICKUP_CATALOG_CSV_PARALLEL_MIN_BYTES if min_parallel_bytes is None else min_parallel_bytes
+    if worker_count <= 1 or len(buffer) < threshold:
+        return 0
+    return worker_count
+
+
+def _init_parse_worker(rules_version: int, rules: ItemTypeRules) -> None:
+    # Os processos filhos usam exatamente as regras carregadas no processo pai,
+    # mesmo que o arquivo JSON tenha mudado desde o último reload.
+    global ITEM_TYPE_RULES, ITEM_TYPE_RULES_VERSION, _ITEM_TYPE_MATCHER
+
+    _ITEM_TYPE_MATCHER = _compile_item_type_rules(rules)
+    ITEM_TYPE_RULES, ITEM_TYPE_RULES_VERSION = rules, rules_version
+    classify_item_type.cache_clear()
+
+
+def _parse_csv_chunk(
+    kind: str,
+    source: CsvSource,
+    start: int,
+    end: int | None,
+    final: bool,
+    encoding: str,
+    delimiter: str,
+    layout: Any,
+) -> tuple[Any, int, int]:
+    # Arquivos em disco são reabertos via mmap no processo filho; só os
+    # deslocamentos atravessam o pool. As linhas são numeradas a partir de 1
+    # dentro do trecho; quem junta os trechos corrige a numeração.
+    # Devolve o parse, o número de registros e o byte onde o trecho parou.
+    span: dict[str, Any] = {}
+    with open_csv_buffer(source) as buffer:
+        stop = len(buffer) if end is None else end
+        rows = _iter_chunk_records(buffer, chunk_encoding(encoding), delimiter, start, stop, final, span)
+        if kind == "clients":
+            part = _parse_client_rows(rows, *layout)
+        else:
+            part = _parse_inventory_rows(rows, layout)
+    return part, span["rows"], span["stop"]
+
+
+def _renumber_inventory_rows(part: dict[str, list[dict[str, Any]]], offset: int) -> None:
+    if not offset:
+        return
+    for items in part.values():
+        for item in items:
+            item["id"] = f"inv_{int(item['id'][4:]) + offset}"
+
+
+def _parse_csv_in_pool(
+    kind: str,
+    source: CsvSource,
+    buffer: bytes | mmap.mmap,
+    encoding: str,
+    delimiter: str,
+    body_start: int,
+    chunks: list[tuple[int, int]],
+    layout: Any,
+    workers: int,
+) -> list[Any]:
+    text_length = len(buffer)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(chunks)),
+        mp_context=context,
+        initializer=_init_parse_worker,
+        initargs=(ITEM_TYPE_RULES_VERSION, ITEM_TYPE_RULES),
+    ) as executor:
+        futures = []
+        for start, end in chunks:
+            final = end >= text_length
+            if isinstance(source, bytes):
+                chunk_args = (buffer[start:end], 0, None, final)
+            else:
+                chunk_args = (str(source), start, end, final)
+            futures.append(executor.submit(_parse_csv_chunk, kind, *chunk_args, encoding, delimiter, layout))
+
+        # Passagem de bastão: cada trecho só vale se começar onde o anterior
+        # parou. Se o anterior deixou um registro incompleto, o corte caiu dentro
+        # de aspas e o trecho é refeito aqui a partir do início desse registro.
+        parts: list[Any] = []
+        expected_start, rows_before = body_start, 0
+        for (start, end), future in zip(chunks, futures):
+            if start == expected_start:
+                part, rows, stop = future.result()
+                if isinstance(source, bytes):
+                    # O trecho foi enviado recortado: o byte de parada é relativo a ele.
+                    stop += start
+            else:
+                future.cancel()
+                part, rows, stop = _parse_csv_chunk(
+                    kind, source, expected_start, end, end >= text_length, encoding, delimiter, layout
+                )
+            if kind != "clients":
+                _renumber_inventory_rows(part, rows_before)
+            parts.append(part)
+            expected_start, rows_before = stop, rows_before + rows
+        return parts
+
+
+def _load_csv_parallel(
+    kind: str,
+    source: CsvSource,
+    buffer: bytes | mmap.mmap,
+    encoding: str,
+    delimiter: str,
+    workers: int,
+) -> list[Any] | None:
+    # Mais trechos que processos equilibra a carga quando há regiões mais densas.
+    headers, body_start, chunks = _plan_csv_chunks(buffer, encoding, delimiter, workers * 4)
+    header_index = _build_header_index(headers)
+    if not chunks:
+        return []
+
+    layout = _client_layout(header_index) if kind == "clients" else _inventory_layout(header_index)
+    try:
+        return _parse_csv_in_pool(kind, source, buffer, encoding, delimiter, body_start, chunks, layout, workers)
+    except (OSError, BrokenProcessPool):
+        logger.warning("Falha no parse paralelo do CSV (%s); usando parse sequencial.", kind, exc_info=True)
+        return None
+
 
+def _client_layout(header_index: dict[str, list[int]]) -> tuple[int | None, tuple[tuple[str, int], ...]]:
     code_col = _pick_column(
-        header_map,
+        header_index,
         CLIENT_FIELD_ALIASES["client_code"],
         required=True,
         context_label="código do cliente",
     )
+    return code_col, _compile_client_plan(header_index)
 
+
+def _parse_client_rows(
+    rows: Iterable[list[str]],
+    code_col: int | None,
+    client_plan: tuple[tuple[str, int], ...],
+) -> dict[str, dict[str, str]]:
     clients: dict[str, dict[str, str]] = {}
     for row in rows:
-        raw_code = (row.get(code_col or "", "") or "").strip()
+        raw_code = _cell(row, code_col)
         code = canonical_code(raw_code)
         if not code:
             continue
 
-        payload = _extract_client_payload_from_row(row, header_map)
+        payload = _extract_client_payload_from_row(row, client_plan)
         payload["client_code"] = raw_code or code
         clients[code] = payload
+    return clients
+
+
+def load_clients_csv(
+    source: CsvSource,
+    *,
+    workers: int | None = None,
+    min_parallel_bytes: int | None = None,
+    profiler: ImportProfiler | None = None,
+) -> dict[str, dict[str, str]]:
+    if is_xlsx_source(source):
+        clients = _load_xlsx("clients", source, profiler)
+        if not clients:
+            raise ValueError("Nenhum cliente válido encontrado na planilha 01.20.11.")
+        return clients
+
+    with open_csv_buffer(source) as buffer:
+        encoding, delimiter = _sniff_csv_buffer(buffer, profiler, "clients")
+        parallel_workers = _use_parallel_parse(buffer, workers, min_parallel_bytes)
+        with profile_stage(profiler, "clients.read_rows") as record:
+            parts = (
+                _load_csv_parallel("clients", source, buffer, encoding, delimiter, parallel_workers)
+                if parallel_workers
+                else None
+            )
+            if parts is not None:
+                if not parts:
+                    raise ValueError("CSV 01.20.11 sem linhas de dados.")
+                clients: dict[str, dict[str, str]] = {}
+                # Trechos na ordem do arquivo: a última linha de cada código continua vencendo.
+                for part in parts:
+                    clients.update(part)
+            else:
+                reader, header_index = _open_csv_reader(buffer, encoding, delimiter)
+                first_row = next(reader, None)
+                if first_row is None:
+                    raise ValueError("CSV 01.20.11 sem linhas de dados.")
+                clients = _parse_client_rows(itertools.chain((first_row,), reader), *_client_layout(header_index))
+                record["rows_in"] = max(0, reader.line_num - 1)
+            record["rows_out"] = len(clients)
 
     if not clients:
         raise ValueError("Nenhum cliente válido encontrado no CSV 01.20.11.")
     return clients
 
 
-def load_inventory_csv(raw_bytes: bytes) -> dict[str, list[dict[str, Any]]]:
-    rows, header_map = _read_csv_rows(raw_bytes)
-    if not rows:
-        raise ValueError("CSV 02.02.20 sem linhas de dados.")
-
+def _inventory_layout(header_index: dict[str, list[int]]) -> dict[str, Any]:
     code_col = _pick_column(
-        header_map,
+        header_index,
         INVENTORY_ALIASES["client_code"],
         required=True,
         context_label="código do cliente",
     )
     desc_col = _pick_column(
-        header_map,
+        header_index,
         INVENTORY_ALIASES["description"],
         required=True,
         context_label="descrição do item",
     )
-    baixados_col = _pick_column(header_map, INVENTORY_ALIASES["baixados"], required=False)
-    saldo_col = _pick_column(header_map, INVENTORY_ALIASES["saldo"], required=False)
-    if not baixados_col and not saldo_col:
+    baixados_col = _pick_column(header_index, INVENTORY_ALIASES["baixados"], required=False)
+    saldo_col = _pick_column(header_index, INVENTORY_ALIASES["saldo"], required=False)
+    if baixados_col is None and saldo_col is None:
         raise ValueError("Coluna obrigatória não encontrada: baixados ou saldo.")
-    rg_col = _pick_column(header_map, INVENTORY_ALIASES["rg"], required=False)
+    rg_col = _pick_column(header_index, INVENTORY_ALIASES["rg"], required=False)
     rg_fallback_col = _pick_column(
-        header_map,
+        header_index,
         ["controla nr serie", "controla nr. serie", "controla n serie"],
         required=False,
     )
-    comodato_col = _pick_column(header_map, INVENTORY_ALIASES["comodato_number"], required=False)
-    issue_date_col = _pick_column(header_map, INVENTORY_ALIASES["issue_date"], required=False)
-    product_col = _pick_column(header_map, INVENTORY_ALIASES["product_code"], required=False)
+    comodato_col = _pick_column(header_index, INVENTORY_ALIASES["comodato_number"], required=False)
+    issue_date_col = _pick_column(header_index, INVENTORY_ALIASES["issue_date"], required=False)
+    product_col = _pick_column(header_index, INVENTORY_ALIASES["product_code"], required=False)
+    return {
+        "code": code_col,
+        "description": desc_col,
+        "baixados": baixados_col,
+        "saldo": saldo_col,
+        "rg": rg_col,
+        "rg_fallback": rg_fallback_col,
+        "comodato_number": comodato_col,
+        "issue_date": issue_date_col,
+        "product_code": product_col,
+        "client_plan": _compile_client_plan(header_index),
+    }
+
+
+def _parse_inventory_rows(
+    rows: Iterable[list[str]],
+    layout: dict[str, Any],
+    first_row_number: int = 1,
+    classify: Callable[[str], str] = classify_item_type,
+) -> dict[str, list[dict[str, Any]]]:
+    code_col = layout["code"]
+    desc_col = layout["description"]
+    baixados_col = layout["baixados"]
+    saldo_col = layout["saldo"]
+    rg_col = layout["rg"]
+    rg_fallback_col = layout["rg_fallback"]
+    comodato_col = layout["comodato_number"]
+    issue_date_col = layout["issue_date"]
+    product_col = layout["product_code"]
+    client_plan = layout["client_plan"]
 
     result: dict[str, list[dict[str, Any]]] = {}
-    row_number = 0
-    for row in rows:
-        row_number += 1
-        raw_code = (row.get(code_col or "", "") or "").strip()
-        code = canonical_code(raw_code)
-        if not code:
+    for row_number, row in enumerate(rows, start=first_row_number):
+
+        # Apenas saldos negativos viram itens em aberto; sem "-" não há como o
+        # valor ser negativo, então a linha é descartada sem nenhum parse.
+        baixados_raw = _cell(row, baixados_col)
+        saldo_raw = _cell(row, saldo_col)
+        if "-" not in baixados_raw and "-" not in saldo_raw:
             continue
 
-        baixados_value = parse_integer(row.get(baixados_col or "", "0")) if baixados_col else 0
-        saldo_value = parse_integer(row.get(saldo_col or "", "0")) if saldo_col else 0
+        baixados_value = parse_integer(baixados_raw) if baixados_col is not None else 0
+        saldo_value = parse_integer(saldo_raw) if saldo_col is not None else 0
 
         open_balance = None
-        if baixados_col and baixados_value < 0:
+        if baixados_col is not None and baixados_value < 0:
             open_balance = baixados_value
-        elif saldo_col and saldo_value < 0:
+        elif saldo_col is not None and saldo_value < 0:
             open_balance = saldo_value
 
         if open_balance is None:
             continue
 
-        open_quantity = abs(open_balance)
-        description = (row.get(desc_col or "", "") or "").strip()
-        description = _compact_spaces(description)
+        code = canonical_code(_cell(row, code_col))
+        if not code:
+            continue
+
+        description = _compact_spaces(_cell(row, desc_col))
         if not description:
             continue
 
-        rg = _compact_spaces(row.get(rg_col or "", "")) if rg_col else ""
-        if not rg and rg_fallback_col:
-            rg = _compact_spaces(row.get(rg_fallback_col or "", ""))
-        comodato_number = _compact_spaces(row.get(comodato_col or "", "")) if comodato_col else ""
-        issue_date = _compact_spaces(row.get(issue_date_col or "", "")) if issue_date_col else ""
-        product_code = _compact_spaces(row.get(product_col or "", "")) if product_col else ""
-        item_type = classify_item_type(description)
-        volume_key = detect_volume_key(description)
+        rg = _compact_spaces(_cell(row, rg_col))
+        if not rg and rg_fallback_col is not None:
+            rg = _compact_spaces(_cell(row, rg_fallback_col))
 
+        items = result.get(code)
         item = {
             "id": f"inv_{row_number}",
             "description": description,
-            "open_quantity": open_quantity,
-            "item_type": item_type,
+            "open_quantity": abs(open_balance),
+            "item_type": classify(description),
             "rg": rg,
-            "comodato_number": comodato_number,
-            "issue_date": issue_date,
-            "volume_key": volume_key,
+            "comodato_number": _compact_spaces(_cell(row, comodato_col)),
+            "issue_date": _compact_spaces(_cell(row, issue_date_col)),
+            "volume_key": detect_volume_key(description),
             "source_baixados": open_balance,
-            "product_code": product_code,
-            "client_snapshot": _extract_client_payload_from_row(row, header_map),
+            "product_code": _compact_spaces(_cell(row, product_col)),
         }
-        result.setdefault(code, []).append(item)
+        if items is None:
+            # O merge só lê o snapshot do primeiro item de cada cliente; as demais
+            # linhas não montam o dicionário de 14 campos.
+            item["client_snapshot"] = _extract_client_payload_from_row(row, client_plan)
+            result[code] = [item]
+        else:
+            items.append(item)
 
     return result
 
 
+def load_inventory_csv(
+    source: CsvSource,
+    *,
+    workers: int | None = None,
+    min_parallel_bytes: int | None = None,
+    profiler: ImportProfiler | None = None,
+) -> dict[str, list[dict[str, Any]]]:
+    if is_xlsx_source(source):
+        return _load_xlsx("inventory", source, profiler)
+
+    with open_csv_buffer(source) as buffer:
+        encoding, delimiter = _sniff_csv_buffer(buffer, profiler, "inventory")
+        parallel_workers = _use_parallel_parse(buffer, workers, min_parallel_bytes)
+        with profile_stage(profiler, "inventory.read_rows") as record:
+            parts = (
+                _load_csv_parallel("inventory", source, buffer, encoding, delimiter, parallel_workers)
+                if parallel_workers
+                else None
+            )
+            if parts is None:
+                reader, header_index = _open_csv_reader(buffer, encoding, delimiter)
+                first_row = next(reader, None)
+                if first_row is None:
+                    raise ValueError("CSV 02.02.20 sem linhas de dados.")
+                classify = (
+                    profiler.timed("inventory.classify_item_type", classify_item_type)
+                    if profiler is not None
+                    else classify_item_type
+                )
+                result = _parse_inventory_rows(
+                    itertools.chain((first_row,), reader),
+                    _inventory_layout(header_index),
+                    classify=classify,
+                )
+                record["rows_in"] = max(0, reader.line_num - 1)
+            elif not parts:
+                raise ValueError("CSV 02.02.20 sem linhas de dados.")
+            else:
+                # Cada trecho já numera as linhas a partir do seu deslocamento no arquivo;
+                # concatenar na ordem dos trechos reproduz a ordem do parse sequencial.
+                # O snapshot fica só no primeiro item de cada cliente, como no serial.
+                result = {}
+                for part in parts:
+                    for code, items in part.items():
+                        current = result.get(code)
+                        if current is None:
+                            result[code] = items
+                        else:
+                            items[0].pop("client_snapshot", None)
+                            current.extend(items)
+            record["rows_out"] = sum(len(items) for items in result.values())
+        if parts is None and profiler is not None:
+            profiler.add_timed(classify, part_of="inventory.read_rows")
+    return result
+
+
+InventoryRowBatch = tuple[int, list[list[str]]]
+
+
+@contextmanager
+def open_inventory_row_batches(
+    source: CsvSource,
+    batch_rows: int,
+    profiler: ImportProfiler | None = None,
+) -> Iterator[tuple[Iterator[InventoryRowBatch], dict[str, Any]]]:
+    # Leitura em blocos para o pipeline de importação. Cabeçalho, colunas e a
+    # primeira linha são conferidos aqui, antes de qualquer gravação; os blocos
+    # (número da primeira linha, linhas cruas) saem de quem iterar, em qualquer thread.
+    with ExitStack() as stack:
+        if is_xlsx_source(source):
+            reader, header_index = stack.enter_context(_open_xlsx_reader(source))
+            empty_message = "Planilha 02.02.20 sem linhas de dados."
+        else:
+            buffer = stack.enter_context(open_csv_buffer(source))
+            encoding, delimiter = _sniff_csv_buffer(buffer, profiler, "inventory")
+            reader, header_index = _open_csv_reader(buffer, encoding, delimiter)
+            empty_message = "CSV 02.02.20 sem linhas de dados."
+        first_row = next(reader, None)
+        if first_row is None:
+            raise ValueError(empty_message)
+        layout = _inventory_layout(header_index)
+
+        def batches() -> Iterator[InventoryRowBatch]:
+            rows = itertools.chain((first_row,), reader)
+            first_row_number = 1
+            while batch := list(itertools.islice(rows, max(1, int(batch_rows)))):
+                yield first_row_number, batch
+                first_row_number += len(batch)
+
+        yield batches(), layout
+
+
+def parse_inventory_batch(
+    batch: InventoryRowBatch,
+    layout: dict[str, Any],
+    classify: Callable[[str], str] = classify_item_type,
+) -> dict[str, list[dict[str, Any]]]:
+    # Mesmo parse do arquivo inteiro, restrito a um bloco: o snapshot do cliente
+    # vem no primeiro item de cada código *dentro do bloco*.
+    first_row_number, rows = batch
+    return _parse_inventory_rows(rows, layout, first_row_number, classify)
+
+
 def merge_clients_with_inventory_snapshots(
     clients: dict[str, dict[str, str]],
     inventory: dict[str, list[dict[str, Any]]],
 ) -> dict[str, dict[str, str]]:
-    merged = {code: dict(payload) for code, payload in clients.items()}
-
+    # Atualiza `clients` no lugar e o devolve; o snapshot vem do primeiro item
+    # de cada cliente (o único que o carrega).
     for code, items in inventory.items():
         if not items:
             continue
-        snapshot = dict(items[0].get("client_snapshot") or {})
+        snapshot = items[0].get("client_snapshot") or {}
 
-        if code not in merged:
-            merged[code] = _blank_client()
-            merged[code]["client_code"] = snapshot.get("client_code") or code
+        payload = clients.get(code)
+        if payload is None:
+            payload = clients[code] = _blank_client()
+            payload["client_code"] = snapshot.get("client_code") or code
 
         for field in CLIENT_FORM_FIELDS:
-            current = (merged[code].get(field, "") or "").strip()
+            if (payload.get(field, "") or "").strip():
+                continue
             incoming = (snapshot.get(field, "") or "").strip()
-            if not current and incoming:
-                merged[code][field] = incoming
+            if incoming:
+                payload[field] = incoming
+
+    return clients
 
-    return merged
@@ -0,0 +1,1181 @@
+from __future__ import annotations
+
+import json
+import itertools
+from typing import Any, Callable, Iterator
+
+from sqlalchemy import Integer, delete, exists, func, select, update
+from sqlalchemy.orm import Session
+
+from app.core.config import (
+    PICKUP_CATALOG_IMPORT_PIPELINE,
+    PICKUP_CATALOG_IMPORT_TRACE_MEMORY,
+    PICKUP_CATALOG_PIPELINE_CHUNK_ROWS,
+    PICKUP_CATALOG_PIPELINE_QUEUE_CHUNKS,
+    PICKUP_CATALOG_RETAINED_BATCHES,
+)
+from app.models.pickup_catalog import (
+    PickupCatalogActiveBatch,
+    PickupCatalogClient,
+    PickupCatalogInventoryItem,
+    PickupCatalogOrder,
+    PickupCatalogUploadBatch,
+)
+from app.services.allocation_token_cache import bump_inventory_revision
+from app.services.code_tokens import (
+    code_key,
+    delete_batch_inventory_tokens,
+    delete_inventory_item_tokens,
+    index_inventory_tokens,
+)
+from app.services.csv_source import CsvSource, csv_sha256
+from app.services.import_pipeline import run_pipeline
+from app.services.import_profile import ImportProfiler
+from app.services.key_set import key_set, select_matching_keys
+from app.services.material_bucket import resolve_material_bucket
+from app.services.pickup_catalog_bulk import (
+    BULK_CHUNK_SIZE,
+    client_ids_by_code,
+    delete_inventory_items,
+    insert_inventory_items,
+    update_inventory_items,
+    upsert_clients,
+)
+from app.services.pickup_catalog_csv import (
+    CLIENT_FORM_FIELDS,
+    canonical_code,
+    classify_item_type,
+    item_type_rules_version,
+    load_clients_csv,
+    load_inventory_csv,
+    merge_clients_with_inventory_snapshots,
+    open_inventory_row_batches,
+    parse_inventory_batch,
+)
+
+
+INVENTORY_ITEM_VALUE_FIELDS = (
+    "description",
+    "item_type",
+    "material_bucket",
+    "open_quantity",
+    "rg",
+    "rg_key",
+    "comodato_number",
+    "invoice_issue_date",
+    "volume_key",
+    "source_baixados",
+    "product_code",
+    "classifier_version",
+)
+
+# Etapas informadas ao callback de progresso (jobs de importação).
+IMPORT_STAGE_CLIENTS = "lendo_clientes"
+IMPORT_STAGE_INVENTORY = "lendo_itens"
+IMPORT_STAGE_WRITING = "gravando"
+IMPORT_STAGE_DONE = "concluida"
+
+ImportProgress = Callable[[str, int], None]
+# Chamado após cada commit parcial do snapshot: (itens gravados, total de itens).
+# No pipeline o total ainda não é conhecido: vai o número de itens lidos até ali.
+ImportCommitProgress = Callable[[int, int], None]
+
+ACTIVE_BATCH_POINTER_ID = 1
+# Lotes novos são gravados em transações curtas deste tamanho; ficam invisíveis
+# às leituras até o ponteiro do lote ativo mudar.
+SNAPSHOT_COMMIT_ROWS = 20000
+# Validação (dry run): quantos problemas por linha voltam no resultado.
+DRY_RUN_MAX_PROBLEMS = 200
+
+
+def _safe_text(value: Any) -> str:
+    return str(value or "").strip()
+
+
+def active_batch_id(db: Session) -> int | None:
+    pointer = (
+        db.query(PickupCatalogActiveBatch.batch_id)
+        .filter(PickupCatalogActiveBatch.id == ACTIVE_BATCH_POINTER_ID)
+        .first()
+    )
+    if pointer is not None:
+        return int(pointer[0]) if pointer[0] is not None else None
+    # Bases anteriores ao ponteiro: o lote mais recente é o ativo.
+    row = (
+        db.query(PickupCatalogUploadBatch.id)
+        .order_by(PickupCatalogUploadBatch.id.desc())
+        .first()
+    )
+    return int(row[0]) if row else None
+
+
+def activate_batch(db: Session, batch_id: int | None) -> None:
+    # Troca atômica do lote servido às leituras; o commit fica com quem chama.
+    now = func.now()
+    pointer = db.get(PickupCatalogActiveBatch, ACTIVE_BATCH_POINTER_ID)
+    if pointer is None:
+        db.add(PickupCatalogActiveBatch(id=ACTIVE_BATCH_POINTER_ID, batch_id=batch_id))
+    else:
+        pointer.batch_id = batch_id
+        pointer.activated_at = now
+    if batch_id is not None:
+        db.execute(
+            update(PickupCatalogUploadBatch.__table__)
+            .where(PickupCatalogUploadBatch.__table__.c.id == batch_id)
+            .values(activated_at=now)
+        )
+
+
+def _ensure_active_pointer(db: Session) -> int | None:
+    # Fixa o lote atual antes de gravar outro; sem isso, o lote em construção
+    # seria o "mais recente" para as leituras.
+    if db.get(PickupCatalogActiveBatch, ACTIVE_BATCH_POINTER_ID) is None:
+        activate_batch(db, active_batch_id(db))
+        db.commit()
+    return active_batch_id(db)
+
+
+def uses_batched_inventory(db: Session) -> bool:
+    return (
+        db.query(PickupCatalogInventoryItem.id)
+        .filter(PickupCatalogInventoryItem.batch_id.isnot(None))
+        .first()
+        is not None
+    )
+
+
+def _client_columns() -> list[Any]:
+    return [getattr(PickupCatalogClient, field) for field in CLIENT_FORM_FIELDS]
+
+
+def _client_payload_from_row(row: Any, code: str) -> dict[str, str]:
+    payload = {field: _safe_text(getattr(row, field)) for field in CLIENT_FORM_FIELDS}
+    payload["client_code"] = payload["client_code"] or code
+    return payload
+
+
+def load_existing_clients_rows(db: Session) -> dict[str, dict[str, str]]:
+    rows: dict[str, dict[str, str]] = {}
+    for client in db.query(*_client_columns()):
+        code = canonical_code(_safe_text(client.client_code))
+        if not code:
+            continue
+        rows[code] = _client_payload_from_row(client, code)
+    return rows
+
+
+def load_clients_file_codes(db: Session) -> set[str]:
+    # Códigos do último 01.20.11 processado (ver _mark_clients_file_codes).
+    return {
+        code
+        for (client_code,) in db.query(PickupCatalogClient.client_code).filter(
+            PickupCatalogClient.in_clients_file.is_(True)
+        )
+        if (code := canonical_code(_safe_text(client_code)))
+    }
+
+
+def load_existing_inventory_rows(db: Session) -> dict[str, list[dict[str, Any]]]:
+    query = db.query(
+        PickupCatalogInventoryItem.client_id,
+        *(getattr(PickupCatalogInventoryItem, field) for field in INVENTORY_ITEM_VALUE_FIELDS),
+    )
+    if uses_batched_inventory(db):
+        current_batch_id = active_batch_id(db)
+        if current_batch_id is None:
+            return {}
+        query = query.filter(PickupCatalogInventoryItem.batch_id == current_batch_id)
+
+    inventory_items = query.order_by(
+        PickupCatalogInventoryItem.client_id.asc(),
+        PickupCatalogInventoryItem.id.asc(),
+    ).all()
+    if not inventory_items:
+        return {}
+
+    client_ids = sorted({int(row.client_id) for row in inventory_items if int(row.client_id or 0) > 0})
+    client_rows = select_matching_keys(
+        db,
+        select(PickupCatalogClient.id, *_client_columns()),
+        PickupCatalogClient.id,
+        client_ids,
+        Integer,
+    )
+    clients_by_id: dict[int, Any] = {int(client.id): client for client in client_rows}
+
+    result: dict[str, list[dict[str, Any]]] = {}
+    row_number = 0
+    for row in inventory_items:
+        client = clients_by_id.get(int(row.client_id or 0))
+        code = canonical_code(_safe_text(getattr(client, "client_code", "")))
+        if not code:
+            continue
+
+        row_number += 1
+        items = result.get(code)
+        item = {
+            "id": f"db_{row_number}",
+            "description": _safe_text(row.description),
+            "open_quantity": int(row.open_quantity or 0),
+            "item_type": _safe_text(row.item_type) or "outro",
+            "rg": _safe_text(row.rg),
+            "comodato_number": _safe_text(row.comodato_number),
+            "issue_date": _safe_text(row.invoice_issue_date),
+            "volume_key": _safe_text(row.volume_key),
+            "source_baixados": int(row.source_baixados or 0),
+            "product_code": _safe_text(row.product_code),
+            "classifier_version": int(row.classifier_version or 0),
+        }
+        if items is None:
+            # Snapshot só no primeiro item do cliente, como no parse do CSV.
+            item["client_snapshot"] = _client_payload_from_row(client, code)
+            result[code] = [item]
+        else:
+            items.append(item)
+
+    return result
+
+
+def prepare_merged_clients(
+    client_rows: dict[str, dict[str, str]],
+    inventory_rows: dict[str, list[dict[str, Any]]],
+) -> dict[str, dict[str, str]]:
+    merged = merge_clients_with_inventory_snapshots(client_rows, inventory_rows)
+    for code, payload in merged.items():
+        payload["client_code"] = _safe_text(payload.get("client_code")) or code
+    return merged
+
+
+def _inventory_item_values(item: dict[str, Any], rules_version: int) -> dict[str, Any]:
+    description = _safe_text(item.get("description"))
+    item_type = _safe_text(item.get("item_type")) or "outro"
+    return {
+        "description": description,
+        "item_type": item_type,
+        "material_bucket": resolve_material_bucket(item_type, description),
+        "open_quantity": int(item.get("open_quantity", 0) or 0),
+        "rg": _safe_text(item.get("rg")),
+        "rg_key": code_key(item.get("rg")),
+        "comodato_number": _safe_text(item.get("comodato_number")),
+        "invoice_issue_date": _safe_text(item.get("issue_date")),
+        "volume_key": _safe_text(item.get("volume_key")),
+        "source_baixados": int(item.get("source_baixados", 0) or 0),
+        "product_code": _safe_text(item.get("product_code")),
+        "classifier_version": int(item.get("classifier_version", rules_version)),
+    }
+
+
+def _inventory_content_key(
+    code: str,
+    values: dict[str, Any],
+    occurrences: dict[tuple[str, str, str, str], int],
+) -> tuple[str, str, str, str, int]:
+    # Chave estável da linha: cliente, produto, RG e comodato. Linhas repetidas
+    # com a mesma chave (ex.: vasilhames sem RG) são numeradas na ordem do arquivo.
+    base_key = (code, values["product_code"], values["rg"], values["comodato_number"])
+    occurrence = occurrences.get(base_key, 0)
+    occurrences[base_key] = occurrence + 1
+    return (*base_key, occurrence)
+
+
+def _insert_inventory_snapshot(
+    db: Session,
+    batch_id: int,
+    inventory_rows: dict[str, list[dict[str, Any]]],
+    client_ids: dict[str, int],
+    rules_version: int,
+    commit_rows: int = SNAPSHOT_COMMIT_ROWS,
+    commit_progress: ImportCommitProgress | None = None,
+) -> int:
+    rows = [
+        {"client_id": client_ids[code], "batch_id": batch_id, **_inventory_item_values(item, rules_version)}
+        for code, items in inventory_rows.items()
+        for item in items
+    ]
+    commit_rows = max(1, int(commit_rows))
+    for start in range(0, len(rows), commit_rows):
+        insert_inventory_items(db, rows[start:start + commit_rows])
+        db.commit()
+        if commit_progress is not None:
+            commit_progress(min(start + commit_rows, len(rows)), len(rows))
+    return len(rows)
+
+
+def _count_batch_items(db: Session, batch_id: int | None) -> int:
+    query = db.query(func.count(PickupCatalogInventoryItem.id))
+    if uses_batched_inventory(db):
+        if batch_id is None:
+            return 0
+        query = query.filter(PickupCatalogInventoryItem.batch_id == batch_id)
+    return int(query.scalar() or 0)
+
+
+def _discard_batch(db: Session, batch_id: int) -> None:
+    items_table = PickupCatalogInventoryItem.__table__
+    batches_table = PickupCatalogUploadBatch.__table__
+    delete_batch_inventory_tokens(db, batch_id)
+    db.execute(delete(items_table).where(items_table.c.batch_id == batch_id))
+    db.execute(delete(batches_table).where(batches_table.c.id == batch_id))
+    db.commit()
+
+
+class _StagedClients:
+    # Clientes de um lote novo ainda não ativado. Os itens referenciam client_id,
+    # então só os códigos novos são inseridos durante a gravação; os dados dos
+    # clientes já existentes mudam na ativação, na mesma transação da troca do
+    # ponteiro. Se a importação falha, discard() apaga os clientes criados.
+    # Com o 01.20.11 idêntico ao do lote ativo, `unchanged_codes` traz os códigos
+    # dele: esses clientes são mantidos como estão, sem reler o arquivo.
+    def __init__(self, unchanged_codes: set[str] | None = None) -> None:
+        self.ids: dict[str, int] = {}
+        self.created_ids: list[int] = []
+        self.updates: dict[str, dict[str, str]] = {}
+        self.unchanged_codes = unchanged_codes or set()
+
+    def kept_codes(self) -> list[str]:
+        return sorted(self.ids.keys() | self.unchanged_codes)
+
+    def stage(self, db: Session, clients: dict[str, dict[str, str]]) -> None:
+        existing_ids = client_ids_by_code(db, list(clients))
+        self.ids.update(existing_ids)
+        self.updates.update({
+            code: payload
+            for code, payload in clients.items()
+            if code in existing_ids and code not in self.unchanged_codes
+        })
+        created = {code: payload for code, payload in clients.items() if code not in existing_ids}
+        if created:
+            created_ids = upsert_clients(db, created)
+            self.ids.update(created_ids)
+            self.created_ids.extend(created_ids.values())
+
+    def apply(self, db: Session) -> int:
+        if self.updates:
+            upsert_clients(db, self.updates)
+        return len(self.updates)
+
+    def discard(self, db: Session) -> None:
+        # Depois de _discard_batch: os itens do lote já não referenciam os clientes.
+        table = PickupCatalogClient.__table__
+        items_table = PickupCatalogInventoryItem.__table__
+        orders_table = PickupCatalogOrder.__table__
+        for start in range(0, len(self.created_ids), BULK_CHUNK_SIZE):
+            db.execute(
+                delete(table).where(
+                    table.c.id.in_(self.created_ids[start:start + BULK_CHUNK_SIZE]),
+                    ~exists().where(orders_table.c.client_id == table.c.id),
+                    ~exists().where(items_table.c.client_id == table.c.id),
+                )
+            )
+        db.commit()
+
+
+def reclaim_inactive_batches(db: Session, keep: int | None = None) -> int:
+    # Mantém o lote ativo e os últimos lotes já ativados (para voltar atrás);
+    # os demais saem, um lote por transação. Lotes mais novos que o ativo podem
+    # estar em construção e não são tocados.
+    keep = max(1, keep or PICKUP_CATALOG_RETAINED_BATCHES)
+    if db.get(PickupCatalogActiveBatch, ACTIVE_BATCH_POINTER_ID) is None:
+        return 0
+    current_batch_id = active_batch_id(db)
+    if current_batch_id is None:
+        return 0
+
+    retained_ids = {
+        int(row[0])
+        for row in (
+            db.query(PickupCatalogUploadBatch.id)
+            .filter(
+                PickupCatalogUploadBatch.id < current_batch_id,
+                PickupCatalogUploadBatch.activated_at.isnot(None),
+            )
+            .order_by(PickupCatalogUploadBatch.id.desc())
+            .limit(keep - 1)
+        )
+    } if keep > 1 else set()
+    stale_ids = [
+        int(row[0])
+        for row in (
+            db.query(PickupCatalogUploadBatch.id)
+            .filter(PickupCatalogUploadBatch.id < current_batch_id)
+            .order_by(PickupCatalogUploadBatch.id.asc())
+        )
+        if int(row[0]) not in retained_ids
+    ]
+
+    items_table = PickupCatalogInventoryItem.__table__
+    # Itens de bases legadas (sem lote) deixam de ser lidos quando há ponteiro.
+    delete_batch_inventory_tokens(db, None)
+    db.execute(delete(items_table).where(items_table.c.batch_id.is_(None)))
+    db.commit()
+    for batch_id in stale_ids:
+        _discard_batch(db, batch_id)
+    return len(stale_ids)
+
+
+def _diff_inventory(
+    db: Session,
+    batch_id: int,
+    inventory_rows: dict[str, list[dict[str, Any]]],
+    rules_version: int,
+) -> dict[str, Any]:
+    # Compara o arquivo com os itens do lote, sem gravar: inserts vêm como
+    # (código do cliente, valores), updates já no formato de update_inventory_items.
+    current_rows = (
+        db.query(
+            PickupCatalogInventoryItem.id,
+            PickupCatalogClient.client_code,
+            *(getattr(PickupCatalogInventoryItem, field) for field in INVENTORY_ITEM_VALUE_FIELDS),
+        )
+        .join(PickupCatalogClient, PickupCatalogClient.id == PickupCatalogInventoryItem.client_id)
+        .filter(PickupCatalogInventoryItem.batch_id == batch_id)
+        .order_by(PickupCatalogInventoryItem.id.asc())
+        .all()
+    )
+
+    occurrences: dict[tuple[str, str, str, str], int] = {}
+    current: dict[tuple[str, str, str, str, int], tuple[int, dict[str, Any]]] = {}
+    for row in current_rows:
+        values = {field: getattr(row, field) for field in INVENTORY_ITEM_VALUE_FIELDS}
+        key = _inventory_content_key(canonical_code(_safe_text(row.client_code)), values, occurrences)
+        current[key] = (int(row.id), values)
+
+    occurrences = {}
+    inserts: list[tuple[str, dict[str, Any]]] = []
+    updates: list[dict[str, Any]] = []
+    unchanged = 0
+    for code, items in inventory_rows.items():
+        for item in items:
+            values = _inventory_item_values(item, rules_version)
+            key = _inventory_content_key(code, values, occurrences)
+            existing = current.pop(key, None)
+            if existing is None:
+                inserts.append((code, values))
+            elif existing[1] != values:
+                updates.append({"row_id": existing[0], **{f"new_{field}": value for field, value in values.items()}})
+            else:
+                unchanged += 1
+
+    # O que sobrou do lote não existe mais no arquivo.
+    return {
+        "inserts": inserts,
+        "updates": updates,
+        "deleted_ids": [row_id for row_id, _ in current.values()],
+        "unchanged": unchanged,
+    }
+
+
+def _diff_counts(diff: dict[str, Any], mode: str) -> dict[str, Any]:
+    return {
+        "mode": mode,
+        "inserted": len(diff["inserts"]),
+        "updated": len(diff["updates"]),
+        "deleted": len(diff["deleted_ids"]),
+        "unchanged": diff["unchanged"],
+    }
+
+
+def _apply_inventory_diff(
+    db: Session,
+    batch_id: int,
+    inventory_rows: dict[str, list[dict[str, Any]]],
+    client_ids: dict[str, int],
+    rules_version: int,
+) -> dict[str, Any]:
+    diff = _diff_inventory(db, batch_id, inventory_rows, rules_version)
+    delete_inventory_items(db, diff["deleted_ids"])
+    # Linhas alteradas perdem os tokens e voltam a ser indexadas com as inseridas.
+    delete_inventory_item_tokens(db, [row["row_id"] for row in diff["updates"]])
+    update_inventory_items(db, diff["updates"], INVENTORY_ITEM_VALUE_FIELDS)
+    insert_inventory_items(
+        db,
+        [{"client_id": client_ids[code], "batch_id": batch_id, **values} for code, values in diff["inserts"]],
+    )
+    index_inventory_tokens(db, batch_id)
+    return _diff_counts(diff, "incremental")
+
+
+def _purge_stale_clients(db: Session, kept_codes: list[str]) -> None:
+    # Clientes fora da nova base saem, exceto os referenciados por pedidos ou
+    # por itens de lotes mantidos para rollback.
+    # Tudo como anti-join (NOT EXISTS): a lista de códigos mantidos passa de
+    # dezenas de milhares e não cabe num NOT IN.
+    table = PickupCatalogClient.__table__
+    items_table = PickupCatalogInventoryItem.__table__
+    orders_table = PickupCatalogOrder.__table__
+    with key_set(db, kept_codes) as kept:
+        db.execute(
+            delete(table).where(
+                ~exists().where(orders_table.c.client_id == table.c.id),
+                ~exists().where(items_table.c.client_id == table.c.id),
+                ~exists().where(kept.c.key == table.c.client_code),
+            )
+        )
+
+
+def _mark_clients_file_codes(db: Session, codes: list[str]) -> None:
+    # Marca os clientes do 01.20.11 processado e desmarca os que saíram dele.
+    # Não faz commit.
+    table = PickupCatalogClient.__table__
+    with key_set(db, codes) as listed:
+        listed_code = exists().where(listed.c.key == table.c.client_code)
+        db.execute(update(table).where(table.c.in_clients_file.is_(True), ~listed_code).values(in_clients_file=False))
+        db.execute(update(table).where(table.c.in_clients_file.is_(False), listed_code).values(in_clients_file=True))
+
+
+def _apply_batch_stats(
+    batch: PickupCatalogUploadBatch,
+    clients_count: int,
+    inventory_clients: int,
+    inventory_diff: dict[str, Any],
+) -> None:
+    batch.clients_count = clients_count
+    batch.inventory_clients = inventory_clients
+    batch.open_items = inventory_diff["inserted"] + inventory_diff["updated"] + inventory_diff["unchanged"]
+
+
+def _new_snapshot_batch(
+    db: Session,
+    *,
+    clients_file_name: str,
+    inventory_file_name: str,
+    clients_sha256: str,
+    inventory_sha256: str,
+) -> tuple[PickupCatalogUploadBatch, int]:
+    # Snapshot em lote novo (blue/green): o lote anterior segue servindo as
+    # leituras até a troca do ponteiro, feita numa transação mínima no fim.
+    previous_batch_id = _ensure_active_pointer(db)
+    replaced_items = _count_batch_items(db, previous_batch_id)
+    batch = PickupCatalogUploadBatch(
+        clients_file_name=clients_file_name,
+        inventory_file_name=inventory_file_name,
+        clients_sha256=clients_sha256,
+        inventory_sha256=inventory_sha256,
+    )
+    db.add(batch)
+    return batch, replaced_items
+
+
+def _activate_snapshot_batch(
+    db: Session,
+    batch: PickupCatalogUploadBatch,
+    *,
+    staged_clients: _StagedClients,
+    clients_file_codes: list[str] | None,
+    inventory_clients: int,
+    inventory_diff: dict[str, Any],
+    profiler: ImportProfiler,
+) -> None:
+    client_codes = staged_clients.kept_codes()
+    # Tokens de RG gravados antes da troca do ponteiro: o lote já entra indexado.
+    with profiler.stage("index_code_tokens", inventory_diff["inserted"]) as record:
+        record["rows_out"] = index_inventory_tokens(db, batch.id)
+        db.commit()
+
+    with profiler.stage("purge_stale_clients", len(client_codes)):
+        _purge_stale_clients(db, client_codes)
+        db.commit()
+
+    # Clientes existentes e ponteiro mudam juntos, num único commit.
+    with profiler.stage("upsert_clients", len(staged_clients.updates)) as record:
+        record["rows_out"] = staged_clients.apply(db)
+        if clients_file_codes is not None:
+            _mark_clients_file_codes(db, clients_file_codes)
+    with profiler.stage("activate_batch"):
+        _apply_batch_stats(batch, len(client_codes), inventory_clients, inventory_diff)
+        activate_batch(db, batch.id)
+        db.commit()
+
+
+def _write_snapshot_batch(
+    db: Session,
+    *,
+    merged_clients: dict[str, dict[str, str]],
+    inventory_rows: dict[str, list[dict[str, Any]]],
+    clients_file_codes: list[str] | None,
+    unchanged_client_codes: set[str] | None,
+    rules_version: int,
+    clients_file_name: str,
+    inventory_file_name: str,
+    clients_sha256: str,
+    inventory_sha256: str,
+    profiler: ImportProfiler,
+    commit_rows: int,
+    commit_progress: ImportCommitProgress | None,
+) -> tuple[PickupCatalogUploadBatch, dict[str, Any]]:
+    batch, replaced_items = _new_snapshot_batch(
+        db,
+        clients_file_name=clients_file_name,
+        inventory_file_name=inventory_file_name,
+        clients_sha256=clients_sha256,
+        inventory_sha256=inventory_sha256,
+    )
+    # Clientes não têm lote: os novos entram já, os existentes só na ativação.
+    staged_clients = _StagedClients(unchanged_client_codes)
+    try:
+        with profiler.stage("stage_clients", len(merged_clients)) as record:
+            staged_clients.stage(db, merged_clients)
+            record["rows_out"] = len(staged_clients.created_ids)
+        db.commit()
+
+        with profiler.stage("inventory.insert", sum(len(items) for items in inventory_rows.values())) as record:
+            inserted_items = _insert_inventory_snapshot(
+                db,
+                batch.id,
+                inventory_rows,
+                staged_clients.ids,
+                rules_version,
+                commit_rows=commit_rows,
+                commit_progress=commit_progress,
+            )
+            record["rows_out"] = inserted_items
+        inventory_diff = {
+            "mode": "snapshot",
+            "inserted": inserted_items,
+            "updated": 0,
+            "deleted": replaced_items,
+            "unchanged": 0,
+        }
+        _activate_snapshot_batch(
+            db,
+            batch,
+            staged_clients=staged_clients,
+            clients_file_codes=clients_file_codes,
+            inventory_clients=len(inventory_rows),
+            inventory_diff=inventory_diff,
+            profiler=profiler,
+        )
+    except BaseException:
+        db.rollback()
+        _discard_batch(db, batch.id)
+        staged_clients.discard(db)
+        raise
+    return batch, inventory_diff
+
+
+def _normalize_inventory_batch(
+    batch: tuple[int, list[list[str]]],
+    layout: dict[str, Any],
+    rules_version: int,
+    classify: Callable[[str], str],
+) -> tuple[int, dict[str, dict[str, Any]], list[tuple[str, dict[str, Any]]]]:
+    # Etapa de classificação do pipeline: devolve as linhas lidas no bloco, o
+    # primeiro item de cada código (com o snapshot do cliente) e os itens já no
+    # formato da tabela.
+    parsed = parse_inventory_batch(batch, layout, classify)
+    first_items = {code: items[0] for code, items in parsed.items()}
+    rows = [(code, _inventory_item_values(item, rules_version)) for code, items in parsed.items() for item in items]
+    return len(batch[1]), first_items, rows
+
+
+def _stream_snapshot_batch(
+    db: Session,
+    *,
+    clients_rows: dict[str, dict[str, str]],
+    clients_file_codes: list[str] | None,
+    unchanged_client_codes: set[str] | None,
+    inventory_source: CsvSource,
+    rules_version: int,
+    clients_file_name: str,
+    inventory_file_name: str,
+    clients_sha256: str,
+    inventory_sha256: str,
+    profiler: ImportProfiler,
+    commit_rows: int,
+    commit_progress: ImportCommitProgress | None,
+    rows_progress: Callable[[int], None],
+) -> tuple[PickupCatalogUploadBatch, dict[str, Any]]:
+    # Snapshot em pipeline: leitura, classificação e gravação do 02.02.20 em
+    # blocos, ao mesmo tempo, sem montar o dicionário do arquivo inteiro. Cada
+    # cliente é preparado no primeiro bloco em que aparece, completado pelo
+    # snapshot da linha como no merge; os que só constam no 01.20.11 entram no
+    # fim. Clientes existentes só são atualizados na ativação (_StagedClients).
+    commit_rows = max(1, int(commit_rows))
+    with open_inventory_row_batches(inventory_source, PICKUP_CATALOG_PIPELINE_CHUNK_ROWS, profiler) as (
+        row_batches,
+        layout,
+    ):
+        batch, replaced_items = _new_snapshot_batch(
+            db,
+            clients_file_name=clients_file_name,
+            inventory_file_name=inventory_file_name,
+            clients_sha256=clients_sha256,
+            inventory_sha256=inventory_sha256,
+        )
+        db.commit()
+
+        staged_clients = _StagedClients(unchanged_client_codes)
+        try:
+            client_ids = staged_clients.ids
+            read_rows = 0
+            read_items = 0
+            written_items = 0
+            uncommitted_items = 0
+            classify = profiler.timed("inventory.classify_item_type", classify_item_type)
+
+            def normalize(row_batch: tuple[int, list[list[str]]]) -> Any:
+                return _normalize_inventory_batch(row_batch, layout, rules_version, classify)
+
+            with profiler.stage("inventory.pipeline") as record, run_pipeline(
+                ("inventory.parse", row_batches),
+                [("inventory.classify", normalize)],
+                queue_chunks=PICKUP_CATALOG_PIPELINE_QUEUE_CHUNKS,
+                consumer_name="inventory.write",
+                profiler=profiler,
+                part_of="inventory.pipeline",
+            ) as chunks:
+                for chunk_rows, first_items, rows in chunks:
+                    new_codes = {code: [item] for code, item in first_items.items() if code not in client_ids}
+                    if new_codes:
+                        merged = prepare_merged_clients(
+                            {code: clients_rows[code] for code in new_codes if code in clients_rows},
+                            new_codes,
+                        )
+                        staged_clients.stage(db, merged)
+                    # Cada bloco é gravado assim que chega: a espera pelo banco fica
+                    # intercalada com a leitura dos blocos seguintes, em vez de
+                    # acumular commit_rows itens enquanto a fila (limitada) enche.
+                    # Os commits continuam a cada commit_rows itens.
+                    values = [{"client_id": client_ids[code], "batch_id": batch.id, **item} for code, item in rows]
+                    read_rows += chunk_rows
+                    read_items += len(values)
+                    start = 0
+                    while start < len(values):
+                        take = min(len(values) - start, commit_rows - uncommitted_items)
+                        insert_inventory_items(db, values[start:start + take])
+                        start += take
+                        uncommitted_items += take
+                        if uncommitted_items >= commit_rows:
+                            db.commit()
+                            written_items += uncommitted_items
+                            uncommitted_items = 0
+                            if commit_progress is not None:
+                                commit_progress(written_items, read_items)
+                            rows_progress(read_items)
+                if uncommitted_items:
+                    db.commit()
+                    written_items += uncommitted_items
+                    if commit_progress is not None:
+                        commit_progress(written_items, read_items)
+                record["rows_in"] = read_rows
+                record["rows_out"] = written_items
+            profiler.add_timed(classify, part_of="inventory.classify")
+
+            inventory_clients = len(client_ids)
+            remaining_clients = {code: payload for code, payload in clients_rows.items() if code not in client_ids}
+            with profiler.stage("stage_clients", len(remaining_clients)) as record:
+                if remaining_clients:
+                    staged_clients.stage(db, prepare_merged_clients(remaining_clients, {}))
+                    db.commit()
+                record["rows_out"] = len(staged_clients.created_ids)
+            inventory_diff = {
+                "mode": "snapshot",
+                "inserted": written_items,
+                "updated": 0,
+                "deleted": replaced_items,
+                "unchanged": 0,
+            }
+            _activate_snapshot_batch(
+                db,
+                batch,
+                staged_clients=staged_clients,
+                clients_file_codes=clients_file_codes,
+                inventory_clients=inventory_clients,
+                inventory_diff=inventory_diff,
+                profiler=profiler,
+            )
+        except BaseException:
+            db.rollback()
+            _discard_batch(db, batch.id)
+            staged_clients.discard(db)
+            raise
+    return batch, inventory_diff
+
+
+def _current_batch(db: Session) -> PickupCatalogUploadBatch | None:
+    batch_id = active_batch_id(db)
+    return db.get(PickupCatalogUploadBatch, batch_id) if batch_id is not None else None
+
+
+def _batch_stats(batch: PickupCatalogUploadBatch | None) -> dict[str, int]:
+    return {
+        "clients_count": int(getattr(batch, "clients_count", 0) or 0),
+        "inventory_clients": int(getattr(batch, "inventory_clients", 0) or 0),
+        "open_items": int(getattr(batch, "open_items", 0) or 0),
+    }
+
+
+def _unchanged_inventory_diff(batch: PickupCatalogUploadBatch | None) -> dict[str, Any]:
+    return {
+        "mode": "unchanged",
+        "inserted": 0,
+        "updated": 0,
+        "deleted": 0,
+        "unchanged": int(getattr(batch, "open_items", 0) or 0),
+    }
+
+
+def _inventory_row_label(item: dict[str, Any]) -> str:
+    # O id do parse traz o número do registro no arquivo (inv_<n>).
+    return f"Registro {_safe_text(item.get('id')).removeprefix('inv_')} do 02.02.20"
+
+
+def _dry_run_problems(
+    inventory_rows: dict[str, list[dict[str, Any]]],
+    clients_file_codes: set[str] | None,
+) -> Iterator[str]:
+    first_row_by_rg: dict[str, str] = {}
+    for code, items in inventory_rows.items():
+        if clients_file_codes is not None and code not in clients_file_codes:
+            yield f"Cliente {code} do 02.02.20 não consta no 01.20.11."
+        for item in items:
+            label = _inventory_row_label(item)
+            if _safe_text(item.get("item_type")) in ("", "outro"):
+                yield f"{label}: item não classificado ({_safe_text(item.get('description'))})."
+            rg = _safe_text(item.get("rg")).upper().replace(" ", "")
+            if not rg:
+                continue
+            first_label = first_row_by_rg.setdefault(rg, label)
+            if first_label != label:
+                yield f"{label}: RG {_safe_text(item.get('rg'))} repetido ({first_label})."
+
+
+def _capped_problems(problems: Iterator[str], limit: int = DRY_RUN_MAX_PROBLEMS) -> tuple[list[str], int]:
+    # Guarda só os primeiros; o restante do gerador é apenas contado.
+    kept = list(itertools.islice(problems, limit))
+    return kept, len(kept) + sum(1 for _ in problems)
+
+
+def import_pickup_catalog(
+    db: Session,
+    *,
+    clients_source: CsvSource | None = None,
+    inventory_source: CsvSource | None = None,
+    clients_file_name: str = "",
+    inventory_file_name: str = "",
+    incremental: bool = False,
+    clients_sha256: str = "",
+    inventory_sha256: str = "",
+    progress: ImportProgress | None = None,
+    trace_memory: bool | None = None,
+    dry_run: bool = False,
+    commit_rows: int = SNAPSHOT_COMMIT_ROWS,
+    commit_progress: ImportCommitProgress | None = None,
+) -> dict[str, Any]:
+    profiler = ImportProfiler(
+        trace_memory=PICKUP_CATALOG_IMPORT_TRACE_MEMORY if trace_memory is None else trace_memory,
+    )
+    try:
+        return _run_import(
+            db,
+            profiler=profiler,
+            clients_source=clients_source,
+            inventory_source=inventory_source,
+            clients_file_name=clients_file_name,
+            inventory_file_name=inventory_file_name,
+            incremental=incremental,
+            clients_sha256=clients_sha256,
+            inventory_sha256=inventory_sha256,
+            progress=progress,
+            dry_run=dry_run,
+            commit_rows=commit_rows,
+            commit_progress=commit_progress,
+        )
+    finally:
+        profiler.close()
+
+
+def _run_import(
+    db: Session,
+    *,
+    profiler: ImportProfiler,
+    clients_source: CsvSource | None,
+    inventory_source: CsvSource | None,
+    clients_file_name: str,
+    inventory_file_name: str,
+    incremental: bool,
+    clients_sha256: str,
+    inventory_sha256: str,
+    progress: ImportProgress | None,
+    dry_run: bool,
+    commit_rows: int,
+    commit_progress: ImportCommitProgress | None,
+) -> dict[str, Any]:
+    def report(stage: str, rows: int) -> None:
+        if progress is not None:
+            progress(stage, rows)
+
+    has_clients_upload = clients_source is not None
+    has_inventory_upload = inventory_source is not None
+    if not has_clients_upload and not has_inventory_upload:
+        raise ValueError("Envie ao menos um arquivo CSV (01.20.11 ou 02.02.20).")
+
+    # Arquivo idêntico ao que gerou o lote ativo não é reprocessado. O hash vem
+    # do spool do upload; sem ele, é calculado aqui lendo o arquivo em blocos.
+    with profiler.stage("hash_check", int(has_clients_upload) + int(has_inventory_upload)):
+        current_batch = _current_batch(db)
+        clients_sha256 = (_safe_text(clients_sha256) or csv_sha256(clients_source)) if has_clients_upload else ""
+        inventory_sha256 = (
+            (_safe_text(inventory_sha256) or csv_sha256(inventory_source)) if has_inventory_upload else ""
+        )
+    clients_unchanged = bool(
+        has_clients_upload and current_batch is not None and clients_sha256 == _safe_text(current_batch.clients_sha256)
+    )
+    inventory_unchanged = bool(
+        has_inventory_upload
+        and current_batch is not None
+        and inventory_sha256 == _safe_text(current_batch.inventory_sha256)
+    )
+    # 01.20.11 idêntico com 02.02.20 novo: o arquivo não é relido; os clientes
+    # mantidos são os marcados pelo último 01.20.11 processado mais os do
+    # 02.02.20. Sem nenhum marcado (lote anterior à coluna), o arquivo é relido.
+    unchanged_client_codes: set[str] | None = None
+    if clients_unchanged and not dry_run and has_inventory_upload and not inventory_unchanged:
+        with profiler.stage("clients.load_file_codes") as record:
+            unchanged_client_codes = load_clients_file_codes(db)
+            record["rows_out"] = len(unchanged_client_codes)
+        if not unchanged_client_codes:
+            clients_unchanged = False
+            unchanged_client_codes = None
+    # A validação lê os arquivos enviados mesmo quando idênticos à base ativa.
+    process_clients = has_clients_upload and (dry_run or not clients_unchanged)
+    process_inventory = has_inventory_upload and (dry_run or not inventory_unchanged)
+    unchanged_sources = {
+        "clients_012011": clients_unchanged,
+        "inventory_020220": inventory_unchanged,
+    }
+
+    if not process_clients and not process_inventory:
+        report(IMPORT_STAGE_DONE, 0)
+        return {
+            "message": "Arquivos idênticos aos da base ativa. Nada foi reprocessado.",
+            "updated_sources": {
+                "clients_012011": False,
+                "inventory_020220": False,
+            },
+            "unchanged_sources": unchanged_sources,
+            "stats": _batch_stats(current_batch),
+            "inventory_diff": _unchanged_inventory_diff(current_batch),
+            "profile": profiler.summary(),
+        }
+
+    report(IMPORT_STAGE_CLIENTS, 0)
+    if process_clients:
+        clients_rows = load_clients_csv(clients_source, profiler=profiler)
+    elif unchanged_client_codes is not None:
+        clients_rows = {}
+    else:
+        with profiler.stage("clients.load_existing") as record:
+            clients_rows = load_existing_clients_rows(db)
+            record["rows_out"] = len(clients_rows)
+    # Só contam as linhas lidas dos arquivos processados.
+    rows_read = len(clients_rows) if process_clients else 0
+    # Códigos a marcar como do 01.20.11 (o merge completa clients_rows no lugar).
+    clients_file_codes = sorted(clients_rows) if process_clients else None
+    report(IMPORT_STAGE_INVENTORY, rows_read)
+    rules_version = item_type_rules_version()
+    batched = current_batch is not None and uses_batched_inventory(db)
+    if PICKUP_CATALOG_IMPORT_PIPELINE and process_inventory and not dry_run and not (batched and incremental):
+        # Lote novo com o 02.02.20 enviado: lê e grava ao mesmo tempo (pipeline).
+        rows_before_inventory = rows_read
+        batch, inventory_diff = _stream_snapshot_batch(
+            db,
+            clients_rows=clients_rows,
+            clients_file_codes=clients_file_codes,
+            unchanged_client_codes=unchanged_client_codes,
+            inventory_source=inventory_source,
+            rules_version=rules_version,
+            clients_file_name=_safe_text(clients_file_name) if process_clients else "",
+            inventory_file_name=_safe_text(inventory_file_name),
+            clients_sha256=(
+                clients_sha256 if process_clients else _safe_text(getattr(current_batch, "clients_sha256", ""))
+            ),
+            inventory_sha256=inventory_sha256,
+            profiler=profiler,
+            commit_rows=commit_rows,
+            commit_progress=commit_progress,
+            rows_progress=lambda items: report(IMPORT_STAGE_WRITING, rows_before_inventory + items),
+        )
+        rows_read += inventory_diff["inserted"]
+    else:
+        if process_inventory:
+            inventory_rows = load_inventory_csv(inventory_source, profiler=profiler)
+        else:
+            with profiler.stage("inventory.load_existing") as record:
+                inventory_rows = load_existing_inventory_rows(db)
+                record["rows_out"] = sum(len(items) for items in inventory_rows.values())
+        if process_inventory:
+            rows_read += sum(len(items) for items in inventory_rows.values())
+        report(IMPORT_STAGE_WRITING, rows_read)
+        with profiler.stage("merge_clients", len(clients_rows) + len(inventory_rows)) as record:
+            merged_clients = prepare_merged_clients(clients_rows, inventory_rows)
+            record["rows_out"] = len(merged_clients)
+
+        if dry_run:
+            result = _dry_run_result(
+                db,
+                profiler=profiler,
+                current_batch=current_batch,
+                batched=batched,
+                merged_clients=merged_clients,
+                inventory_rows=inventory_rows,
+                clients_file_codes=(
+                    set(clients_file_codes) if clients_file_codes is not None and process_inventory else None
+                ),
+                process_clients=process_clients,
+                process_inventory=process_inventory,
+                unchanged_sources=unchanged_sources,
+                rules_version=rules_version,
+            )
+            report(IMPORT_STAGE_DONE, rows_read)
+            return result
+        if batched and (not process_inventory or incremental):
+            # No lugar, sobre o lote ativo: só clientes (itens do 02.02.20 iguais aos
+            # gravados) ou modo incremental, que aplica só a diferença dos itens.
+            # O merge já inclui os códigos presentes só no 02.02.20.
+            unchanged_codes = unchanged_client_codes or set()
+            kept_codes = sorted(merged_clients.keys() | unchanged_codes)
+            with profiler.stage("upsert_clients", len(merged_clients)) as record:
+                client_ids = upsert_clients(
+                    db,
+                    {code: payload for code, payload in merged_clients.items() if code not in unchanged_codes},
+                )
+                client_ids.update(client_ids_by_code(db, [code for code in merged_clients if code in unchanged_codes]))
+                if clients_file_codes is not None:
+                    _mark_clients_file_codes(db, clients_file_codes)
+                record["rows_out"] = len(client_ids)
+            batch = current_batch
+            if process_clients:
+                batch.clients_file_name = _safe_text(clients_file_name)
+                batch.clients_sha256 = clients_sha256
+            if process_inventory:
+                batch.inventory_file_name = _safe_text(inventory_file_name)
+                batch.inventory_sha256 = inventory_sha256
+                with profiler.stage("inventory.apply_diff", rows_read) as record:
+                    inventory_diff = _apply_inventory_diff(db, batch.id, inventory_rows, client_ids, rules_version)
+                    record["rows_out"] = (
+                        inventory_diff["inserted"] + inventory_diff["updated"] + inventory_diff["deleted"]
+                    )
+            else:
+                inventory_diff = _unchanged_inventory_diff(batch)
+            batch.uploaded_at = func.now()
+            with profiler.stage("purge_stale_clients", len(kept_codes)):
+                _purge_stale_clients(db, kept_codes)
+                _apply_batch_stats(batch, len(kept_codes), len(inventory_rows), inventory_diff)
+                db.commit()
+        else:
+            # Sem lote ativo (primeira carga ou base legada sem lotes) o modo
+            # incremental também vira snapshot. Fontes não reprocessadas herdam o
+            # hash do lote ativo, de onde vieram os dados.
+            batch, inventory_diff = _write_snapshot_batch(
+                db,
+                merged_clients=merged_clients,
+                inventory_rows=inventory_rows,
+                clients_file_codes=clients_file_codes,
+                unchanged_client_codes=unchanged_client_codes,
+                rules_version=rules_version,
+                clients_file_name=_safe_text(clients_file_name) if process_clients else "",
+                inventory_file_name=_safe_text(inventory_file_name) if process_inventory else "",
+                clients_sha256=(
+                    clients_sha256 if process_clients else _safe_text(getattr(current_batch, "clients_sha256", ""))
+                ),
+                inventory_sha256=(
+                    inventory_sha256
+                    if process_inventory
+                    else _safe_text(getattr(current_batch, "inventory_sha256", ""))
+                ),
+                profiler=profiler,
+                commit_rows=commit_rows,
+                commit_progress=commit_progress,
+            )
+
+    # Histórico de desempenho: o resumo fica gravado no lote.
+    profile = profiler.summary()
+    batch.import_profile = json.dumps(profile, ensure_ascii=False)
+    db.commit()
+    bump_inventory_revision()
+    report(IMPORT_STAGE_DONE, rows_read)
+
+    if process_clients and process_inventory:
+        message = "Dados gravados com sucesso. Base anterior substituída."
+    elif process_clients:
+        message = "Dados gravados com sucesso. Atualização parcial aplicada (01.20.11)."
+    else:
+        message = "Dados gravados com sucesso. Atualização parcial aplicada (02.02.20)."
+    if clients_unchanged or inventory_unchanged:
+        message += " Arquivo idêntico ao da base ativa ignorado."
+
+    return {
+        "message": message,
+        "updated_sources": {
+            "clients_012011": process_clients,
+            "inventory_020220": process_inventory,
+        },
+        "unchanged_sources": unchanged_sources,
+        "stats": _batch_stats(batch),
+        "inventory_diff": inventory_diff,
+        "profile": profile,
+    }
+
+
+def _dry_run_result(
+    db: Session,
+    *,
+    profiler: ImportProfiler,
+    current_batch: PickupCatalogUploadBatch | None,
+    batched: bool,
+    merged_clients: dict[str, dict[str, str]],
+    inventory_rows: dict[str, list[dict[str, Any]]],
+    clients_file_codes: set[str] | None,
+    process_clients: bool,
+    process_inventory: bool,
+    unchanged_sources: dict[str, bool],
+    rules_version: int,
+) -> dict[str, Any]:
+    # Só leituras: a diferença é calculada contra o lote ativo e nada é gravado.
+    with profiler.stage("dry_run.diff", sum(len(items) for items in inventory_rows.values())) as record:
+        if not process_inventory:
+            inventory_diff = _unchanged_inventory_diff(current_batch)
+        elif batched:
+            inventory_diff = _diff_counts(
+                _diff_inventory(db, current_batch.id, inventory_rows, rules_version),
+                "dry_run",
+            )
+        else:
+            inventory_diff = {
+                "mode": "dry_run",
+                "inserted": sum(len(items) for items in inventory_rows.values()),
+                "updated": 0,
+                "deleted": _count_batch_items(db, active_batch_id(db)),
+                "unchanged": 0,
+            }
+        record["rows_out"] = inventory_diff["inserted"] + inventory_diff["updated"] + inventory_diff["deleted"]
+
+    with profiler.stage("dry_run.problems") as record:
+        if process_inventory:
+            problems, problems_total = _capped_problems(_dry_run_problems(inventory_rows, clients_file_codes))
+        else:
+            problems, problems_total = [], 0
+        record["rows_out"] = problems_total
+
+    message = "Validação concluída. Nada foi gravado."
+    if unchanged_sources["clients_012011"] or unchanged_sources["inventory_020220"]:
+        message += " Há arquivo idêntico ao da base ativa."
+    return {
+        "dry_run": True,
+        "message": message,
+        "updated_sources": {
+            "clients_012011": process_clients,
+            "inventory_020220": process_inventory,
+        },
+        "unchanged_sources": unchanged_sources,
+        "stats": {
+            "clients_count": len(merged_clients),
+            "inventory_clients": len(inventory_rows),
+            "open_items": inventory_diff["inserted"] + inventory_diff["updated"] + inventory_diff["unchanged"],
+        },
+        "inventory_diff": inventory_diff,
+        "problems": problems,
+        "problems_total": problems_total,
+        "profile": profiler.summary(),
+    }
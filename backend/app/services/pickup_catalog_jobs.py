@@ -0,0 +1,388 @@
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Iterator
+
+from sqlalchemy import func, or_, update
+from sqlalchemy.orm import Session
+
+from app.core.config import PICKUP_CATALOG_IMPORT_JOB_HEARTBEAT_SECONDS, PICKUP_CATALOG_IMPORT_JOB_STALE_SECONDS
+from app.database.session import SessionLocal
+from app.models.pickup_catalog import PickupCatalogImportJob
+from app.services.equipment_allocation_state import rebuild_allocation_state
+from app.services.pickup_catalog_import import (
+    IMPORT_STAGE_DONE,
+    import_pickup_catalog,
+    reclaim_inactive_batches,
+)
+
+
+logger = logging.getLogger("uvicorn.error")
+
+JOB_STATUS_QUEUED = "na_fila"
+JOB_STATUS_RUNNING = "processando"
+JOB_STATUS_DONE = "concluida"
+JOB_STATUS_FAILED = "falhou"
+JOB_FINAL_STATUSES = {JOB_STATUS_DONE, JOB_STATUS_FAILED}
+JOB_STAGE_RECLAIM = "removendo_lotes_antigos"
+
+# A fila é a própria tabela: jobs "na_fila" esperam a vez e sobrevivem a um
+# reinício. Um único worker por processo pega o mais antigo (por id) e roda um
+# de cada vez; a troca de status na_fila -> processando é condicional, então
+# dois processos nunca pegam o mesmo job.
+_worker_lock = threading.Lock()
+_worker_thread: threading.Thread | None = None
+
+# Andamento do job em execução: a importação informa etapa e linhas aqui e o
+# heartbeat (thread e sessão próprias, fora da transação da importação) grava
+# na linha do job a cada PICKUP_CATALOG_IMPORT_JOB_HEARTBEAT_SECONDS. Leituras,
+# em qualquer processo, vêm do banco.
+_progress_lock = threading.Lock()
+_live_progress: dict[int, dict[str, Any]] = {}
+
+
+def _safe_text(value: Any) -> str:
+    return str(value or "").strip()
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _spool_path_text(path: Path | None) -> str:
+    return str(path) if path is not None else ""
+
+
+def _unlink_job_files(job: PickupCatalogImportJob) -> None:
+    for raw_path in (job.clients_spool_path, job.inventory_spool_path):
+        if _safe_text(raw_path):
+            Path(raw_path).unlink(missing_ok=True)
+
+
+def submit_import_job(
+    db: Session,
+    *,
+    clients_path: Path | None,
+    inventory_path: Path | None,
+    clients_file_name: str = "",
+    inventory_file_name: str = "",
+    incremental: bool = False,
+    dry_run: bool = False,
+    clients_sha256: str = "",
+    inventory_sha256: str = "",
+    requested_by: str = "",
+) -> PickupCatalogImportJob:
+    # Os arquivos passam a pertencer ao job e são removidos quando ele termina.
+    job = PickupCatalogImportJob(
+        status=JOB_STATUS_QUEUED,
+        stage="",
+        rows_processed=0,
+        incremental=bool(incremental),
+        dry_run=bool(dry_run),
+        clients_file_name=_safe_text(clients_file_name) if clients_path else "",
+        inventory_file_name=_safe_text(inventory_file_name) if inventory_path else "",
+        clients_spool_path=_spool_path_text(clients_path),
+        inventory_spool_path=_spool_path_text(inventory_path),
+        clients_sha256=_safe_text(clients_sha256) if clients_path else "",
+        inventory_sha256=_safe_text(inventory_sha256) if inventory_path else "",
+        requested_by=_safe_text(requested_by),
+        error="",
+        result="",
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+
+    _ensure_worker()
+    return job
+
+
+def resume_queued_import_jobs() -> None:
+    # Bootstrap: retoma os jobs que ficaram na fila antes do reinício.
+    _ensure_worker()
+
+
+def _ensure_worker() -> None:
+    global _worker_thread
+    with _worker_lock:
+        if _worker_thread is not None and _worker_thread.is_alive():
+            return
+        _worker_thread = threading.Thread(
+            target=_worker_loop,
+            daemon=True,
+            name="pickup-catalog-import",
+        )
+        _worker_thread.start()
+
+
+def _worker_loop() -> None:
+    global _worker_thread
+    while True:
+        # A busca acontece com a trava: um envio confirmado antes dela é visto
+        # aqui, e um envio depois dela encontra o worker já encerrado e sobe outro.
+        with _worker_lock:
+            try:
+                job_id = claim_next_import_job()
+            except Exception:  # pragma: no cover - o worker não pode morrer
+                logger.exception("Falha ao buscar a próxima importação da base de retiradas")
+                job_id = None
+            if job_id is None:
+                _worker_thread = None
+                return
+        try:
+            run_import_job(job_id)
+        except Exception:  # pragma: no cover - o worker não pode morrer
+            logger.exception("Falha ao executar importação da base de retiradas (job %s)", job_id)
+
+
+def claim_next_import_job() -> int | None:
+    db = SessionLocal()
+    try:
+        fail_interrupted_import_jobs(db)
+        table = PickupCatalogImportJob.__table__
+        while True:
+            job_id = (
+                db.query(PickupCatalogImportJob.id)
+                .filter(PickupCatalogImportJob.status == JOB_STATUS_QUEUED)
+                .order_by(PickupCatalogImportJob.id.asc())
+                .limit(1)
+                .scalar()
+            )
+            if job_id is None:
+                return None
+            claimed_at = _now()
+            claimed = db.execute(
+                update(table)
+                .where(table.c.id == job_id, table.c.status == JOB_STATUS_QUEUED)
+                .values(status=JOB_STATUS_RUNNING, started_at=claimed_at, heartbeat_at=claimed_at)
+            )
+            db.commit()
+            if claimed.rowcount == 1:
+                return int(job_id)
+            # Outro processo pegou o mesmo job entre a busca e a troca: tenta o próximo.
+    finally:
+        db.close()
+
+
+def _set_live_progress(job_id: int, stage: str, rows: int) -> None:
+    with _progress_lock:
+        _live_progress[job_id] = {"stage": stage, "rows_processed": int(rows)}
+
+
+def live_progress(job_id: int) -> dict[str, Any] | None:
+    with _progress_lock:
+        current = _live_progress.get(job_id)
+        return dict(current) if current else None
+
+
+def write_job_heartbeat(job_id: int) -> None:
+    # Uma falha (ex.: SQLite travado pela importação) só adia a gravação.
+    progress = live_progress(job_id) or {}
+    values: dict[str, Any] = {"heartbeat_at": _now()}
+    if progress:
+        values["stage"] = progress["stage"]
+        values["rows_processed"] = progress["rows_processed"]
+    table = PickupCatalogImportJob.__table__
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(table).where(table.c.id == job_id, table.c.status == JOB_STATUS_RUNNING).values(**values)
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        logger.warning("Falha ao gravar o andamento da importação (job %s)", job_id, exc_info=True)
+    finally:
+        db.close()
+
+
+@contextmanager
+def _job_heartbeat(job_id: int) -> Iterator[None]:
+    stop = threading.Event()
+
+    def beat() -> None:
+        while not stop.wait(PICKUP_CATALOG_IMPORT_JOB_HEARTBEAT_SECONDS):
+            write_job_heartbeat(job_id)
+
+    thread = threading.Thread(target=beat, daemon=True, name=f"pickup-catalog-import-heartbeat-{job_id}")
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_import_job(job_id: int) -> None:
+    db = SessionLocal()
+    job: PickupCatalogImportJob | None = None
+    try:
+        # O job já foi marcado como "processando" por claim_next_import_job.
+        job = db.get(PickupCatalogImportJob, job_id)
+        if job is None or job.status != JOB_STATUS_RUNNING:
+            return
+
+        clients_path = Path(job.clients_spool_path) if _safe_text(job.clients_spool_path) else None
+        inventory_path = Path(job.inventory_spool_path) if _safe_text(job.inventory_spool_path) else None
+        if any(path is not None and not path.exists() for path in (clients_path, inventory_path)):
+            _finish_job(db, job, status=JOB_STATUS_FAILED, error="Arquivo da importação não encontrado; envie novamente.")
+            return
+        with _job_heartbeat(job_id):
+            try:
+                result = import_pickup_catalog(
+                    db,
+                    clients_source=clients_path,
+                    inventory_source=inventory_path,
+                    clients_file_name=job.clients_file_name,
+                    inventory_file_name=job.inventory_file_name,
+                    incremental=bool(job.incremental),
+                    clients_sha256=_safe_text(job.clients_sha256),
+                    inventory_sha256=_safe_text(job.inventory_sha256),
+                    dry_run=bool(job.dry_run),
+                    progress=lambda stage, rows: _set_live_progress(job_id, stage, rows),
+                )
+            except ValueError as exc:
+                db.rollback()
+                _finish_job(db, job, status=JOB_STATUS_FAILED, error=str(exc))
+            except Exception:
+                db.rollback()
+                logger.exception("Falha inesperada na importação da base de retiradas (job %s)", job_id)
+                _finish_job(db, job, status=JOB_STATUS_FAILED, error="Falha inesperada na importação.")
+            else:
+                # Validação não grava lote novo; não há o que limpar.
+                if not job.dry_run:
+                    _refresh_allocation_after_import(db, job_id)
+                    _reclaim_after_import(db, job_id)
+                _finish_job(db, job, status=JOB_STATUS_DONE, result=result)
+    finally:
+        if job is not None:
+            _unlink_job_files(job)
+        with _progress_lock:
+            _live_progress.pop(job_id, None)
+        db.close()
+
+
+def _refresh_allocation_after_import(db: Session, job_id: int) -> None:
+    # A importação já foi confirmada; uma falha aqui não desfaz o lote, e a
+    # tabela é refeita na próxima escrita ou no bootstrap.
+    try:
+        rebuild_allocation_state(db)
+    except Exception:
+        db.rollback()
+        logger.exception("Falha ao recalcular alocação de refrigeradores (job %s)", job_id)
+
+
+def _reclaim_after_import(db: Session, job_id: int) -> None:
+    # Com o novo lote já ativo, a limpeza não afeta as leituras.
+    progress = live_progress(job_id) or {}
+    rows = int(progress.get("rows_processed", 0) or 0)
+    _set_live_progress(job_id, JOB_STAGE_RECLAIM, rows)
+    try:
+        reclaim_inactive_batches(db)
+    except Exception:
+        db.rollback()
+        logger.exception("Falha ao remover lotes antigos da base de retiradas (job %s)", job_id)
+    _set_live_progress(job_id, IMPORT_STAGE_DONE, rows)
+
+
+def _finish_job(
+    db: Session,
+    job: PickupCatalogImportJob,
+    *,
+    status: str,
+    error: str = "",
+    result: dict[str, Any] | None = None,
+) -> None:
+    progress = live_progress(int(job.id)) or {}
+    job.status = status
+    job.stage = _safe_text(progress.get("stage")) or job.stage
+    job.rows_processed = int(progress.get("rows_processed", job.rows_processed) or 0)
+    job.error = error
+    job.result = json.dumps(result, ensure_ascii=False) if result is not None else ""
+    job.finished_at = _now()
+    db.commit()
+
+
+def fail_interrupted_import_jobs(db: Session) -> int:
+    # Só jobs em execução são perdidos num reinício; os da fila continuam
+    # esperando e são retomados por resume_queued_import_jobs. Um job está
+    # interrompido quando o heartbeat (ou o início, antes do primeiro) parou há
+    # mais de PICKUP_CATALOG_IMPORT_JOB_STALE_SECONDS: jobs de outros workers
+    # seguem vivos. Chamado no bootstrap, a cada job pego e na consulta do job.
+    last_seen = func.coalesce(PickupCatalogImportJob.heartbeat_at, PickupCatalogImportJob.started_at)
+    stale_before = _now() - timedelta(seconds=PICKUP_CATALOG_IMPORT_JOB_STALE_SECONDS)
+    jobs = (
+        db.query(PickupCatalogImportJob)
+        .filter(
+            PickupCatalogImportJob.status == JOB_STATUS_RUNNING,
+            or_(last_seen.is_(None), last_seen < stale_before),
+        )
+        .all()
+    )
+    for job in jobs:
+        _unlink_job_files(job)
+        job.status = JOB_STATUS_FAILED
+        job.error = "Importação interrompida pelo reinício do servidor."
+        job.finished_at = _now()
+    if jobs:
+        db.commit()
+    return len(jobs)
+
+
+def import_job_payload(job: PickupCatalogImportJob) -> dict[str, Any]:
+    stage = _safe_text(job.stage)
+    rows_processed = int(job.rows_processed or 0)
+
+    rows_per_second = 0.0
+    if job.started_at is not None:
+        started_at = job.started_at if job.started_at.tzinfo else job.started_at.replace(tzinfo=timezone.utc)
+        finished_at = job.finished_at or _now()
+        if finished_at.tzinfo is None:
+            finished_at = finished_at.replace(tzinfo=timezone.utc)
+        elapsed = (finished_at - started_at).total_seconds()
+        if elapsed > 0:
+            rows_per_second = round(rows_processed / elapsed, 1)
+
+    result: dict[str, Any] | None = None
+    if _safe_text(job.result):
+        result = json.loads(job.result)
+
+    return {
+        "id": int(job.id),
+        "status": job.status,
+        "stage": stage,
+        "rows_processed": rows_processed,
+        "rows_per_second": rows_per_second,
+        "incremental": bool(job.incremental),
+        "dry_run": bool(job.dry_run),
+        "clients_file_name": _safe_text(job.clients_file_name),
+        "inventory_file_name": _safe_text(job.inventory_file_name),
+        "requested_by": _safe_text(job.requested_by),
+        "error": _safe_text(job.error),
+        "result": result,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def wait_for_import_job(job_id: int, timeout: float = 30.0) -> PickupCatalogImportJob | None:
+    # Usado por scripts e testes que precisam do resultado de forma síncrona.
+    deadline = time.monotonic() + timeout
+    while True:
+        db = SessionLocal()
+        try:
+            job = db.get(PickupCatalogImportJob, job_id)
+            if job is None or job.status in JOB_FINAL_STATUSES or time.monotonic() >= deadline:
+                if job is not None:
+                    db.expunge(job)
+                return job
+        finally:
+            db.close()
+        time.sleep(0.05)
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+
+from app.core.config import PICKUP_CATALOG_RECLASSIFY_BATCH_SIZE
+from app.models.pickup_catalog import PickupCatalogInventoryItem
+from app.services.allocation_token_cache import bump_inventory_revision
+from app.services.equipment_allocation_state import rebuild_allocation_state
+from app.services.material_bucket import resolve_material_bucket
+from app.services.pickup_catalog_csv import classify_item_type, item_type_rules_version
+
+
+def reclassify_stale_inventory_items(db: Session, *, batch_size: int | None = None) -> int:
+    # Reprocessa apenas linhas classificadas com uma versão de regras anterior à atual,
+    # em lotes por id (cada lote é confirmado separadamente).
+    current_version = item_type_rules_version()
+    limit = max(1, int(batch_size or PICKUP_CATALOG_RECLASSIFY_BATCH_SIZE))
+    table = PickupCatalogInventoryItem.__table__
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam("row_id"))
+        .values(
+            item_type=bindparam("new_item_type"),
+            material_bucket=bindparam("new_material_bucket"),
+            classifier_version=current_version,
+        )
+    )
+
+    processed = 0
+    last_id = 0
+    while True:
+        rows = (
+            db.query(
+                PickupCatalogInventoryItem.id,
+                PickupCatalogInventoryItem.description,
+            )
+            .filter(
+                PickupCatalogInventoryItem.classifier_version < current_version,
+                PickupCatalogInventoryItem.id > last_id,
+            )
+            .order_by(PickupCatalogInventoryItem.id.asc())
+            .limit(limit)
+            .all()
+        )
+        if not rows:
+            break
+
+        updates = []
+        for row in rows:
+            item_type = classify_item_type(row.description or "")
+            updates.append(
+                {
+                    "row_id": int(row.id),
+                    "new_item_type": item_type,
+                    "new_material_bucket": resolve_material_bucket(item_type, row.description),
+                }
+            )
+        db.execute(statement, updates)
+        db.commit()
+        processed += len(rows)
+        last_id = int(rows[-1].id)
+
+    if processed:
+        bump_inventory_revision()
+        rebuild_allocation_state(db)
+    return processed
+
+
+def backfill_material_buckets(db: Session, *, batch_size: int | None = None) -> int:
+    # Linhas gravadas antes da coluna material_bucket (NULL), em lotes por id;
+    # usa o item_type gravado, sem reclassificar a versão de regras.
+    limit = max(1, int(batch_size or PICKUP_CATALOG_RECLASSIFY_BATCH_SIZE))
+    table = PickupCatalogInventoryItem.__table__
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam("row_id"))
+        .values(material_bucket=bindparam("new_material_bucket"))
+    )
+
+    filled = 0
+    last_id = 0
+    while True:
+        rows = (
+            db.query(
+                PickupCatalogInventoryItem.id,
+                PickupCatalogInventoryItem.item_type,
+                PickupCatalogInventoryItem.description,
+            )
+            .filter(
+                PickupCatalogInventoryItem.material_bucket.is_(None),
+                PickupCatalogInventoryItem.id > last_id,
+            )
+            .order_by(PickupCatalogInventoryItem.id.asc())
+            .limit(limit)
+            .all()
+        )
+        if not rows:
+            break
+
+        db.execute(
+            statement,
+            [
+                {"row_id": int(row.id), "new_material_bucket": resolve_material_bucket(row.item_type, row.description)}
+                for row in rows
+            ],
+        )
+        db.commit()
+        filled += len(rows)
+        last_id = int(rows[-1].id)
+
+    if filled:
+        bump_inventory_revision()
+        rebuild_allocation_state(db)
+    return filled
@@ -1,12 +1,17 @@
+import asyncio
+import io
 import os
 import tempfile
 from pathlib import Path
 from uuid import uuid4
 
 import pytest
+from fastapi import UploadFile
+from starlette.datastructures import Headers
 
 TEST_DB_FILE = Path(tempfile.gettempdir()) / f"test_equipments_sync_integration_{uuid4().hex}.db"
-os.environ["DATABASE_URL"] = f"sqlite:///{TEST_DB_FILE.as_posix()}"
+# TEST_DATABASE_URL permite rodar a mesma suíte contra um PostgreSQL descartável.
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL") or f"sqlite:///{TEST_DB_FILE.as_posix()}"
 os.environ.setdefault("SECRET_KEY", "test-secret-key")
 os.environ.setdefault("ALGORITHM", "HS256")
 os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
@@ -15,6 +20,8 @@ os.environ.setdefault("DB_BOOTSTRAP_MODE", "off")
 from app.core.security import get_password_hash  # noqa: E402
 from app.database.base import Base  # noqa: E402
 from app.database.session import SessionLocal, engine  # noqa: E402
+from app.models.code_token import CodeToken  # noqa: E402
+from app.models.equipment import Equipment, EquipmentAllocationState  # noqa: E402
 from app.models.pickup_catalog import (  # noqa: E402
     PickupCatalogClient,
     PickupCatalogInventoryItem,
@@ -25,13 +32,28 @@ from app.models.user import User  # noqa: E402
 from app.routes.pickup_catalog import list_orders, update_order_status  # noqa: E402
 from app.routes.equipments import (  # noqa: E402
     create_equipment,
+    delete_equipment,
+    get_allocation_cache_stats,
+    import_refrigerators_csv,
     list_available_refrigerators_for_comodato,
     list_equipments,
+    list_inventory_materials,
     list_non_allocated_refrigerators,
+    lookup_allocated_material,
     sync_refrigerators_allocation_status,
+    update_equipment,
 )
-from app.schemas.equipment import EquipmentCreate  # noqa: E402
+from app.schemas.equipment import EquipmentCreate, EquipmentUpdate  # noqa: E402
 from app.schemas.pickup_catalog import PickupCatalogOrderStatusUpdateIn  # noqa: E402
+from app.services.allocation_token_cache import allocation_token_cache, bump_inventory_revision  # noqa: E402
+from app.services.code_tokens import (  # noqa: E402
+    backfill_code_keys,
+    delete_batch_inventory_tokens,
+    index_inventory_tokens,
+    index_order_item_tokens,
+)
+from app.services.equipment_allocation_state import rebuild_allocation_state  # noqa: E402
+from app.services.pickup_catalog_reclassify import backfill_material_buckets  # noqa: E402
 
 
 @pytest.fixture(autouse=True)
@@ -40,6 +62,8 @@ def reset_database():
     if TEST_DB_FILE.exists():
         TEST_DB_FILE.unlink()
     Base.metadata.create_all(bind=engine)
+    # O cache de tokens é do processo e sobreviveria ao banco recriado.
+    allocation_token_cache.clear()
     try:
         yield
     finally:
@@ -82,6 +106,8 @@ def seed_020220_allocation(db, tag_code: str, client_code: str = "1001") -> None
     db.add(client)
     db.flush()
 
+    # Sem material_bucket, como as linhas gravadas antes da coluna: a alocação
+    # não pode depender do backfill.
     db.add(
         PickupCatalogInventoryItem(
             client_id=client.id,
@@ -94,7 +120,11 @@ def seed_020220_allocation(db, tag_code: str, client_code: str = "1001") -> None
             invoice_issue_date="2026-02-22",
         )
     )
+    db.flush()
+    index_inventory_tokens(db, None)
     db.commit()
+    bump_inventory_revision()
+    rebuild_allocation_state(db)
 
 
 def equipment_by_id(items, equipment_id: int):
@@ -227,6 +257,8 @@ def test_concluded_withdrawal_returns_refrigerator_to_non_allocated_and_blocks_r
             comodato_number="CMD-RET-0001",
         )
     )
+    db_session.flush()
+    index_order_item_tokens(db_session, order.id)
     db_session.commit()
 
     update_order_status(
@@ -270,6 +302,203 @@ def test_concluded_withdrawal_returns_refrigerator_to_non_allocated_and_blocks_r
     assert equipment_id not in (sync_payload.updated_ids or [])
 
 
+def test_backfill_code_keys_and_concluded_withdrawal_matches_by_rg_key(db_session):
+    current_user = create_admin_user(db_session)
+    token_seed = uuid4().hex[:8].upper()
+
+    # Linha gravada antes das colunas rg_key/tag_key: chaves nulas até o backfill.
+    legacy = Equipment(
+        category="refrigerador",
+        model_name="VISA COOLER LEGADO",
+        brand="BRAHMA",
+        quantity=1,
+        voltage="220v",
+        rg_code=f"rg {token_seed} a",
+        tag_code=f"tag {token_seed}",
+        status="em_uso",
+        client_name="Cliente Antigo",
+    )
+    db_session.add(legacy)
+    db_session.commit()
+    assert legacy.rg_key is None
+    assert legacy.tag_key is None
+
+    assert backfill_code_keys(db_session) >= 1
+    db_session.refresh(legacy)
+    assert legacy.rg_key == f"RG{token_seed}A"
+    assert legacy.tag_key == f"TAG{token_seed}"
+    assert legacy.model_key == "visa cooler legado"
+    assert backfill_code_keys(db_session) == 0
+
+    order = PickupCatalogOrder(
+        order_number=f"KEY-{token_seed}",
+        client_code="3003",
+        nome_fantasia="Cliente Chave",
+        withdrawal_date="2026-03-12",
+        status="pendente",
+        summary_line="Refrigerador retornado",
+    )
+    db_session.add(order)
+    db_session.flush()
+    db_session.add(
+        PickupCatalogOrderItem(
+            order_id=order.id,
+            description="VISA COOLER LEGADO",
+            item_type="refrigerador",
+            quantity=1,
+            rg=f"RG{token_seed} A",
+            comodato_number="CMD-KEY-0001",
+        )
+    )
+    db_session.commit()
+
+    update_order_status(
+        order_id=int(order.id),
+        payload=PickupCatalogOrderStatusUpdateIn(
+            status="concluida",
+            status_note="Retirado",
+            refrigerator_condition="sucata",
+        ),
+        db=db_session,
+        current_user=current_user,
+    )
+
+    db_session.refresh(legacy)
+    assert legacy.status == "sucata"
+    assert legacy.client_name is None
+
+
+def test_rg_and_tag_matches_fall_back_to_codes_before_the_key_backfill(db_session):
+    current_user = create_admin_user(db_session)
+    token_seed = uuid4().hex[:8].upper()
+
+    # O backfill roda em background no bootstrap: até lá rg_key/tag_key ficam nulas.
+    legacy = Equipment(
+        category="refrigerador",
+        model_name="VISA COOLER LEGADO",
+        brand="BRAHMA",
+        quantity=1,
+        voltage="220v",
+        rg_code=f"RG {token_seed}",
+        tag_code=f"TAG {token_seed}",
+        status="em_uso",
+        client_name="Cliente Antigo",
+    )
+    db_session.add(legacy)
+    db_session.commit()
+    assert legacy.rg_key is None
+
+    by_tag = lookup_allocated_material(
+        rg_code=None, tag_code=f"tag{token_seed}", db=db_session, current_user=current_user
+    )
+    assert by_tag.rg_code == f"RG {token_seed}"
+    by_rg = lookup_allocated_material(
+        rg_code=f"RG{token_seed}", tag_code=None, db=db_session, current_user=current_user
+    )
+    assert by_rg.tag_code == f"TAG {token_seed}"
+
+    order = PickupCatalogOrder(
+        order_number=f"NOKEY-{token_seed}",
+        client_code="3003",
+        nome_fantasia="Cliente Chave",
+        withdrawal_date="2026-03-12",
+        status="pendente",
+        summary_line="Refrigerador retornado",
+    )
+    db_session.add(order)
+    db_session.flush()
+    db_session.add(
+        PickupCatalogOrderItem(
+            order_id=order.id,
+            description="VISA COOLER LEGADO",
+            item_type="refrigerador",
+            quantity=1,
+            rg=f"RG {token_seed}",
+            comodato_number="CMD-NOKEY-0001",
+        )
+    )
+    db_session.commit()
+
+    update_order_status(
+        order_id=int(order.id),
+        payload=PickupCatalogOrderStatusUpdateIn(
+            status="concluida",
+            status_note="Retirado",
+            refrigerator_condition="sucata",
+        ),
+        db=db_session,
+        current_user=current_user,
+    )
+
+    db_session.refresh(legacy)
+    assert legacy.status == "sucata"
+    assert legacy.client_name is None
+
+
+def test_inventory_materials_filter_group_and_type_by_material_bucket(db_session):
+    current_user = create_admin_user(db_session)
+    client = PickupCatalogClient(client_code="4004", nome_fantasia="Cliente Materiais", setor="001")
+    db_session.add(client)
+    db_session.flush()
+    # Linhas gravadas antes da coluna: item_type "outro" desatualizado cai na
+    # classificação da descrição; o backfill grava o tipo resolvido.
+    for description, item_type in (
+        ("VISA COOLER TESTE", "outro"),
+        ("CAIXA TERMICA 20L", "caixa_termica"),
+        ("CAIXA 600ML", "vasilhame_caixa"),
+        ("PECA AVULSA", "outro"),
+    ):
+        db_session.add(
+            PickupCatalogInventoryItem(
+                client_id=client.id,
+                batch_id=None,
+                description=description,
+                item_type=item_type,
+                open_quantity=1,
+                invoice_issue_date="2026-02-22",
+            )
+        )
+    db_session.commit()
+
+    def listed(group: str, item_type: str | None = None) -> list[tuple[str, str]]:
+        payload = list_inventory_materials(
+            group=group,
+            limit=50,
+            offset=0,
+            q=None,
+            year=None,
+            month=None,
+            item_type_filter=item_type,
+            sort="newest",
+            db=db_session,
+            current_user=current_user,
+        )
+        assert payload.page.total == len(payload.items)
+        return sorted((item.model_name, item.item_type) for item in payload.items)
+
+    def check_listings() -> None:
+        assert listed("refrigerador") == [("VISA COOLER TESTE", "refrigerador")]
+        assert listed("outros") == [
+            ("CAIXA 600ML", "garrafeira"),
+            ("CAIXA TERMICA 20L", "caixa_termica"),
+            ("PECA AVULSA", "outro"),
+        ]
+        assert sorted(item_type for _, item_type in listed("todos")) == [
+            "caixa_termica",
+            "garrafeira",
+            "outro",
+            "refrigerador",
+        ]
+        assert listed("todos", "garrafeira") == [("CAIXA 600ML", "garrafeira")]
+        assert listed("refrigerador", "caixa termica") == []
+
+    # Antes do backfill (coluna NULL) o resultado é o mesmo de depois.
+    check_listings()
+    assert backfill_material_buckets(db_session) == 4
+    assert backfill_material_buckets(db_session) == 0
+    check_listings()
+
+
 def test_list_orders_sorts_pending_first_then_completed_by_withdrawal_date_desc(db_session):
     current_user = create_admin_user(db_session)
 
@@ -335,3 +564,254 @@ def test_list_orders_sorts_pending_first_then_completed_by_withdrawal_date_desc(
         "RET-CONCLUIDA-ANTIGA",
         "RET-CANCELADA",
     ]
+
+
+def test_refrigerator_import_dry_run_validates_without_writing(db_session):
+    current_user = create_admin_user(db_session)
+    raw = (
+        "Tipo;Modelo;Marca;Voltagem;RG;Etiqueta\n"
+        "Refrigerador;VISA 330L;Metalfrio;127;RG-1;ET-1\n"
+        "Refrigerador;VISA 330L;Metalfrio;127;RG-1;ET-2\n"
+        "Refrigerador;VISA 330L;Metalfrio;380;RG-2;ET-3\n"
+    )
+
+    def upload(dry_run: bool):
+        return asyncio.run(
+            import_refrigerators_csv(
+                csv_file=UploadFile(
+                    file=io.BytesIO(raw.encode("utf-8")),
+                    filename="geladeiras.csv",
+                    headers=Headers({"content-type": "text/csv"}),
+                ),
+                dry_run=dry_run,
+                db=db_session,
+                current_user=current_user,
+            )
+        )
+
+    preview = upload(dry_run=True)
+    assert preview.dry_run is True
+    assert (preview.total_rows, preview.imported_count, preview.duplicates_in_file, preview.invalid_rows) == (3, 1, 1, 1)
+    assert preview.errors == ["Linha 4: voltagem inválida (380)."]
+    assert db_session.query(Equipment).count() == 0
+
+    imported = upload(dry_run=False)
+    assert imported.dry_run is False
+    assert imported.imported_count == preview.imported_count
+    assert db_session.query(Equipment).count() == 1
+
+
+def test_allocation_lookup_matches_rg_variants_through_code_tokens(db_session):
+    current_user = create_admin_user(db_session)
+    seed_020220_allocation(db_session, "rg 55-1234", client_code="3003")
+
+    def lookup(rg_code: str):
+        return lookup_allocated_material(rg_code=rg_code, tag_code=None, db=db_session, current_user=current_user)
+
+    for variant in ("RG 55-1234", "rg551234", "551234"):
+        result = lookup(variant)
+        assert result.total == 1, variant
+        assert result.items[0].client_code == "3003"
+        assert result.items[0].rg_code == "rg 55-1234"
+    assert lookup("55123").total == 0
+
+    # A consulta lê só o índice: sem tokens, o item não é encontrado.
+    delete_batch_inventory_tokens(db_session, None)
+    db_session.commit()
+    assert lookup("551234").total == 0
+
+
+def test_equipment_tokens_follow_create_and_delete(db_session):
+    current_user = create_admin_user(db_session)
+    created = create_equipment(
+        payload=EquipmentCreate(
+            category="refrigerador",
+            model_name="VISA COOLER 330L",
+            brand="BRAHMA",
+            quantity=1,
+            voltage="220v",
+            rg_code="RG-77 01",
+            tag_code="ET-9",
+            status="novo",
+            client_name=None,
+            notes=None,
+        ),
+        db=db_session,
+        current_user=current_user,
+    )
+    tokens = {
+        row.token for row in db_session.query(CodeToken).filter(CodeToken.equipment_id == int(created.id))
+    }
+    assert tokens == {"RG-77 01", "RG7701", "7701", "ET-9", "ET9", "9"}
+
+    delete_equipment(equipment_id=int(created.id), db=db_session, current_user=current_user)
+    assert db_session.query(CodeToken).count() == 0
+
+
+def create_refrigerator(db, current_user, rg_code: str, status: str = "novo", model_name: str = "VISA COOLER 330L"):
+    return create_equipment(
+        payload=EquipmentCreate(
+            category="refrigerador",
+            model_name=model_name,
+            brand="BRAHMA",
+            quantity=1,
+            voltage="220v",
+            rg_code=rg_code,
+            tag_code=None,
+            status=status,
+            client_name=None,
+            notes=None,
+        ),
+        db=db,
+        current_user=current_user,
+    )
+
+
+def test_allocation_state_is_kept_by_writers_and_lists_only_read(db_session):
+    current_user = create_admin_user(db_session)
+    created = create_refrigerator(db_session, current_user, "RG-CACHE-2")
+
+    def available_ids() -> list[int]:
+        rows = list_available_refrigerators_for_comodato(
+            limit=50,
+            offset=0,
+            q=None,
+            db=db_session,
+            current_user=current_user,
+        )
+        return [int(row.id) for row in rows]
+
+    def counters() -> dict[str, tuple[int, int]]:
+        stats = get_allocation_cache_stats(current_user=current_user)
+        return {row.name: (row.hits, row.misses) for row in stats.sets}
+
+    def states() -> dict[int, bool]:
+        return {
+            int(row.equipment_id): bool(row.still_allocated)
+            for row in db_session.query(EquipmentAllocationState).all()
+        }
+
+    # O cadastro já grava a linha de estado, sem esperar uma listagem.
+    assert states() == {int(created.id): False}
+    assert counters() == {"allocated_020220": (0, 1), "returned_pickups": (0, 1)}
+
+    # Nova carga da base sobe a revisão e recalcula tudo; o conjunto de retiradas vem do cache.
+    seed_020220_allocation(db_session, "RG-CACHE-1")
+    assert counters() == {"allocated_020220": (0, 2), "returned_pickups": (1, 1)}
+
+    # Listagens só leem a tabela: não consultam os conjuntos nem gravam nada.
+    assert available_ids() == [int(created.id)]
+    assert available_ids() == [int(created.id)]
+    assert counters() == {"allocated_020220": (0, 2), "returned_pickups": (1, 1)}
+    assert not db_session.new and not db_session.dirty and not db_session.deleted
+
+    # Alterar o equipamento recalcula só a sua linha, com os conjuntos em cache.
+    update_equipment(
+        equipment_id=int(created.id),
+        payload=EquipmentUpdate(notes="Revisado"),
+        db=db_session,
+        current_user=current_user,
+    )
+    assert counters() == {"allocated_020220": (1, 2), "returned_pickups": (2, 1)}
+
+    seed_020220_allocation(db_session, "RG-CACHE-2", client_code="1002")
+    assert states() == {int(created.id): True}
+    assert available_ids() == []
+    stats = get_allocation_cache_stats(current_user=current_user)
+    allocated = next(row for row in stats.sets if row.name == "allocated_020220")
+    assert (allocated.hits, allocated.misses, allocated.tokens) == (1, 3, 6)
+    assert allocated.hit_rate == 0.25
+
+
+def test_refrigerators_without_state_rows_fall_back_to_the_token_check(db_session):
+    current_user = create_admin_user(db_session)
+    allocated = create_refrigerator(db_session, current_user, "RG-STATE-1")
+    free = create_refrigerator(db_session, current_user, "RG-STATE-2")
+    seed_020220_allocation(db_session, "RG-STATE-1")
+    # Primeiro deploy (rebuild do bootstrap ainda não rodou) ou refresh falho
+    # após a importação: nenhuma linha de estado.
+    db_session.query(EquipmentAllocationState).delete()
+    db_session.commit()
+
+    available = list_available_refrigerators_for_comodato(
+        limit=50,
+        offset=0,
+        q=None,
+        db=db_session,
+        current_user=current_user,
+    )
+    assert [int(row.id) for row in available] == [int(free.id)]
+
+    non_allocated = list_non_allocated_refrigerators(
+        limit=50,
+        offset=0,
+        q=None,
+        status_filter="todos",
+        sort="newest",
+        db=db_session,
+        current_user=current_user,
+    )
+    assert [int(row.id) for row in non_allocated.items] == [int(free.id)]
+    assert non_allocated.dashboard.total_nao_alocados == 1
+    assert non_allocated.page.total == 1
+
+    synced = sync_refrigerators_allocation_status(db=db_session, current_user=current_user)
+    assert synced.updated_ids == [int(allocated.id)]
+    assert db_session.query(EquipmentAllocationState).count() == 0
+
+
+def test_available_refrigerators_sort_accented_models_like_python(db_session):
+    current_user = create_admin_user(db_session)
+    names = ["Única 300L", "ábaco", "Zeta", "uva"]
+    for index, name in enumerate(names):
+        create_refrigerator(db_session, current_user, f"RG-SORT-{index}", model_name=name)
+
+    rows = list_available_refrigerators_for_comodato(
+        limit=50,
+        offset=0,
+        q=None,
+        db=db_session,
+        current_user=current_user,
+    )
+    # lower() do SQLite deixaria "Única" antes de "ábaco".
+    assert [row.model_name for row in rows] == sorted(names, key=str.lower)
+    assert [row.model_name for row in rows] == ["uva", "Zeta", "ábaco", "Única 300L"]
+
+
+def test_non_allocated_refrigerators_are_filtered_counted_and_paged_in_sql(db_session):
+    current_user = create_admin_user(db_session)
+    created_ids = [
+        int(create_refrigerator(db_session, current_user, f"RG-PAGE-{index}", status=status).id)
+        for index, status in enumerate(["novo", "disponivel", "novo", "recap", "novo"])
+    ]
+    seed_020220_allocation(db_session, "RG-PAGE-2")
+
+    def page(offset: int, status_filter: str = "todos", sort: str = "newest"):
+        return list_non_allocated_refrigerators(
+            limit=2,
+            offset=offset,
+            q=None,
+            status_filter=status_filter,
+            sort=sort,
+            db=db_session,
+            current_user=current_user,
+        )
+
+    first = page(0)
+    assert (first.dashboard.total_nao_alocados, first.dashboard.novo, first.dashboard.recap) == (4, 2, 1)
+    assert first.page.total == 4
+    assert first.page.has_next is True
+    newest = [int(item.id) for offset in (0, 2) for item in page(offset).items]
+    assert newest == [created_ids[4], created_ids[3], created_ids[1], created_ids[0]]
+    oldest = [int(item.id) for offset in (0, 2) for item in page(offset, sort="oldest").items]
+    assert oldest == list(reversed(newest))
+
+    only_new = page(0, status_filter="novo")
+    assert only_new.page.total == 2
+    assert [int(item.id) for item in only_new.items] == [created_ids[4], created_ids[0]]
+
+    states = {
+        int(row.equipment_id): bool(row.still_allocated)
+        for row in db_session.query(EquipmentAllocationState).all()
+    }
+    assert states == {equipment_id: equipment_id == created_ids[2] for equipment_id in created_ids}
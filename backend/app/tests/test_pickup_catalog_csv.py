@@ -0,0 +1,382 @@
+import asyncio
+import csv
+import gzip
+import hashlib
+import io
+import random
+import threading
+
+import pytest
+
+from app.services import pickup_catalog_csv
+from app.services.csv_source import (
+    CsvUploadTooLargeError,
+    CsvUploadInvalidArchiveError,
+    CsvUploadTooManyLinesError,
+    detect_csv_encoding,
+    spool_upload,
+    upload_inner_suffix,
+)
+from app.services.pickup_catalog_csv import (
+    ITEM_TYPE_RULES,
+    _normalized_description,
+    classify_item_type,
+    load_clients_csv,
+    load_inventory_csv,
+    merge_clients_with_inventory_snapshots,
+)
+
+INVENTORY_CSV = (
+    "Código;Nome Fantasia;CNPJ;CNPJ;Descrição;Baixados;Saldo;Nro Serie Mercadoria;Nro Comodato\n"
+    "0001;Bar do Zé;;12.345.678/0001-90;VISA COOLER 330L;-1;0;RG 123;CMD-1\n"
+    "0001;Bar do Zé;;;CAIXA 600ML;2;0;;CMD-1\n"
+    "0002;Mercado;;;\"CJ DE MESA\nPLASTICA\";0;-3\n"
+    "\n"
+    "0003;Sem saldo;;;GARRAFA 1L;0;0;;\n"
+)
+
+
+def test_load_inventory_csv_keeps_only_open_rows_with_original_row_numbers():
+    result = load_inventory_csv(INVENTORY_CSV.encode("utf-8"))
+
+    assert list(result) == ["1", "2"]
+    first = result["1"][0]
+    assert first["id"] == "inv_1"
+    assert first["item_type"] == "refrigerador"
+    assert first["open_quantity"] == 1
+    assert first["rg"] == "RG 123"
+    assert first["client_snapshot"]["cnpj_cpf"] == ""
+    assert first["client_snapshot"]["nome_fantasia"] == "Bar do Zé"
+
+    # Linha com quebra dentro de aspas e linha curta (sem RG/comodato).
+    second = result["2"][0]
+    assert second["id"] == "inv_3"
+    assert second["description"] == "CJ DE MESA PLASTICA"
+    assert second["item_type"] == "jogo_mesa"
+    assert second["open_quantity"] == 3
+    assert second["comodato_number"] == ""
+
+
+def test_client_snapshot_only_on_first_item_and_merge_is_in_place():
+    raw = INVENTORY_CSV + "0001;Bar do Zé;;;GARRAFEIRA;0;-2;;CMD-2\n"
+    inventory = load_inventory_csv(raw.encode("utf-8"))
+
+    assert [("client_snapshot" in item) for item in inventory["1"]] == [True, False]
+
+    clients = {"1": {"client_code": "1", "nome_fantasia": "", "cnpj_cpf": "99"}}
+    existing = clients["1"]
+    merged = merge_clients_with_inventory_snapshots(clients, inventory)
+
+    assert merged is clients
+    assert merged["1"] is existing
+    assert existing["nome_fantasia"] == "Bar do Zé"
+    assert existing["cnpj_cpf"] == "99"
+    assert merged["2"]["client_code"] == "0002"
+    assert merged["2"]["nome_fantasia"] == "Mercado"
+
+
+def build_xlsx(text: str) -> bytes:
+    openpyxl = pytest.importorskip("openpyxl")
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    for row in csv.reader(io.StringIO(text), delimiter=";"):
+        # Saldos como números, como o ERP exporta; o resto fica como texto.
+        sheet.append([int(value) if value.lstrip("-").isdigit() and value.startswith("-") else value for value in row])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def test_xlsx_inventory_and_clients_parse_like_csv(tmp_path):
+    xlsx = build_xlsx(INVENTORY_CSV)
+    assert load_inventory_csv(xlsx) == load_inventory_csv(INVENTORY_CSV.encode("utf-8"))
+
+    clients_text = "Codigo;Nome Fantasia;Setor\n001;Primeiro;Setor 12\n1;Segundo;0045\n"
+    clients_path = tmp_path / "012011.xlsx"
+    clients_path.write_bytes(build_xlsx(clients_text))
+    assert load_clients_csv(clients_path) == load_clients_csv(clients_text.encode("utf-8"))
+
+
+def test_load_inventory_csv_requires_data_rows_before_columns():
+    try:
+        load_inventory_csv(b"a;b\n")
+    except ValueError as exc:
+        assert "sem linhas de dados" in str(exc)
+    else:
+        raise AssertionError("CSV sem linhas deveria falhar.")
+
+
+def test_load_clients_csv_last_row_wins_per_code():
+    raw = (
+        "Codigo;Nome Fantasia;Setor\n"
+        "001;Primeiro;Setor 12\n"
+        "1;Segundo;0045\n"
+    ).encode("cp1252")
+    clients = load_clients_csv(raw)
+
+    assert list(clients) == ["1"]
+    assert clients["1"]["nome_fantasia"] == "Segundo"
+    assert clients["1"]["client_code"] == "1"
+    assert clients["1"]["setor"] == "045"
+
+
+def _reference_classify_item_type(description: str) -> str:
+    # Cadeia de "in" original, mantida aqui como referência de paridade.
+    text = _normalized_description(description)
+    if (
+        "cj de mesa" in text
+        or "cj. mesa" in text
+        or "cj mesas" in text
+        or "mesa jogos" in text
+        or "jogos mesa" in text
+        or "jogo de mesa" in text
+        or "jogos de mesa" in text
+        or "jg mesa" in text
+        or "mesa bistro" in text
+        or "mesa madeira" in text
+    ):
+        return "jogo_mesa"
+    if "caixa termica" in text or "cx termica" in text:
+        return "caixa_termica"
+    if "chopeira" in text or "choppeira" in text:
+        return "chopeira"
+    if (
+        "barril chopp" in text
+        or "torre de chopp" in text
+        or "torre chopp" in text
+        or "cilindro co2" in text
+        or "choperia" in text
+        or "chopp" in text
+    ):
+        return "chopeira"
+    if "balde" in text or "baldes" in text:
+        return "balde"
+    if "testeira" in text:
+        return "testeira"
+    if "compressor" in text:
+        return "compressor"
+    if "totem" in text:
+        return "totem"
+    if "cooler carrinho" in text or "coller carrinho" in text:
+        return "cooler_carrinho"
+    if "inflavel" in text or "pit stop" in text or "portal trave" in text:
+        return "inflavel"
+    if "empilhadeira" in text:
+        return "empilhadeira"
+    if "calca" in text:
+        return "calca"
+    if "cartucho" in text or "toner" in text:
+        return "cartucho"
+    if "ombrelone" in text or "ombrellone" in text:
+        return "ombrelone"
+    if "camera fria" in text or "camara frig" in text:
+        return "camera_fria"
+    if "dispensador" in text:
+        return "dispensador"
+    if "garrafeira" in text or "gfa vidro" in text:
+        return "garrafeira"
+    if "visa cooler" in text or ("visa" in text and "cooler" in text):
+        return "refrigerador"
+    refrigerador_words = ("refrigerador", "geladeira", "frigobar", "cervejeira", "horizontal", "vertical", "mini")
+    if any(word in text for word in refrigerador_words):
+        return "refrigerador"
+    if "equipamento refrigeracao" in text or "pre resfriador" in text or "cervegela" in text or "cervejela" in text:
+        return "refrigerador"
+    if any(word in text for word in ("caixa", "cx ", "cx.", "engrad", "fardo")):
+        return "vasilhame_caixa"
+    if any(word in text for word in ("garrafa", "gfa", "vasilhame")):
+        return "vasilhame_garrafa"
+    return "outro"
+
+
+def _description_corpus(size: int) -> list[str]:
+    keywords: list[str] = []
+    for _, terms in ITEM_TYPE_RULES:
+        for term in terms:
+            keywords.extend([term] if isinstance(term, str) else list(term))
+    fillers = [
+        "330L", "600ML", "1 LT", "Brahma", "Skol", "Ç", "açaí", "Câmara", "TÉRMICA",
+        "cx", "mesa", "visa", "cooler", "garraf", "-", ".", "  ", "300 ml", "PLÁSTICA",
+    ]
+    rng = random.Random(20240213)
+    corpus = [keyword.upper() for keyword in keywords] + keywords
+    while len(corpus) < size:
+        parts = rng.sample(keywords, rng.randint(0, 3)) + rng.sample(fillers, rng.randint(1, 4))
+        rng.shuffle(parts)
+        text = " ".join(parts)
+        if rng.random() < 0.3:
+            text = text.replace(" ", rng.choice(["", "  ", "."]), 1)
+        corpus.append(text.upper() if rng.random() < 0.5 else text)
+    return corpus
+
+
+def test_classify_item_type_matches_reference_rules():
+    corpus = _description_corpus(30000)
+    mismatches = [
+        (description, classify_item_type(description), _reference_classify_item_type(description))
+        for description in corpus
+        if classify_item_type(description) != _reference_classify_item_type(description)
+    ]
+    assert mismatches == []
+
+
+def _synthetic_inventory_csv(rows: int) -> bytes:
+    rng = random.Random(5)
+    descriptions = ["VISA COOLER 330L", "CAIXA 600ML", "CJ DE MESA\nPLASTICA", 'TV 32"', "GARRAFA 1L", ""]
+    lines = ["Código;Nome Fantasia;CNPJ;Descrição;Baixados;Saldo;Nro Serie Mercadoria;Nro Comodato"]
+    for idx in range(rows):
+        description = rng.choice(descriptions)
+        if "\n" in description:
+            description = f'"{description}"'
+        baixados = rng.choice(["-1", "-2", "0", "3", "-1.000"])
+        lines.append(f"{rng.randint(1, 400):04d};Cliente Açaí {idx};{idx:014d};{description};{baixados};0;RG {idx};CMD")
+        if idx % 97 == 0:
+            lines.append("")
+    return ("\n".join(lines) + "\n").encode("cp1252")
+
+
+def test_parallel_parse_matches_serial_parse(monkeypatch):
+    parallel_runs = []
+    load_parallel = pickup_catalog_csv._load_csv_parallel
+
+    def tracking_load_parallel(*args):
+        parts = load_parallel(*args)
+        parallel_runs.append(parts is not None)
+        return parts
+
+    monkeypatch.setattr(pickup_catalog_csv, "_load_csv_parallel", tracking_load_parallel)
+
+    raw_inventory = _synthetic_inventory_csv(3000)
+    serial = load_inventory_csv(raw_inventory, workers=1)
+    parallel = load_inventory_csv(raw_inventory, workers=2, min_parallel_bytes=0)
+    assert list(parallel) == list(serial)
+    assert parallel == serial
+
+    raw_clients = INVENTORY_CSV.encode("utf-8") * 200
+    assert load_clients_csv(raw_clients, workers=2, min_parallel_bytes=0) == load_clients_csv(raw_clients)
+    # Sem fallback silencioso: os dois parses paralelos rodaram no pool.
+    assert parallel_runs == [True, True]
+
+
+def test_parallel_parse_resyncs_chunks_cut_inside_quoted_fields(tmp_path):
+    body = _synthetic_inventory_csv(400).decode("cp1252").split("\n")
+    # Um campo entre aspas com centenas de quebras de linha atravessa vários cortes.
+    long_field = '"' + "\n".join(f'LINHA {idx} "" COM ASPAS' for idx in range(600)) + '"'
+    body.insert(200, f"0042;Cliente Longo;00000000000042;{long_field};-1;0;RG LONGO;CMD")
+    raw = "\n".join(body).encode("cp1252")
+
+    headers, body_start, chunks = pickup_catalog_csv._plan_csv_chunks(raw, "cp1252", ";", 16)
+    assert headers[0] == "Código"
+    assert chunks[0][0] == body_start and chunks[-1][1] == len(raw)
+    # Cortes provisórios em "\n", e ao menos um deles dentro do campo longo.
+    assert all(raw[start - 1:start] == b"\n" for start, _ in chunks[1:])
+    field_start = raw.index(b'"LINHA 0')
+    field_end = raw.index(b'COM ASPAS";-1')
+    assert any(field_start < start < field_end for start, _ in chunks)
+
+    expected = load_inventory_csv(raw, workers=1)
+    assert any(item["rg"] == "RG LONGO" for items in expected.values() for item in items)
+    assert load_inventory_csv(raw, workers=4, min_parallel_bytes=0) == expected
+    path = tmp_path / "inventario.csv"
+    path.write_bytes(raw)
+    assert load_inventory_csv(path, workers=4, min_parallel_bytes=0) == expected
+
+
+class _FakeUpload:
+    def __init__(self, raw: bytes):
+        self._stream = io.BytesIO(raw)
+
+    async def read(self, size: int = -1) -> bytes:
+        return self._stream.read(size)
+
+
+def test_spooled_upload_parses_like_in_memory_bytes(monkeypatch):
+    monkeypatch.setattr("app.services.csv_source.UPLOAD_SPOOL_CHUNK_BYTES", 4096)
+    monkeypatch.setattr("app.services.csv_source.CSV_DECODE_CHUNK_BYTES", 4096)
+    raw = b"\xef\xbb\xbf" + _synthetic_inventory_csv(800).decode("cp1252").encode("utf-8")
+    spool_path = asyncio.run(spool_upload(_FakeUpload(raw), max_bytes=len(raw), max_lines=2000))
+    try:
+        assert spool_path.read_bytes() == raw
+        expected = load_inventory_csv(raw)
+        assert load_inventory_csv(spool_path) == expected
+        assert load_inventory_csv(spool_path, workers=2, min_parallel_bytes=0) == expected
+    finally:
+        spool_path.unlink()
+
+
+def test_spooled_upload_enforces_limits_and_discards_file(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.services.csv_source.CSV_UPLOAD_SPOOL_DIR", str(tmp_path))
+    raw = b"a;b\n" * 100
+    with pytest.raises(CsvUploadTooLargeError):
+        asyncio.run(spool_upload(_FakeUpload(raw), max_bytes=len(raw) - 1, max_lines=1000))
+    with pytest.raises(CsvUploadTooManyLinesError):
+        asyncio.run(spool_upload(_FakeUpload(raw), max_bytes=len(raw), max_lines=99))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_gzip_upload_is_spooled_decompressed_with_limits_on_output(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.services.csv_source.CSV_UPLOAD_SPOOL_DIR", str(tmp_path))
+    monkeypatch.setattr("app.services.csv_source.UPLOAD_SPOOL_CHUNK_BYTES", 512)
+    raw = _synthetic_inventory_csv(800)
+    # Dois membros concatenados, como `cat a.gz b.gz`.
+    compressed = gzip.compress(raw[:5000]) + gzip.compress(raw[5000:])
+    digest = hashlib.sha256()
+    spool_path = asyncio.run(spool_upload(_FakeUpload(compressed), max_bytes=len(raw), max_lines=2000, digest=digest))
+    try:
+        assert spool_path.read_bytes() == raw
+        assert digest.hexdigest() == hashlib.sha256(raw).hexdigest()
+    finally:
+        spool_path.unlink()
+
+    # Os limites valem para o conteúdo descomprimido, não para o .gz.
+    with pytest.raises(CsvUploadTooLargeError):
+        asyncio.run(spool_upload(_FakeUpload(compressed), max_bytes=len(compressed) * 2, max_lines=2000))
+    with pytest.raises(CsvUploadTooManyLinesError):
+        asyncio.run(spool_upload(_FakeUpload(compressed), max_bytes=len(raw), max_lines=100))
+    with pytest.raises(CsvUploadInvalidArchiveError):
+        asyncio.run(spool_upload(_FakeUpload(compressed[:-40]), max_bytes=len(raw), max_lines=2000))
+    assert list(tmp_path.iterdir()) == []
+    assert upload_inner_suffix("Relatorio 02.02.20.CSV.gz") == ".csv"
+
+
+def test_gzip_upload_inflates_off_the_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.services.csv_source.CSV_UPLOAD_SPOOL_DIR", str(tmp_path))
+    monkeypatch.setattr("app.services.csv_source.UPLOAD_SPOOL_CHUNK_BYTES", 512)
+    write_threads: set[int] = set()
+
+    class _RecordingDigest:
+        def __init__(self):
+            self._digest = hashlib.sha256()
+
+        def update(self, chunk: bytes) -> None:
+            write_threads.add(threading.get_ident())
+            self._digest.update(chunk)
+
+    raw = _synthetic_inventory_csv(200)
+    spool_path = asyncio.run(
+        spool_upload(_FakeUpload(gzip.compress(raw)), max_bytes=len(raw), max_lines=2000, digest=_RecordingDigest())
+    )
+    spool_path.unlink()
+    # O teste roda o loop na thread principal; inflate/hash/gravação ficam fora dela.
+    assert write_threads
+    assert threading.get_ident() not in write_threads
+
+
+def _reference_csv_encoding(raw: bytes) -> str:
+    for encoding in ("utf-8-sig", "cp1252", "latin-1"):
+        try:
+            raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+        return encoding
+    raise AssertionError("latin-1 decodifica qualquer byte")
+
+
+def test_detect_csv_encoding_matches_full_decode_chain(monkeypatch):
+    # Blocos minúsculos forçam sequências multibyte cortadas entre blocos.
+    monkeypatch.setattr("app.services.csv_source.CSV_DECODE_CHUNK_BYTES", 5)
+    pieces = [b"ab;", b"\n", b"\xc3\xa9", b"\xe2\x82\xac", b"\xf0\x9f\x98\x80", b"\xef\xbb\xbf", b"\xe9", b"\x81", b"\x9d", b"\xc3"]
+    rng = random.Random(7)
+    for _ in range(5000):
+        raw = b"".join(rng.choice(pieces) for _ in range(rng.randint(0, 10)))
+        assert detect_csv_encoding(raw) == _reference_csv_encoding(raw), raw
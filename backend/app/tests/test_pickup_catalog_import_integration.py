@@ -0,0 +1,964 @@
+import asyncio
+import io
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from uuid import uuid4
+
+import pytest
+from fastapi import UploadFile
+from sqlalchemy import Integer, event, select
+from starlette.datastructures import Headers
+
+TEST_DB_FILE = Path(tempfile.gettempdir()) / f"test_pickup_catalog_import_integration_{uuid4().hex}.db"
+# TEST_DATABASE_URL permite rodar a mesma suíte contra um PostgreSQL descartável.
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL") or f"sqlite:///{TEST_DB_FILE.as_posix()}"
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+os.environ.setdefault("DB_BOOTSTRAP_MODE", "off")
+
+from app.cli import main as cli_main  # noqa: E402
+from app.core.security import get_password_hash  # noqa: E402
+from app.database.base import Base  # noqa: E402
+from app.database.session import SessionLocal, engine  # noqa: E402
+from app.models.code_token import CodeToken  # noqa: E402
+from app.models.pickup_catalog import (  # noqa: E402
+    PickupCatalogClient,
+    PickupCatalogImportJob,
+    PickupCatalogInventoryItem,
+    PickupCatalogUploadBatch,
+)
+from app.models.user import User  # noqa: E402
+from app.routes.pickup_catalog import (  # noqa: E402
+    activate_upload_batch,
+    get_import_job,
+    list_upload_batches,
+    upload_csv,
+)
+from app.services.import_pipeline import run_pipeline  # noqa: E402
+from app.services.code_tokens import index_inventory_tokens  # noqa: E402
+from app.services.key_set import key_set  # noqa: E402
+from app.services.pg_copy import encode_copy_rows  # noqa: E402
+from app.services.pickup_catalog_bulk import (  # noqa: E402
+    client_ids_by_code,
+    insert_inventory_items,
+    upsert_clients,
+)
+from app.services.pickup_catalog_csv import item_type_rules_version  # noqa: E402
+from app.services.pickup_catalog_import import (  # noqa: E402
+    _purge_stale_clients,
+    active_batch_id,
+    import_pickup_catalog,
+    reclaim_inactive_batches,
+)
+from app.services.pickup_catalog_jobs import (  # noqa: E402
+    _set_live_progress,
+    fail_interrupted_import_jobs,
+    resume_queued_import_jobs,
+    wait_for_import_job,
+    write_job_heartbeat,
+)
+from app.services.pickup_catalog_reclassify import reclassify_stale_inventory_items  # noqa: E402
+
+requires_postgresql = pytest.mark.skipif(
+    engine.dialect.name != "postgresql",
+    reason="Requer TEST_DATABASE_URL apontando para um PostgreSQL.",
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_database():
+    engine.dispose()
+    if TEST_DB_FILE.exists():
+        TEST_DB_FILE.unlink()
+    Base.metadata.create_all(bind=engine)
+    try:
+        yield
+    finally:
+        Base.metadata.drop_all(bind=engine)
+        engine.dispose()
+        if TEST_DB_FILE.exists():
+            TEST_DB_FILE.unlink()
+
+
+@pytest.fixture
+def db_session():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def test_reclassify_only_touches_items_from_older_rules_versions(db_session):
+    current_version = item_type_rules_version()
+    client = PickupCatalogClient(client_code="1001", nome_fantasia="Cliente Reclassificacao")
+    db_session.add(client)
+    db_session.flush()
+
+    stale_items = [
+        PickupCatalogInventoryItem(
+            client_id=client.id,
+            description=description,
+            item_type="outro",
+            open_quantity=1,
+            classifier_version=current_version - 1,
+        )
+        for description in ("CJ DE MESA PLASTICA", "CAIXA TERMICA 50L", "VISA COOLER 330L")
+    ]
+    current_item = PickupCatalogInventoryItem(
+        client_id=client.id,
+        description="VISA COOLER 330L",
+        item_type="outro",
+        open_quantity=1,
+        classifier_version=current_version,
+    )
+    db_session.add_all([*stale_items, current_item])
+    db_session.commit()
+
+    assert reclassify_stale_inventory_items(db_session, batch_size=2) == 3
+    assert reclassify_stale_inventory_items(db_session, batch_size=2) == 0
+
+    db_session.expire_all()
+    assert [item.item_type for item in stale_items] == ["jogo_mesa", "caixa_termica", "refrigerador"]
+    assert {item.classifier_version for item in stale_items} == {current_version}
+    assert [item.material_bucket for item in stale_items] == ["jogo_mesa", "caixa_termica", "refrigerador"]
+    # Linhas já na versão atual não são reprocessadas.
+    assert current_item.item_type == "outro"
+
+
+INVENTORY_HEADER = "Código;Nome Fantasia;Descrição;Baixados;Saldo;Nro Serie Mercadoria;Nro Comodato;Codigo Produto\n"
+
+
+def create_admin_user(db) -> User:
+    user = User(
+        name="Admin Import",
+        email=f"admin.import.{uuid4().hex[:8]}@test.local",
+        password=get_password_hash("Admin@123"),
+        role="admin",
+        permissions="[]",
+    )
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    return user
+
+
+def csv_upload(text: str, filename: str = "020220.csv") -> UploadFile:
+    return UploadFile(
+        file=io.BytesIO(text.encode("utf-8")),
+        filename=filename,
+        headers=Headers({"content-type": "text/csv"}),
+    )
+
+
+def submit_upload(
+    db,
+    user,
+    inventory_text: str | None,
+    *,
+    incremental: bool,
+    clients_text: str | None = None,
+    dry_run: bool = False,
+):
+    return asyncio.run(
+        upload_csv(
+            clients_csv=csv_upload(clients_text, "012011.csv") if clients_text is not None else None,
+            inventory_csv=csv_upload(INVENTORY_HEADER + inventory_text) if inventory_text is not None else None,
+            incremental=incremental,
+            dry_run=dry_run,
+            db=db,
+            current_user=user,
+        )
+    )
+
+
+def run_upload(
+    db,
+    user,
+    inventory_text: str | None,
+    *,
+    incremental: bool,
+    clients_text: str | None = None,
+    dry_run: bool = False,
+) -> dict:
+    submitted = submit_upload(
+        db,
+        user,
+        inventory_text,
+        incremental=incremental,
+        clients_text=clients_text,
+        dry_run=dry_run,
+    )
+    job = wait_for_import_job(submitted.id)
+    assert job is not None and job.status == "concluida", job and job.error
+    db.expire_all()
+    return get_import_job(submitted.id, db=db, current_user=user).result
+
+
+def inventory_snapshot(db) -> list[tuple]:
+    rows = (
+        db.query(
+            PickupCatalogClient.client_code,
+            PickupCatalogInventoryItem.description,
+            PickupCatalogInventoryItem.open_quantity,
+            PickupCatalogInventoryItem.rg,
+        )
+        .join(PickupCatalogClient, PickupCatalogClient.id == PickupCatalogInventoryItem.client_id)
+        .filter(PickupCatalogInventoryItem.batch_id == active_batch_id(db))
+        .order_by(PickupCatalogInventoryItem.id.asc())
+        .all()
+    )
+    return [tuple(row) for row in rows]
+
+
+def indexed_inventory_tokens(db) -> set[tuple]:
+    # (RG do item, token) de todos os tokens de itens; órfãos aparecem com RG None.
+    rows = db.query(PickupCatalogInventoryItem.rg, CodeToken.token).select_from(CodeToken).outerjoin(
+        PickupCatalogInventoryItem, PickupCatalogInventoryItem.id == CodeToken.inventory_item_id
+    ).filter(CodeToken.inventory_item_id.isnot(None))
+    return {tuple(row) for row in rows}
+
+
+def test_incremental_upload_applies_only_the_inventory_delta(db_session):
+    user = create_admin_user(db_session)
+    first = run_upload(
+        db_session,
+        user,
+        "1001;Bar A;VISA COOLER 330L;-1;0;RG 1;CMD-1;P1\n"
+        "1001;Bar A;CAIXA 600ML;-2;0;;CMD-1;P2\n"
+        "1001;Bar A;CAIXA 600ML;-3;0;;CMD-1;P2\n"
+        "1002;Bar B;CJ DE MESA;-1;0;;CMD-2;P3\n",
+        incremental=True,
+    )
+    # Sem lote ativo, a primeira carga incremental vira snapshot.
+    assert first["inventory_diff"]["mode"] == "snapshot"
+    assert first["inventory_diff"]["inserted"] == 4
+    untouched_id = (
+        db_session.query(PickupCatalogInventoryItem.id)
+        .filter(PickupCatalogInventoryItem.rg == "RG 1")
+        .scalar()
+    )
+
+    second = run_upload(
+        db_session,
+        user,
+        "1001;Bar A;VISA COOLER 330L;-1;0;RG 1;CMD-1;P1\n"
+        "1001;Bar A;CAIXA 600ML;-2;0;;CMD-1;P2\n"
+        "1001;Bar A;CAIXA 600ML;-5;0;;CMD-1;P2\n"
+        "1003;Bar C;VISA COOLER 330L;-1;0;RG 9;CMD-3;P1\n",
+        incremental=True,
+    )
+    assert second["inventory_diff"] == {
+        "mode": "incremental",
+        "inserted": 1,
+        "updated": 1,
+        "deleted": 1,
+        "unchanged": 2,
+    }
+    assert second["stats"]["open_items"] == 4
+    # Tokens do item removido saem; o inserido entra indexado.
+    assert indexed_inventory_tokens(db_session) == {
+        ("RG 1", "RG 1"),
+        ("RG 1", "RG1"),
+        ("RG 1", "1"),
+        ("RG 9", "RG 9"),
+        ("RG 9", "RG9"),
+        ("RG 9", "9"),
+    }
+
+    db_session.expire_all()
+    assert inventory_snapshot(db_session) == [
+        ("1001", "VISA COOLER 330L", 1, "RG 1"),
+        ("1001", "CAIXA 600ML", 2, ""),
+        ("1001", "CAIXA 600ML", 5, ""),
+        ("1003", "VISA COOLER 330L", 1, "RG 9"),
+    ]
+    # Linhas inalteradas mantêm o mesmo id.
+    assert (
+        db_session.query(PickupCatalogInventoryItem.id)
+        .filter(PickupCatalogInventoryItem.rg == "RG 1")
+        .scalar()
+        == untouched_id
+    )
+
+    # Reenvio idêntico: o hash bate com o do lote ativo e nada é reprocessado.
+    same = run_upload(
+        db_session,
+        user,
+        "1001;Bar A;VISA COOLER 330L;-1;0;RG 1;CMD-1;P1\n"
+        "1001;Bar A;CAIXA 600ML;-2;0;;CMD-1;P2\n"
+        "1001;Bar A;CAIXA 600ML;-5;0;;CMD-1;P2\n"
+        "1003;Bar C;VISA COOLER 330L;-1;0;RG 9;CMD-3;P1\n",
+        incremental=False,
+    )
+    assert same["inventory_diff"]["mode"] == "unchanged"
+    assert same["updated_sources"] == {"clients_012011": False, "inventory_020220": False}
+    assert same["unchanged_sources"] == {"clients_012011": False, "inventory_020220": True}
+    assert same["stats"]["open_items"] == 4
+
+    # O snapshot completo continua produzindo a mesma base.
+    full = run_upload(
+        db_session,
+        user,
+        "1001;Bar A;VISA COOLER 330L;-1;0;RG 1;CMD-1;P1\n"
+        "1001;Bar A;CAIXA 600ML;-2;0;;CMD-1;P2\n"
+        "1001;Bar A;CAIXA 600ML;-5;0;;CMD-1;P2\n"
+        "1003;Bar C;VISA COOLER 330L;-1;0;RG 9;CMD-3;P1\n"
+        "1003;Bar C;CJ DE MESA;-1;0;;CMD-3;P3\n",
+        incremental=False,
+    )
+    assert full["inventory_diff"]["mode"] == "snapshot"
+    assert full["inventory_diff"]["deleted"] == 4
+    db_session.expire_all()
+    assert inventory_snapshot(db_session) == [
+        ("1001", "VISA COOLER 330L", 1, "RG 1"),
+        ("1001", "CAIXA 600ML", 2, ""),
+        ("1001", "CAIXA 600ML", 5, ""),
+        ("1003", "VISA COOLER 330L", 1, "RG 9"),
+        ("1003", "CJ DE MESA", 1, ""),
+    ]
+
+
+def test_upload_returns_a_job_and_reports_its_outcome(db_session):
+    user = create_admin_user(db_session)
+    submitted = submit_upload(
+        db_session,
+        user,
+        "1001;Bar A;VISA COOLER 330L;-1;0;RG 1;CMD-1;P1\n"
+        "1002;Bar B;CJ DE MESA;-1;0;;CMD-2;P3\n",
+        incremental=False,
+    )
+    assert submitted.status == "na_fila"
+    assert submitted.inventory_file_name == "020220.csv"
+
+    assert wait_for_import_job(submitted.id).status == "concluida"
+    db_session.expire_all()
+    job = get_import_job(submitted.id, db=db_session, current_user=user)
+    assert job.stage == "concluida"
+    assert job.rows_processed == 2
+    assert job.result["stats"]["open_items"] == 2
+    assert job.error == ""
+    assert job.finished_at is not None
+
+    # Relatório por etapa na resposta e gravado no lote.
+    stages = {stage["stage"]: stage for stage in job.result["profile"]["stages"]}
+    assert {
+        "inventory.detect_encoding",
+        "inventory.detect_delimiter",
+        "inventory.pipeline",
+        "inventory.parse",
+        "inventory.classify",
+        "inventory.classify_item_type",
+        "inventory.write",
+        "upsert_clients",
+        "activate_batch",
+    } <= set(stages)
+    assert stages["inventory.pipeline"]["rows_in"] == 2
+    assert stages["inventory.pipeline"]["rows_out"] == 2
+    assert stages["inventory.parse"]["part_of"] == "inventory.pipeline"
+    assert all(stage["wall_ms"] >= 0 for stage in stages.values())
+    batch_profile = list_upload_batches(db=db_session, current_user=user)[0].import_profile
+    assert batch_profile["stages"] == job.result["profile"]["stages"]
+
+    # Falhas de validação ficam registradas no job em vez de virar erro HTTP.
+    failed = asyncio.run(
+        upload_csv(
+            clients_csv=None,
+            inventory_csv=csv_upload("coluna_a;coluna_b\n1;2\n"),
+            incremental=False,
+            dry_run=False,
+            db=db_session,
+            current_user=user,
+        )
+    )
+    assert wait_for_import_job(failed.id).status == "falhou"
+    db_session.expire_all()
+    failed_job = get_import_job(failed.id, db=db_session, current_user=user)
+    assert failed_job.error
+    assert failed_job.result is None
+    # A base anterior continua intacta.
+    assert len(inventory_snapshot(db_session)) == 2
+
+
+def test_queued_jobs_survive_restart_and_run_oldest_first(db_session, tmp_path):
+    # Estado deixado por um processo encerrado: um job em execução e dois na fila.
+    spools = []
+    for code in ("1001", "1002"):
+        spool = tmp_path / f"020220-{code}.csv"
+        spool.write_text(INVENTORY_HEADER + f"{code};Bar {code};VISA COOLER 330L;-1;0;RG {code};CMD-1;P1\n")
+        spools.append(spool)
+    running = PickupCatalogImportJob(
+        status="processando",
+        inventory_file_name="020220.csv",
+        started_at=datetime.now(timezone.utc) - timedelta(hours=1),
+    )
+    # Em execução em outro worker: heartbeat recente, não é interrompido.
+    other_worker = PickupCatalogImportJob(
+        status="processando",
+        inventory_file_name="020220.csv",
+        started_at=datetime.now(timezone.utc) - timedelta(hours=1),
+        heartbeat_at=datetime.now(timezone.utc),
+    )
+    queued = [
+        PickupCatalogImportJob(status="na_fila", inventory_file_name=spool.name, inventory_spool_path=str(spool))
+        for spool in spools
+    ]
+    missing = PickupCatalogImportJob(
+        status="na_fila",
+        inventory_file_name="020220.csv",
+        inventory_spool_path=str(tmp_path / "removido.csv"),
+    )
+    db_session.add_all([running, other_worker, *queued, missing])
+    db_session.commit()
+
+    assert fail_interrupted_import_jobs(db_session) == 1
+    resume_queued_import_jobs()
+
+    first, second = (wait_for_import_job(int(job.id)) for job in queued)
+    assert (first.status, second.status) == ("concluida", "concluida")
+    assert first.finished_at <= second.started_at
+    assert wait_for_import_job(int(missing.id)).status == "falhou"
+    db_session.expire_all()
+    assert running.status == "falhou"
+    assert other_worker.status == "processando"
+    assert inventory_snapshot(db_session) == [("1002", "VISA COOLER 330L", 1, "RG 1002")]
+    assert not any(spool.exists() for spool in spools)
+
+
+def test_job_progress_is_read_from_the_job_row(db_session):
+    user = create_admin_user(db_session)
+    job = PickupCatalogImportJob(
+        status="processando",
+        inventory_file_name="020220.csv",
+        started_at=datetime.now(timezone.utc),
+    )
+    db_session.add(job)
+    db_session.commit()
+
+    # O heartbeat grava o andamento; outro worker o lê do banco.
+    _set_live_progress(int(job.id), "gravando", 1500)
+    write_job_heartbeat(int(job.id))
+    reader = SessionLocal()
+    try:
+        payload = get_import_job(int(job.id), db=reader, current_user=user)
+    finally:
+        reader.close()
+    assert (payload.status, payload.stage, payload.rows_processed) == ("processando", "gravando", 1500)
+
+    # Heartbeat parado além do limite: a consulta já o mostra como interrompido.
+    db_session.expire_all()
+    job.heartbeat_at = datetime.now(timezone.utc) - timedelta(hours=1)
+    db_session.commit()
+    assert get_import_job(int(job.id), db=db_session, current_user=user).status == "falhou"
+
+
+def test_snapshot_imports_switch_batches_and_keep_the_previous_one(db_session):
+    user = create_admin_user(db_session)
+    run_upload(db_session, user, "1001;Bar A;VISA COOLER 330L;-1;0;RG 1;CMD-1;P1\n", incremental=False)
+    first_batch_id = active_batch_id(db_session)
+    run_upload(db_session, user, "1002;Bar B;VISA COOLER 330L;-1;0;RG 2;CMD-2;P1\n", incremental=False)
+    second_batch_id = active_batch_id(db_session)
+    assert second_batch_id != first_batch_id
+    assert inventory_snapshot(db_session) == [("1002", "VISA COOLER 330L", 1, "RG 2")]
+    assert {
+        row.material_bucket
+        for row in db_session.query(PickupCatalogInventoryItem.material_bucket).filter(
+            PickupCatalogInventoryItem.batch_id == second_batch_id
+        )
+    } == {"refrigerador"}
+
+    # O lote anterior fica guardado (PICKUP_CATALOG_RETAINED_BATCHES=2) junto
+    # com o cliente que só ele referencia.
+    batches = list_upload_batches(db=db_session, current_user=user)
+    assert [(batch.id, batch.active) for batch in batches] == [(second_batch_id, True), (first_batch_id, False)]
+
+    activate_upload_batch(first_batch_id, db=db_session, current_user=user)
+    db_session.expire_all()
+    assert inventory_snapshot(db_session) == [("1001", "VISA COOLER 330L", 1, "RG 1")]
+
+    activate_upload_batch(second_batch_id, db=db_session, current_user=user)
+    run_upload(db_session, user, "1003;Bar C;VISA COOLER 330L;-1;0;RG 3;CMD-3;P1\n", incremental=False)
+    db_session.expire_all()
+    remaining = [batch.id for batch in list_upload_batches(db=db_session, current_user=user)]
+    assert remaining == [active_batch_id(db_session), second_batch_id]
+    assert db_session.query(PickupCatalogInventoryItem).filter(
+        PickupCatalogInventoryItem.batch_id == first_batch_id
+    ).count() == 0
+    assert {rg for rg, _ in indexed_inventory_tokens(db_session)} == {"RG 2", "RG 3"}
+
+
+def test_only_the_changed_source_is_reprocessed(db_session):
+    user = create_admin_user(db_session)
+    inventory_text = "1001;Bar A;VISA COOLER 330L;-1;0;RG 1;CMD-1;P1\n"
+    run_upload(
+        db_session,
+        user,
+        inventory_text,
+        incremental=False,
+        clients_text="Codigo;Nome Fantasia;Setor\n1001;Bar A;Centro\n",
+    )
+    batch_id = active_batch_id(db_session)
+    item_ids = [row[0] for row in db_session.query(PickupCatalogInventoryItem.id)]
+
+    # 02.02.20 idêntico e 01.20.11 alterado: só os clientes são regravados.
+    result = run_upload(
+        db_session,
+        user,
+        inventory_text,
+        incremental=False,
+        clients_text="Codigo;Nome Fantasia;Setor\n1001;Bar A Novo;Centro\n",
+    )
+    assert result["updated_sources"] == {"clients_012011": True, "inventory_020220": False}
+    assert result["unchanged_sources"] == {"clients_012011": False, "inventory_020220": True}
+    assert result["inventory_diff"]["mode"] == "unchanged"
+    assert active_batch_id(db_session) == batch_id
+    assert [row[0] for row in db_session.query(PickupCatalogInventoryItem.id)] == item_ids
+    assert (
+        db_session.query(PickupCatalogClient.nome_fantasia)
+        .filter(PickupCatalogClient.client_code == "1001")
+        .scalar()
+        == "Bar A Novo"
+    )
+
+
+@pytest.mark.parametrize(
+    ("incremental", "expected_codes"),
+    [
+        # O 1004 continua porque o lote anterior (mantido para rollback) o referencia.
+        (False, {"1001", "1002", "1004", "1006"}),
+        # No modo incremental o lote é o mesmo e os itens do 1004 já saíram.
+        (True, {"1001", "1002", "1006"}),
+    ],
+)
+def test_unchanged_clients_file_does_not_keep_clients_from_old_inventories(db_session, incremental, expected_codes):
+    user = create_admin_user(db_session)
+    clients_text = "Codigo;Nome Fantasia;Setor\n1001;Bar A;Centro\n1002;Bar B;Centro\n"
+    run_upload(
+        db_session,
+        user,
+        "1001;Bar A;VISA COOLER 330L;-1;0;RG 1;CMD-1;P1\n1005;Bar E;VISA COOLER 330L;-1;0;RG 5;CMD-5;P1\n",
+        incremental=incremental,
+        clients_text=clients_text,
+    )
+    run_upload(
+        db_session,
+        user,
+        "1001;Bar A;VISA COOLER 330L;-1;0;RG 1;CMD-1;P1\n1004;Bar D;VISA COOLER 330L;-1;0;RG 4;CMD-4;P1\n",
+        incremental=incremental,
+        clients_text=clients_text,
+    )
+    # Sem o primeiro lote, nenhum item referencia mais o 1005.
+    reclaim_inactive_batches(db_session, keep=1)
+
+    # 01.20.11 idêntico: não é relido; os clientes mantidos são os dele (já
+    # marcados no banco) e os do 02.02.20 novo.
+    result = run_upload(
+        db_session,
+        user,
+        "1001;Bar A Loja;VISA COOLER 330L;-1;0;RG 1;CMD-1;P1\n1006;Bar F;VISA COOLER 330L;-1;0;RG 6;CMD-6;P1\n",
+        incremental=incremental,
+        clients_text=clients_text,
+    )
+    assert result["unchanged_sources"] == {"clients_012011": True, "inventory_020220": False}
+    stages = {stage["stage"] for stage in result["profile"]["stages"]}
+    # Nenhuma etapa de leitura do 01.20.11 (clients.detect_encoding, clients.read_rows...).
+    assert {stage for stage in stages if stage.startswith("clients.")} == {"clients.load_file_codes"}
+    codes = {row[0] for row in db_session.query(PickupCatalogClient.client_code)}
+    assert codes == expected_codes
+    # Os dados dos clientes do 01.20.11 continuam os do arquivo.
+    assert (
+        db_session.query(PickupCatalogClient.nome_fantasia)
+        .filter(PickupCatalogClient.client_code == "1001")
+        .scalar()
+        == "Bar A"
+    )
+
+
+def test_zip_upload_with_both_reports_matches_plain_csvs(db_session):
+    user = create_admin_user(db_session)
+    clients_text = "Codigo;Nome Fantasia;Setor\n1001;Bar A;Centro\n"
+    inventory_text = "1001;Bar A;VISA COOLER 330L;-1;0;RG 1;CMD-1;P1\n"
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as bundle:
+        bundle.writestr("relatorios/", "")
+        bundle.writestr("relatorios/Relatorio 01.20.11.csv", clients_text)
+        bundle.writestr("relatorios/Relatorio 02.02.20.csv", INVENTORY_HEADER + inventory_text)
+    zip_upload = UploadFile(
+        file=io.BytesIO(archive.getvalue()),
+        filename="base.zip",
+        headers=Headers({"content-type": "application/zip"}),
+    )
+
+    # O .zip vai no campo do 02.02.20, mas os membros são separados pelo nome.
+    submitted = asyncio.run(
+        upload_csv(
+            clients_csv=None,
+            inventory_csv=zip_upload,
+            incremental=False,
+            dry_run=False,
+            db=db_session,
+            current_user=user,
+        )
+    )
+    assert submitted.clients_file_name == "Relatorio 01.20.11.csv"
+    assert submitted.inventory_file_name == "Relatorio 02.02.20.csv"
+    job = wait_for_import_job(submitted.id)
+    assert job is not None and job.status == "concluida", job and job.error
+    db_session.expire_all()
+    assert inventory_snapshot(db_session) == [("1001", "VISA COOLER 330L", 1, "RG 1")]
+
+    # O hash é do conteúdo descomprimido: os mesmos CSVs soltos não mudam nada.
+    result = run_upload(db_session, user, inventory_text, incremental=False, clients_text=clients_text)
+    assert result["unchanged_sources"] == {"clients_012011": True, "inventory_020220": True}
+
+
+def test_dry_run_reports_diff_and_problems_without_writing(db_session):
+    user = create_admin_user(db_session)
+    base_text = "1001;Bar A;VISA COOLER 330L;-1;0;RG 1;CMD-1;P1\n"
+    run_upload(db_session, user, base_text, incremental=False)
+    batch_id = active_batch_id(db_session)
+    snapshot = inventory_snapshot(db_session)
+
+    submitted = submit_upload(
+        db_session,
+        user,
+        base_text + "1002;Bar B;PECA AVULSA;-1;0;RG 1;CMD-2;P2\n",
+        incremental=False,
+        clients_text="Codigo;Nome Fantasia;Setor\n1001;Bar A;Centro\n",
+        dry_run=True,
+    )
+    assert submitted.dry_run is True
+    job = wait_for_import_job(submitted.id)
+    assert job.status == "concluida", job.error
+    result = get_import_job(submitted.id, db=db_session, current_user=user).result
+
+    assert result["dry_run"] is True
+    assert result["inventory_diff"] == {"mode": "dry_run", "inserted": 1, "updated": 0, "deleted": 0, "unchanged": 1}
+    assert result["stats"] == {"clients_count": 2, "inventory_clients": 2, "open_items": 2}
+    assert result["problems_total"] == 3
+    assert result["problems"] == [
+        "Cliente 1002 do 02.02.20 não consta no 01.20.11.",
+        "Registro 2 do 02.02.20: item não classificado (PECA AVULSA).",
+        "Registro 2 do 02.02.20: RG RG 1 repetido (Registro 1 do 02.02.20).",
+    ]
+
+    # Nada foi gravado: mesmo lote ativo, mesmos itens, nenhum cliente novo.
+    db_session.expire_all()
+    assert active_batch_id(db_session) == batch_id
+    assert inventory_snapshot(db_session) == snapshot
+    assert db_session.query(PickupCatalogClient).filter(PickupCatalogClient.client_code == "1002").count() == 0
+    assert len(list_upload_batches(db=db_session, current_user=user)) == 1
+
+
+def test_cli_imports_local_files_in_commit_chunks(db_session, tmp_path, capsys):
+    inventory_file = tmp_path / "020220.csv"
+    inventory_file.write_text(
+        INVENTORY_HEADER
+        + "".join(f"{1000 + idx};Bar {idx};VISA COOLER 330L;-1;0;RG {idx};CMD-{idx};P1\n" for idx in range(5)),
+        encoding="utf-8",
+    )
+
+    assert cli_main(["catalog-import", "--inventory", str(inventory_file), "--commit-rows", "2"]) == 0
+    output = capsys.readouterr()
+    assert "gravando: 2/5 itens" in output.err
+    assert "gravando: 5/5 itens" in output.err
+    assert "itens em aberto: 5" in output.out
+
+    db_session.expire_all()
+    assert len(inventory_snapshot(db_session)) == 5
+    batch = list_upload_batches(db=db_session, current_user=create_admin_user(db_session))[0]
+    assert batch.inventory_file_name == "020220.csv"
+
+    # Mesmo arquivo de novo: nada a reprocessar.
+    assert cli_main(["catalog-import", "--inventory", str(inventory_file)]) == 0
+    assert "Nada foi reprocessado" in capsys.readouterr().out
+
+
+def test_import_profile_reports_peak_memory_when_tracing(db_session):
+    result = import_pickup_catalog(
+        db_session,
+        inventory_source=(INVENTORY_HEADER + "1001;Bar A;VISA COOLER 330L;-1;0;RG 1;CMD-1;P1\n").encode("utf-8"),
+        inventory_file_name="020220.csv",
+        trace_memory=True,
+    )
+    assert result["profile"]["trace_memory"] is True
+    pipeline = next(stage for stage in result["profile"]["stages"] if stage["stage"] == "inventory.pipeline")
+    assert pipeline["peak_memory_kb"] >= 0
+    assert pipeline["cpu_ms"] >= 0
+
+
+def _catalog_state(db) -> tuple[list[tuple], list[tuple]]:
+    clients = db.query(PickupCatalogClient.client_code, PickupCatalogClient.nome_fantasia, PickupCatalogClient.setor)
+    return sorted(tuple(row) for row in clients), sorted(inventory_snapshot(db))
+
+
+def test_pipelined_snapshot_matches_sequential_import(db_session, monkeypatch):
+    # Blocos de 2 linhas: o mesmo cliente aparece em vários blocos e o
+    # snapshot dele só vale no primeiro, como no merge do arquivo inteiro.
+    monkeypatch.setattr("app.services.pickup_catalog_import.PICKUP_CATALOG_PIPELINE_CHUNK_ROWS", 2)
+    monkeypatch.setattr("app.services.pickup_catalog_import.PICKUP_CATALOG_PIPELINE_QUEUE_CHUNKS", 1)
+    clients_csv = "Codigo;Nome Fantasia;Setor\n1001;;101\n1009;Bar Sem Itens;102\n".encode("utf-8")
+    inventory_csv = (
+        INVENTORY_HEADER
+        + "1001;Bar A;VISA COOLER 330L;-1;0;RG 1;CMD-1;P1\n"
+        + "1002;Bar B;CJ DE MESA;-1;0;;CMD-2;P3\n"
+        + "1001;Bar A Outro Nome;CAIXA 600ML;-2;0;;CMD-1;P2\n"
+        + "1003;Bar C;CAIXA 600ML;0;0;;CMD-3;P2\n"
+        + "1002;Bar B;CAIXA 600ML;-3;0;;CMD-2;P2\n"
+    ).encode("utf-8")
+
+    results = {}
+    states = {}
+    for pipeline in (False, True):
+        monkeypatch.setattr("app.services.pickup_catalog_import.PICKUP_CATALOG_IMPORT_PIPELINE", pipeline)
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+        results[pipeline] = import_pickup_catalog(
+            db_session,
+            clients_source=clients_csv,
+            inventory_source=inventory_csv,
+            commit_rows=1,
+        )
+        db_session.expire_all()
+        states[pipeline] = _catalog_state(db_session)
+
+    assert states[True] == states[False]
+    assert states[True][0] == [
+        ("1001", "Bar A", "101"),
+        ("1002", "Bar B", ""),
+        ("1009", "Bar Sem Itens", "102"),
+    ]
+    assert results[True]["stats"] == results[False]["stats"] == {
+        "clients_count": 3,
+        "inventory_clients": 2,
+        "open_items": 4,
+    }
+    assert results[True]["inventory_diff"] == results[False]["inventory_diff"]
+
+
+def test_pipeline_queues_are_bounded_and_errors_reach_the_consumer():
+    produced = []
+
+    def producer():
+        for number in range(10000):
+            produced.append(number)
+            yield number
+
+    # O consumidor para no primeiro bloco: com filas de 1, a leitura não avança
+    # mais que alguns blocos além dele.
+    with pytest.raises(RuntimeError, match="consumidor"):
+        with run_pipeline(
+            ("ler", producer()),
+            [("dobrar", lambda number: number * 2)],
+            queue_chunks=1,
+            consumer_name="gravar",
+        ) as chunks:
+            for chunk in chunks:
+                assert chunk == 0
+                time.sleep(0.2)
+                raise RuntimeError("falha no consumidor")
+    assert len(produced) <= 5
+
+    def failing_stage(number):
+        if number == 3:
+            raise ValueError("linha inválida")
+        return number
+
+    with pytest.raises(ValueError, match="linha inválida"):
+        with run_pipeline(
+            ("ler", iter(range(100))),
+            [("validar", failing_stage)],
+            queue_chunks=2,
+            consumer_name="gravar",
+        ) as chunks:
+            for _ in chunks:
+                pass
+
+
+def test_pipeline_failure_discards_the_new_batch_and_stops_workers(db_session, monkeypatch):
+    monkeypatch.setattr("app.services.pickup_catalog_import.PICKUP_CATALOG_PIPELINE_CHUNK_ROWS", 1)
+    monkeypatch.setattr("app.services.pickup_catalog_import.PICKUP_CATALOG_PIPELINE_QUEUE_CHUNKS", 1)
+    user = create_admin_user(db_session)
+    run_upload(db_session, user, "1001;Bar A;VISA COOLER 330L;-1;0;RG 1;CMD-1;P1\n", incremental=False)
+    batch_id = active_batch_id(db_session)
+    snapshot = inventory_snapshot(db_session)
+    clients_before = sorted(db_session.query(PickupCatalogClient.client_code, PickupCatalogClient.nome_fantasia))
+    threads_before = threading.active_count()
+
+    inserts = []
+
+    def failing_insert(db, rows):
+        inserts.append(len(rows))
+        if len(inserts) == 3:
+            raise RuntimeError("falha simulada na gravação")
+        insert_inventory_items(db, rows)
+
+    monkeypatch.setattr("app.services.pickup_catalog_import.insert_inventory_items", failing_insert)
+    inventory_csv = INVENTORY_HEADER + "".join(
+        f"{1000 + idx};Bar {idx};CAIXA 600ML;-1;0;;CMD-{idx};P2\n" for idx in range(50)
+    )
+    with pytest.raises(RuntimeError, match="falha simulada"):
+        import_pickup_catalog(db_session, inventory_source=inventory_csv.encode("utf-8"), commit_rows=1)
+
+    # Lote parcial removido, lote ativo intacto e as threads do pipeline encerradas.
+    db_session.expire_all()
+    assert active_batch_id(db_session) == batch_id
+    assert inventory_snapshot(db_session) == snapshot
+    assert [row[0] for row in db_session.query(PickupCatalogUploadBatch.id)] == [batch_id]
+    assert threading.active_count() == threads_before
+    # Clientes criados pelo lote descartado saem; o existente (1001) não foi alterado.
+    clients_after = sorted(db_session.query(PickupCatalogClient.client_code, PickupCatalogClient.nome_fantasia))
+    assert clients_after == clients_before == [("1001", "Bar A")]
+
+
+def test_large_code_sets_use_joins_instead_of_in_lists(db_session):
+    # Acima do limite padrão de parâmetros do SQLite (32766) para uma lista IN.
+    codes = [str(number) for number in range(1, 40001)]
+    client_ids = upsert_clients(db_session, {code: {"nome_fantasia": f"Cliente {code}"} for code in codes})
+    db_session.commit()
+    assert len(client_ids) == len(codes)
+    assert client_ids_by_code(db_session, codes) == client_ids
+
+    referenced_id = client_ids["39999"]
+    db_session.add(PickupCatalogInventoryItem(client_id=referenced_id, description="CAIXA 600ML", open_quantity=1))
+    db_session.commit()
+
+    _purge_stale_clients(db_session, codes[:35000])
+    db_session.commit()
+
+    remaining = {code for (code,) in db_session.query(PickupCatalogClient.client_code)}
+    assert remaining == set(codes[:35000]) | {"39999"}
+
+
+def test_per_chunk_code_lookups_use_in_batches_without_temp_tables(db_session, monkeypatch):
+    monkeypatch.setattr("app.services.key_set.KEY_SET_IN_CHUNK", 50)
+    monkeypatch.setattr("app.services.key_set.KEY_SET_IN_MAX_KEYS", 500)
+    codes = [str(number) for number in range(1, 1001)]
+    client_ids = upsert_clients(db_session, {code: {"nome_fantasia": f"Cliente {code}"} for code in codes})
+    db_session.commit()
+
+    statements: list[str] = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        assert client_ids_by_code(db_session, codes[:200]) == {code: client_ids[code] for code in codes[:200]}
+        small_lookup = list(statements)
+        statements.clear()
+        assert client_ids_by_code(db_session, codes) == client_ids
+        large_lookup = list(statements)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+    if engine.dialect.name == "postgresql":
+        assert len(small_lookup) == 1 and "unnest" in small_lookup[0]
+        return
+    # Até o limite: só SELECTs com IN, um por lote de chaves.
+    assert len(small_lookup) == 4
+    assert not any("TEMPORARY" in statement.upper() for statement in small_lookup)
+    # Acima dele: uma tabela temporária para o conjunto inteiro.
+    assert sum("CREATE TEMPORARY TABLE" in statement.upper() for statement in large_lookup) == 1
+
+
+@requires_postgresql
+def test_key_set_on_postgresql_unnests_a_single_array_parameter(db_session):
+    codes = [f"PG{number}" for number in range(1, 3001)]
+    client_ids = upsert_clients(db_session, {code: {"nome_fantasia": f"Cliente {code}"} for code in codes})
+    db_session.commit()
+
+    with key_set(db_session, codes[:2000] + codes[:10]) as wanted:
+        statement = select(PickupCatalogClient.client_code).join(
+            wanted, wanted.c.key == PickupCatalogClient.client_code
+        )
+        compiled = statement.compile(dialect=engine.dialect)
+        assert "unnest" in str(compiled).lower()
+        assert len(compiled.params) == 1
+        assert sorted(code for (code,) in db_session.execute(statement)) == sorted(codes[:2000])
+
+    wanted_ids = [client_ids[code] for code in codes[:5]]
+    with key_set(db_session, wanted_ids, Integer) as wanted:
+        statement = select(PickupCatalogClient.id).join(wanted, wanted.c.key == PickupCatalogClient.id)
+        assert sorted(client_id for (client_id,) in db_session.execute(statement)) == sorted(wanted_ids)
+    assert client_ids_by_code(db_session, codes) == client_ids
+
+
+def test_copy_rows_write_none_as_unquoted_null():
+    # Campo vazio sem aspas é NULL no COPY (FORMAT csv); "" entre aspas é texto vazio.
+    assert encode_copy_rows([(7, None, "", 'TV 32"', "a,b\nc")]) == '"7",,"","TV 32""","a,b\nc"\n'
+
+
+@requires_postgresql
+def test_copy_keeps_null_and_empty_text_apart_on_postgresql(db_session):
+    client_ids = upsert_clients(db_session, {"1001": {"nome_fantasia": "Bar A"}})
+    row = {
+        "client_id": client_ids["1001"],
+        "batch_id": None,
+        "description": 'TV 32", SALA',
+        "item_type": "outro",
+        "material_bucket": None,
+        "open_quantity": 1,
+        "rg": "",
+        "rg_key": None,
+        "comodato_number": "CMD-1",
+        "invoice_issue_date": "",
+        "volume_key": None,
+        "source_baixados": -1,
+        "product_code": "P1",
+        "classifier_version": item_type_rules_version(),
+    }
+    insert_inventory_items(db_session, [row, {**row, "rg": "RG 7", "rg_key": "RG7", "batch_id": None}])
+    db_session.commit()
+
+    items = db_session.query(PickupCatalogInventoryItem).order_by(PickupCatalogInventoryItem.id).all()
+    assert [(item.batch_id, item.rg, item.rg_key, item.volume_key) for item in items] == [
+        (None, "", None, None),
+        (None, "RG 7", "RG7", None),
+    ]
+    assert items[0].description == 'TV 32", SALA'
+    assert items[0].invoice_issue_date == ""
+
+
+@requires_postgresql
+def test_code_token_copy_leaves_unused_owner_columns_null_on_postgresql(db_session):
+    client_ids = upsert_clients(db_session, {"1001": {"nome_fantasia": "Bar A"}})
+    insert_inventory_items(
+        db_session,
+        [
+            {
+                "client_id": client_ids["1001"],
+                "batch_id": None,
+                "description": "VISA COOLER 330L",
+                "item_type": "refrigerador",
+                "material_bucket": "refrigerador",
+                "open_quantity": 1,
+                "rg": 'RG "7"',
+                "rg_key": 'RG"7"',
+                "comodato_number": "CMD-1",
+                "invoice_issue_date": "",
+                "volume_key": "",
+                "source_baixados": -1,
+                "product_code": "P1",
+                "classifier_version": item_type_rules_version(),
+            }
+        ],
+    )
+    db_session.commit()
+    item_id = db_session.query(PickupCatalogInventoryItem.id).scalar()
+
+    # Tokens gravados por COPY: aspas no valor preservadas, demais donos NULL.
+    assert index_inventory_tokens(db_session, None) == 3
+    db_session.commit()
+    tokens = db_session.query(CodeToken.token, CodeToken.inventory_item_id, CodeToken.equipment_id, CodeToken.order_item_id)
+    assert set(tokens) == {
+        ('RG "7"', item_id, None, None),
+        ("RG7", item_id, None, None),
+        ("7", item_id, None, None),
+    }
@@ -0,0 +1,136 @@
+"""Benchmark da importação da base de retiradas: sequencial x pipeline.
+
+Importa o mesmo 02.02.20 sintético duas vezes, pelo caminho completo de
+``import_pickup_catalog`` (leitura, classificação e gravação de um lote novo):
+primeiro com as etapas uma depois da outra, depois em pipeline, com as três
+etapas ao mesmo tempo ligadas por filas limitadas. Mostra o tempo total e o
+pico de memória do Python (tracemalloc) de cada modo. O tempo vem de uma
+rodada sem tracemalloc, que deixa cada alocação bem mais lenta; o pico, de
+outra rodada com ele ligado.
+
+Uso (a partir de ``backend/``)::
+
+    python -m benchmarks.bench_catalog_pipeline --rows 200000
+    python -m benchmarks.bench_catalog_pipeline --rows 200000 --database-url postgresql://...
+    python -m benchmarks.bench_catalog_pipeline --rows 200000 --write-ms-per-1k 25
+
+Sem ``--database-url`` usa um SQLite temporário. O banco informado é
+recriado (drop/create das tabelas) a cada rodada. O ganho do pipeline
+aparece quando a gravação espera o banco (rede, disco); num SQLite local,
+tudo disputa o mesmo núcleo de CPU. ``--write-ms-per-1k`` soma uma espera
+(sem CPU, como a resposta de um PostgreSQL remoto) a cada gravação de itens,
+proporcional ao número de linhas, para medir a sobreposição localmente.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app.database.base import Base  # noqa: E402
+from app.models.pickup_catalog import PickupCatalogInventoryItem  # noqa: E402
+from app.services import pickup_catalog_import  # noqa: E402
+
+INVENTORY_HEADER = "Código;Nome Fantasia;Descrição;Baixados;Saldo;Nro Serie Mercadoria;Nro Comodato;Codigo Produto\n"
+DESCRIPTIONS = ("VISA COOLER 330L", "CAIXA 600ML", "CJ DE MESA", "CAIXA TERMICA 20L", "PECA AVULSA")
+
+
+def build_inventory_csv(rows: int, path: Path) -> None:
+    client_count = max(1, rows // 4)
+    with path.open("w", encoding="utf-8") as handle:
+        handle.write(INVENTORY_HEADER)
+        for idx in range(rows):
+            code = idx % client_count + 1
+            description = DESCRIPTIONS[idx % len(DESCRIPTIONS)]
+            # Uma linha em cada cinco está quitada e é descartada no parse.
+            baixados = 0 if idx % 5 == 4 else -(1 + idx % 3)
+            handle.write(f"{code};Bar {code};{description};{baixados};0;RG {idx};CMD-{idx % 997};P{idx % 50}\n")
+
+
+def _slow_writes(write_ms_per_1k: float):
+    insert_items = pickup_catalog_import.insert_inventory_items
+
+    def insert_inventory_items(db, rows):
+        time.sleep(write_ms_per_1k * len(rows) / 1_000_000)
+        insert_items(db, rows)
+
+    return insert_inventory_items
+
+
+def timed_round(
+    database_url: str,
+    inventory_path: Path,
+    pipeline: bool,
+    write_ms_per_1k: float = 0.0,
+    trace: bool = False,
+) -> tuple[float, int, int]:
+    engine = create_engine(database_url)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    previous = pickup_catalog_import.PICKUP_CATALOG_IMPORT_PIPELINE
+    previous_insert = pickup_catalog_import.insert_inventory_items
+    pickup_catalog_import.PICKUP_CATALOG_IMPORT_PIPELINE = pipeline
+    if write_ms_per_1k:
+        pickup_catalog_import.insert_inventory_items = _slow_writes(write_ms_per_1k)
+    if trace:
+        tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        pickup_catalog_import.import_pickup_catalog(
+            db,
+            inventory_source=inventory_path,
+            inventory_file_name=inventory_path.name,
+            trace_memory=False,
+        )
+        seconds = time.perf_counter() - started
+        peak_bytes = tracemalloc.get_traced_memory()[1] if trace else 0
+        items = db.query(PickupCatalogInventoryItem).count()
+        return seconds, peak_bytes, items
+    finally:
+        tracemalloc.stop()
+        pickup_catalog_import.PICKUP_CATALOG_IMPORT_PIPELINE = previous
+        pickup_catalog_import.insert_inventory_items = previous_insert
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+        engine.dispose()
+
+
+def run(rows: int, database_url: str | None, write_ms_per_1k: float = 0.0) -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        inventory_path = Path(tmp_dir) / "020220.csv"
+        build_inventory_csv(rows, inventory_path)
+        url = database_url or f"sqlite:///{(Path(tmp_dir) / 'bench_catalog_pipeline.db').as_posix()}"
+        serial_seconds, _, serial_items = timed_round(url, inventory_path, False, write_ms_per_1k)
+        pipeline_seconds, _, pipeline_items = timed_round(url, inventory_path, True, write_ms_per_1k)
+        serial_peak = timed_round(url, inventory_path, False, write_ms_per_1k, trace=True)[1]
+        pipeline_peak = timed_round(url, inventory_path, True, write_ms_per_1k, trace=True)[1]
+
+    assert serial_items == pipeline_items
+    latency = f" | espera na gravação: {write_ms_per_1k:g} ms/1000 itens" if write_ms_per_1k else ""
+    print(f"banco: {url.split(':', 1)[0]} | linhas: {rows} | itens gravados: {pipeline_items}{latency}")
+    print(f"antes  (sequencial): {serial_seconds:.2f}s | pico {serial_peak / (1024 * 1024):.0f} MB")
+    print(f"depois (pipeline):   {pipeline_seconds:.2f}s | pico {pipeline_peak / (1024 * 1024):.0f} MB")
+    print(f"ganho: {serial_seconds / pipeline_seconds:.2f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--write-ms-per-1k", type=float, default=0.0)
+    args = parser.parse_args()
+    run(args.rows, args.database_url, args.write_ms_per_1k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Benchmark da fase de gravação da importação da base de retiradas.
+
+Compara a gravação antiga (um objeto ORM por cliente e por item, com flush
+extra para clientes novos) com o escritor em massa de
+``app.services.pickup_catalog_bulk`` (COPY/ON CONFLICT no PostgreSQL,
+executemany via Core nos demais bancos). Só a escrita é medida; o parse
+do CSV fica fora do tempo.
+
+Uso (a partir de ``backend/``)::
+
+    python -m benchmarks.bench_catalog_write --rows 120000
+    python -m benchmarks.bench_catalog_write --rows 120000 --database-url postgresql://...
+
+Sem ``--database-url`` usa um SQLite temporário. O banco informado é
+recriado (drop/create das tabelas) a cada rodada.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app.database.base import Base  # noqa: E402
+from app.models.pickup_catalog import (  # noqa: E402
+    PickupCatalogClient,
+    PickupCatalogInventoryItem,
+    PickupCatalogUploadBatch,
+)
+from app.services.pickup_catalog_bulk import insert_inventory_items, upsert_clients  # noqa: E402
+from app.services.pickup_catalog_csv import CLIENT_FORM_FIELDS  # noqa: E402
+from app.services.pickup_catalog_import import INVENTORY_ITEM_VALUE_FIELDS  # noqa: E402
+
+
+def build_dataset(rows: int) -> tuple[dict[str, dict[str, str]], dict[str, list[dict[str, Any]]]]:
+    clients: dict[str, dict[str, str]] = {}
+    inventory: dict[str, list[dict[str, Any]]] = {}
+    client_count = max(1, rows // 3)
+    for idx in range(rows):
+        code = str(idx % client_count + 1)
+        clients.setdefault(code, {field: f"{field} {code}" for field in CLIENT_FORM_FIELDS})
+        inventory.setdefault(code, []).append({
+            "description": f"VISA COOLER {idx % 7}",
+            "item_type": "refrigerador",
+            "open_quantity": 1 + idx % 3,
+            "rg": f"RG {idx}",
+            "comodato_number": f"CMD {idx % 997}",
+            "invoice_issue_date": "01/01/2024",
+            "volume_key": "",
+            "source_baixados": -1,
+            "product_code": f"P{idx % 50}",
+            "classifier_version": 1,
+        })
+    return clients, inventory
+
+
+def write_with_orm(db, clients, inventory) -> None:
+    batch = PickupCatalogUploadBatch()
+    db.add(batch)
+    db.flush()
+    models: dict[str, PickupCatalogClient] = {}
+    for code, payload in clients.items():
+        model = PickupCatalogClient(client_code=code)
+        for field in CLIENT_FORM_FIELDS:
+            if field != "client_code":
+                setattr(model, field, payload[field])
+        db.add(model)
+        models[code] = model
+    db.flush()
+    for code, items in inventory.items():
+        for item in items:
+            db.add(PickupCatalogInventoryItem(client_id=models[code].id, batch_id=batch.id, **item))
+    db.commit()
+
+
+def write_in_bulk(db, clients, inventory) -> None:
+    batch = PickupCatalogUploadBatch()
+    db.add(batch)
+    db.flush()
+    client_ids = upsert_clients(db, clients)
+    insert_inventory_items(
+        db,
+        [
+            {"client_id": client_ids[code], "batch_id": batch.id, **{field: item[field] for field in INVENTORY_ITEM_VALUE_FIELDS}}
+            for code, items in inventory.items()
+            for item in items
+        ],
+    )
+    db.commit()
+
+
+def timed_round(database_url: str, writer, clients, inventory) -> float:
+    engine = create_engine(database_url)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    try:
+        started = time.perf_counter()
+        writer(db, clients, inventory)
+        seconds = time.perf_counter() - started
+        assert db.query(PickupCatalogInventoryItem).count() == sum(len(items) for items in inventory.values())
+        return seconds
+    finally:
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+        engine.dispose()
+
+
+def run(rows: int, database_url: str | None) -> None:
+    clients, inventory = build_dataset(rows)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        url = database_url or f"sqlite:///{(Path(tmp_dir) / 'bench_catalog_write.db').as_posix()}"
+        orm_seconds = timed_round(url, write_with_orm, clients, inventory)
+        bulk_seconds = timed_round(url, write_in_bulk, clients, inventory)
+
+    print(f"banco: {url.split(':', 1)[0]} | itens: {rows} | clientes: {len(clients)}")
+    print(f"antes  (ORM por linha):     {orm_seconds:.2f}s")
+    print(f"depois (escritor em massa): {bulk_seconds:.2f}s")
+    print(f"ganho: {orm_seconds / bulk_seconds:.1f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=120000)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+    run(args.rows, args.database_url)
+
+
+if __name__ == "__main__":
+    main()
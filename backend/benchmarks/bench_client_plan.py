@@ -0,0 +1,85 @@
+"""Micro-benchmark da extração de clientes (01.20.11) por linha.
+
+Compara a resolução de colunas por linha (aliases normalizados a cada
+chamada, como antes do plano compilado) com o plano campo -> índice
+resolvido uma vez por arquivo.
+
+Uso (a partir de ``backend/``)::
+
+    python -m benchmarks.bench_client_plan --rows 50000
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+
+from app.services.pickup_catalog_csv import (
+    CLIENT_FIELD_ALIASES,
+    _blank_client,
+    _cell,
+    _compile_client_plan,
+    _extract_client_payload_from_row,
+    _normalize_client_field,
+    _open_csv_reader,
+    _pick_column,
+    _sniff_csv_buffer,
+)
+
+HEADER = (
+    "Código;Nome Fantasia;Razão Social;CNPJ/CPF;Setor;Telefone;Endereço;"
+    "Bairro;Cidade;CEP;Inscr. Est.;Responsável"
+)
+
+
+def build_clients_csv(rows: int) -> bytes:
+    lines = [HEADER]
+    for idx in range(rows):
+        lines.append(
+            f"{idx:06d};Loja {idx};Razao {idx} LTDA;12.345.678/0001-{idx % 100:02d};"
+            f"Setor {idx % 20};(13) 99999-{idx % 10000:04d};Rua {idx}, 10;Centro;"
+            f"Registro;11900-000;ISENTO;Responsavel {idx}"
+        )
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def _extract_per_row(row: list[str], header_index: dict[str, list[int]]) -> dict[str, str]:
+    payload = _blank_client()
+    for field, aliases in CLIENT_FIELD_ALIASES.items():
+        column = _pick_column(header_index, aliases, required=False)
+        if column is not None:
+            payload[field] = _normalize_client_field(field, _cell(row, column))
+    return payload
+
+
+def run(rows: int) -> None:
+    raw = build_clients_csv(rows)
+    reader, header_index = _open_csv_reader(raw, *_sniff_csv_buffer(raw))
+    data_rows = list(reader)
+
+    started = time.perf_counter()
+    before = [_extract_per_row(row, header_index) for row in data_rows]
+    before_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    plan = _compile_client_plan(header_index)
+    after = [_extract_client_payload_from_row(row, plan) for row in data_rows]
+    after_seconds = time.perf_counter() - started
+
+    assert before == after
+    count = len(data_rows)
+    print(f"linhas: {count}")
+    print(f"antes  (aliases por linha): {before_seconds:.3f}s | {before_seconds / count * 1e6:.1f} us/linha")
+    print(f"depois (plano compilado):   {after_seconds:.3f}s | {after_seconds / count * 1e6:.1f} us/linha")
+    print(f"ganho: {before_seconds / after_seconds:.1f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50000)
+    args = parser.parse_args()
+    run(args.rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Benchmark da detecção de encoding e decodificação dos CSVs.
+
+Compara a cadeia antiga (``bytes.decode`` do arquivo inteiro tentando
+utf-8-sig, cp1252 e latin-1) com a detecção incremental sobre mmap seguida
+de uma única decodificação em blocos. Gera duas fixtures no diretório
+temporário: UTF-8 com acentos ao longo do arquivo e cp1252 quase todo ASCII
+com um único byte acentuado perto do fim (o pior caso da cadeia antiga).
+
+Uso (a partir de ``backend/``)::
+
+    python -m benchmarks.bench_csv_decode --mb 100
+"""
+
+from __future__ import annotations
+
+import argparse
+import codecs
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+
+from app.services.csv_source import (
+    CSV_DECODE_CHUNK_BYTES,
+    detect_csv_encoding,
+    iter_csv_lines,
+    open_csv_buffer,
+)
+
+LINE = "000123;Bar do Ze;VISA COOLER 330L;-1;0;RG 123456;CMD-1\n"
+ACCENTED_LINE = "000123;Bar do Zé;CAIXA TÉRMICA 50L;-1;0;Açaí;CMD-1\n"
+
+
+def build_fixtures(target_dir: Path, size_mb: int) -> dict[str, Path]:
+    target_bytes = size_mb * 1024 * 1024
+    utf8_path = target_dir / "bench_utf8.csv"
+    cp1252_path = target_dir / "bench_cp1252.csv"
+
+    block = (LINE * 9 + ACCENTED_LINE) * 2000
+    encoded = block.encode("utf-8")
+    with utf8_path.open("wb") as handle:
+        for _ in range(max(1, target_bytes // len(encoded))):
+            handle.write(encoded)
+
+    ascii_block = (LINE * 20000).encode("cp1252")
+    with cp1252_path.open("wb") as handle:
+        for _ in range(max(1, target_bytes // len(ascii_block))):
+            handle.write(ascii_block)
+        handle.write(ACCENTED_LINE.encode("cp1252"))
+        handle.write(ascii_block[:4096])
+    return {"utf-8": utf8_path, "cp1252": cp1252_path}
+
+
+def decode_full_chain(path: Path) -> tuple[str, int]:
+    raw = path.read_bytes()
+    for encoding in ("utf-8-sig", "cp1252", "latin-1"):
+        try:
+            return encoding, len(raw.decode(encoding))
+        except UnicodeDecodeError:
+            continue
+    raise AssertionError("latin-1 decodifica qualquer byte")
+
+
+def decode_incremental(path: Path) -> tuple[str, int]:
+    with open_csv_buffer(path) as buffer:
+        encoding = detect_csv_encoding(buffer)
+        decoder = codecs.getincrementaldecoder(encoding)()
+        total = 0
+        for offset in range(0, len(buffer), CSV_DECODE_CHUNK_BYTES):
+            total += len(decoder.decode(buffer[offset:offset + CSV_DECODE_CHUNK_BYTES]))
+        return encoding, total + len(decoder.decode(b"", final=True))
+
+
+def decode_incremental_lines(path: Path) -> tuple[str, int]:
+    # Inclui a quebra em linhas que o csv.reader consome (antes feita pelo StringIO).
+    with open_csv_buffer(path) as buffer:
+        encoding = detect_csv_encoding(buffer)
+        return encoding, sum(len(line) for line in iter_csv_lines(buffer, encoding))
+
+
+def measure(func: Callable[[Path], tuple[str, int]], path: Path) -> tuple[tuple[str, int], float, int]:
+    started = time.perf_counter()
+    result = func(path)
+    seconds = time.perf_counter() - started
+
+    tracemalloc.start()
+    func(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def run(size_mb: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fixtures = build_fixtures(Path(tmp_dir), size_mb)
+        for label, path in fixtures.items():
+            before, before_seconds, before_peak = measure(decode_full_chain, path)
+            after, after_seconds, after_peak = measure(decode_incremental, path)
+            lines, lines_seconds, lines_peak = measure(decode_incremental_lines, path)
+            assert before == after == lines, (before, after, lines)
+
+            size = path.stat().st_size / (1024 * 1024)
+            print(f"{label} ({size:.0f} MB, encoding detectado: {after[0]})")
+            print(f"  antes  (decode completo por tentativa): {before_seconds:.2f}s | pico {before_peak / 2**20:.0f} MB")
+            print(f"  depois (detecção incremental + blocos):  {after_seconds:.2f}s | pico {after_peak / 2**20:.0f} MB")
+            print(f"  depois + quebra em linhas:              {lines_seconds:.2f}s | pico {lines_peak / 2**20:.0f} MB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mb", type=int, default=100)
+    args = parser.parse_args()
+    run(args.mb)
+
+
+if __name__ == "__main__":
+    main()
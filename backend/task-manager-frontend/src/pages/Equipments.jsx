@@ -2085,7 +2085,7 @@ const EquipmentPage = () => {
                   <input
                     ref={bulkImportInputRef}
                     type="file"
-                    accept=".csv,text/csv"
+                    accept=".csv,.gz,.zip,text/csv,application/gzip,application/zip"
                     onChange={handleBulkImportFileChange}
                     style={{ display: 'none' }}
                   />
@@ -3,6 +3,8 @@ import {
   Alert,
   Box,
   Button,
+  Checkbox,
+  FormControlLabel,
   Typography,
 } from '@mui/material';
 import { useNavigate } from 'react-router-dom';
@@ -12,7 +14,31 @@ import { hasPermission } from '../utils/auth';
 
 const MAX_CSV_UPLOAD_MB = 200;
 const MAX_CSV_UPLOAD_BYTES = MAX_CSV_UPLOAD_MB * 1024 * 1024;
-const ACCEPTED_UPLOAD_EXTENSIONS = ['.csv', '.txt'];
+const ACCEPTED_UPLOAD_EXTENSIONS = ['.csv', '.txt', '.xlsx', '.gz', '.zip'];
+const IMPORT_JOB_POLL_INTERVAL_MS = 1500;
+const IMPORT_JOB_FINAL_STATUSES = ['concluida', 'falhou'];
+const IMPORT_JOB_STAGE_LABELS = {
+  lendo_clientes: 'lendo 01.20.11',
+  lendo_itens: 'lendo 02.02.20',
+  gravando: 'gravando na base',
+  removendo_lotes_antigos: 'removendo lotes antigos',
+  concluida: 'concluída',
+};
+
+const wait = (ms) => new Promise((resolve) => { setTimeout(resolve, ms); });
+
+const describeImportJob = (job) => {
+  if (!job) {
+    return '';
+  }
+  if (job.status === 'na_fila') {
+    return 'Importação na fila. Aguardando a importação anterior terminar...';
+  }
+  const stage = IMPORT_JOB_STAGE_LABELS[job.stage] || 'iniciando';
+  const rows = Number(job.rows_processed || 0).toLocaleString('pt-BR');
+  const throughput = Number(job.rows_per_second || 0).toLocaleString('pt-BR');
+  return `Importando (${stage}): ${rows} linhas lidas, ${throughput} linhas/s.`;
+};
 
 const formatFileSize = (bytes) => {
   const normalized = Number(bytes || 0);
@@ -35,7 +61,7 @@ const validateUploadFile = (file, label) => {
 
   const normalizedName = String(file.name || '').trim().toLowerCase();
   if (!ACCEPTED_UPLOAD_EXTENSIONS.some((extension) => normalizedName.endsWith(extension))) {
-    return `${label} deve estar em formato CSV ou TXT.`;
+    return `${label} deve estar em formato CSV, TXT ou XLSX (ou .gz/.zip).`;
   }
 
   if ((Number(file.size) || 0) > MAX_CSV_UPLOAD_BYTES) {
@@ -55,8 +81,12 @@ const PickupsDataUpload = () => {
   const [clientsFile, setClientsFile] = useState(null);
   const [inventoryFile, setInventoryFile] = useState(null);
   const [uploading, setUploading] = useState(false);
+  const [incrementalUpload, setIncrementalUpload] = useState(false);
+  const [dryRun, setDryRun] = useState(false);
+  const [problems, setProblems] = useState([]);
   const [error, setError] = useState('');
   const [success, setSuccess] = useState('');
+  const [jobProgress, setJobProgress] = useState('');
 
   const panelSx = {
     backgroundColor: 'var(--surface)',
@@ -119,6 +149,7 @@ const PickupsDataUpload = () => {
     event.preventDefault();
     setError('');
     setSuccess('');
+    setProblems([]);
 
     if (!clientsFile && !inventoryFile) {
       setError('Envie pelo menos um CSV: 01.20.11 ou 02.02.20.');
@@ -147,13 +178,41 @@ const PickupsDataUpload = () => {
 
     try {
       setUploading(true);
-      const response = await api.post('/pickup-catalog/upload-csv', formData, {
+      const submitted = await api.post('/pickup-catalog/upload-csv', formData, {
         headers: { 'Content-Type': 'multipart/form-data' },
+        params: { incremental: incrementalUpload, dry_run: dryRun },
       });
 
-      const stats = response?.data?.stats || {};
-      const baseMessage = String(response?.data?.message || 'Base atualizada.').trim();
-      const message = `${baseMessage} Clientes: ${stats.clients_count || 0}, clientes com itens: ${stats.inventory_clients || 0}, itens em aberto: ${stats.open_items || 0}.`;
+      // A importação roda em segundo plano; acompanha o job até terminar.
+      let job = submitted?.data;
+      setJobProgress(describeImportJob(job));
+      while (job && !IMPORT_JOB_FINAL_STATUSES.includes(job.status)) {
+        await wait(IMPORT_JOB_POLL_INTERVAL_MS);
+        const polled = await api.get(`/pickup-catalog/import-jobs/${job.id}`);
+        job = polled?.data;
+        setJobProgress(describeImportJob(job));
+      }
+
+      if (job?.status !== 'concluida') {
+        setError(job?.error || 'Erro ao atualizar a base de retiradas.');
+        return;
+      }
+
+      const result = job.result || {};
+      const stats = result.stats || {};
+      const diff = result.inventory_diff;
+      const baseMessage = String(result.message || 'Base atualizada.').trim();
+      let message = `${baseMessage} Clientes: ${stats.clients_count || 0}, clientes com itens: ${stats.inventory_clients || 0}, itens em aberto: ${stats.open_items || 0}.`;
+      if (diff?.mode === 'incremental' || diff?.mode === 'dry_run') {
+        message += ` Alterações nos itens: ${diff.inserted || 0} novos, ${diff.updated || 0} atualizados, ${diff.deleted || 0} removidos, ${diff.unchanged || 0} sem mudança.`;
+      }
+      if (result.dry_run) {
+        // Validação: mantém os arquivos selecionados para o envio definitivo.
+        message += ` Problemas encontrados: ${result.problems_total || 0}.`;
+        setProblems(Array.isArray(result.problems) ? result.problems : []);
+        setSuccess(message);
+        return;
+      }
       setSuccess(message);
       clearSelectedFiles();
       await loadStatus();
@@ -162,6 +221,7 @@ const PickupsDataUpload = () => {
       setError(typeof detail === 'string' ? detail : 'Erro ao atualizar a base de retiradas.');
     } finally {
       setUploading(false);
+      setJobProgress('');
     }
   };
 
@@ -182,6 +242,16 @@ const PickupsDataUpload = () => {
 
       {error && <Alert severity="error">{error}</Alert>}
       {success && <Alert severity="success">{success}</Alert>}
+      {jobProgress && <Alert severity="info">{jobProgress}</Alert>}
+      {problems.length > 0 && (
+        <Alert severity="warning">
+          <Box component="ul" sx={{ m: 0, pl: 2 }}>
+            {problems.map((problem) => (
+              <li key={problem}>{problem}</li>
+            ))}
+          </Box>
+        </Alert>
+      )}
 
       <Box sx={panelSx}>
         <Typography variant="subtitle1" sx={{ mb: 1 }}>Carga diária de CSV</Typography>
@@ -189,7 +259,7 @@ const PickupsDataUpload = () => {
           Envie 01.20.11 (clientes), 02.02.20 (itens emprestados) ou ambos no mesmo envio.
         </Typography>
         <Typography variant="caption" color="text.secondary" sx={{ display: 'block', mb: 2 }}>
-          Limite por arquivo: {MAX_CSV_UPLOAD_MB} MB. Formatos aceitos: .csv e .txt.
+          Limite por arquivo: {MAX_CSV_UPLOAD_MB} MB. Formatos aceitos: .csv, .txt e .xlsx (primeira aba), também em .gz ou .zip. Um .zip pode trazer os dois arquivos (012011 e 020220 no nome).
         </Typography>
 
         <Box component="form" onSubmit={handleSubmit} sx={{ display: 'grid', gap: 1.5 }}>
@@ -198,7 +268,7 @@ const PickupsDataUpload = () => {
             <input
               ref={clientsFileInputRef}
               type="file"
-              accept=".csv,.txt,text/csv,text/plain"
+              accept=".csv,.txt,.xlsx,.gz,.zip,text/csv,text/plain,application/vnd.openxmlformats-officedocument.spreadsheetml.sheet,application/gzip,application/zip"
               onChange={handleFileSelection(setClientsFile, 'CSV 01.20.11')}
               style={{
                 width: '100%',
@@ -220,7 +290,7 @@ const PickupsDataUpload = () => {
             <input
               ref={inventoryFileInputRef}
               type="file"
-              accept=".csv,.txt,text/csv,text/plain"
+              accept=".csv,.txt,.xlsx,.gz,.zip,text/csv,text/plain,application/vnd.openxmlformats-officedocument.spreadsheetml.sheet,application/gzip,application/zip"
               onChange={handleFileSelection(setInventoryFile, 'CSV 02.02.20')}
               style={{
                 width: '100%',
@@ -237,9 +307,31 @@ const PickupsDataUpload = () => {
             </Typography>
           </Box>
 
+          <FormControlLabel
+            control={(
+              <Checkbox
+                checked={incrementalUpload}
+                onChange={(event) => setIncrementalUpload(event.target.checked)}
+                disabled={uploading}
+              />
+            )}
+            label="Atualização incremental (grava apenas os itens alterados do 02.02.20)"
+          />
+
+          <FormControlLabel
+            control={(
+              <Checkbox
+                checked={dryRun}
+                onChange={(event) => setDryRun(event.target.checked)}
+                disabled={uploading}
+              />
+            )}
+            label="Somente validar (confere os arquivos sem gravar nada)"
+          />
+
           <Box sx={{ display: 'flex', gap: 1, flexWrap: 'wrap' }}>
             <Button type="submit" variant="contained" disabled={uploading}>
-              {uploading ? 'Atualizando...' : 'Atualizar base'}
+              {uploading ? (dryRun ? 'Validando...' : 'Atualizando...') : (dryRun ? 'Validar arquivos' : 'Atualizar base')}
             </Button>
             <Button type="button" variant="outlined" disabled={uploading} onClick={loadStatus}>
               Atualizar status